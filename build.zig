@@ -60,6 +60,29 @@ pub fn build(b: *std.Build) void {
         test_exe_step.dependOn(&exe_install.step);
     }
 
+    // Bench.
+    {
+        const bench = b.addExecutable(.{
+            .name = "bench",
+            .root_source_file = b.path("src/bench.zig"),
+            .target = target,
+            .optimize = std.builtin.OptimizeMode.ReleaseFast,
+        });
+        bench.root_module.addImport("lmdb", lmdb.module("lmdb"));
+        bench.root_module.addImport("toml", toml.module("zig-toml"));
+        bench.linkLibC();
+
+        const run_bench = b.addRunArtifact(bench);
+        run_bench.has_side_effects = true;
+        if (b.args) |args| {
+            run_bench.addArgs(args);
+        }
+
+        // A command step to build and run the benchmarks, always optimised.
+        const bench_step = b.step("bench", "Run benchmarks");
+        bench_step.dependOn(&run_bench.step);
+    }
+
     // List tests.
     {
         const list_tests = b.addTest(.{
@@ -0,0 +1,124 @@
+//! Benchmarks of the brillig execute loop variants. Run with `zig build bench`.
+//! Any arguments are paths to txe test artifacts to also bench, e.g. `zig build bench -- target/tests/test_foo.json`.
+const std = @import("std");
+const bvm = @import("bvm/package.zig");
+const cvm_execute = @import("cvm/execute.zig");
+const txe_pkg = @import("txe/package.zig");
+const Txe = txe_pkg.Txe;
+
+const BrilligVm = bvm.BrilligVm;
+const ExecuteOptions = bvm.brillig_vm.ExecuteOptions;
+const BrilligVmHooks = bvm.brillig_vm.BrilligVmHooks;
+
+// Each bench takes the best of this many runs.
+const runs = 5;
+
+pub fn main() !void {
+    var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
+    const allocator = arena.allocator();
+    defer arena.deinit();
+
+    try benchLoop(allocator);
+    try benchSimpleTest();
+
+    var args = try std.process.argsWithAllocator(allocator);
+    _ = args.skip();
+    while (args.next()) |artifact_path| {
+        try benchTxe(allocator, artifact_path);
+    }
+}
+
+fn report(name: []const u8, best_ns: u64, ops: ?u64) void {
+    if (ops) |n| {
+        std.debug.print("{s:<24} {d:>10}us {d:>8.2}ns/op\n", .{
+            name,
+            best_ns / 1000,
+            @as(f64, @floatFromInt(best_ns)) / @as(f64, @floatFromInt(n)),
+        });
+    } else {
+        std.debug.print("{s:<24} {d:>10}us\n", .{ name, best_ns / 1000 });
+    }
+}
+
+/// A tight counting loop in each loop variant, which shows the per opcode cost of each feature.
+fn benchLoop(allocator: std.mem.Allocator) !void {
+    std.debug.print("counting loop:\n", .{});
+    var opcodes = bvm.test_programs.countingLoop(1 << 22);
+    var code = try bvm.Bytecode.init(allocator, &opcodes);
+    defer code.deinit();
+    var fc_handler = try bvm.foreign_call.Dispatcher.init(allocator);
+    defer fc_handler.deinit();
+    var pool = bvm.MemoryPool.init(allocator, 1024, .flat);
+    defer pool.deinit();
+    var calldata = [_]u256{};
+
+    const Variant = struct { name: []const u8, options: ExecuteOptions, hooks: ?BrilligVmHooks };
+    const variants = [_]Variant{
+        .{ .name = "release", .options = .{}, .hooks = null },
+        .{ .name = "stats", .options = .{ .collect_stats = true }, .hooks = null },
+        .{ .name = "sampled", .options = .{ .sample_rate = 1000 }, .hooks = null },
+        .{ .name = "debug hooks", .options = .{}, .hooks = bvm.test_programs.noopHooks() },
+        .{ .name = "fused", .options = .{}, .hooks = null },
+    };
+    for (variants) |v| {
+        if (std.mem.eql(u8, v.name, "fused")) try code.fuse(null);
+        var best: u64 = std.math.maxInt(u64);
+        var ops: u64 = 0;
+        for (0..runs) |_| {
+            var vm = try BrilligVm.init(allocator, &calldata, fc_handler.fcDispatcher(), v.hooks, .{ .memory_pool = &pool });
+            defer vm.deinit();
+            try vm.executeVm(&code, v.options);
+            best = @min(best, vm.time_taken);
+            ops = vm.ops_executed;
+        }
+        report(v.name, best, ops);
+    }
+}
+
+/// The simple_test project, in the release, stats and fused variants.
+/// Its artifact must have been built with `nargo compile` in simple_test.
+fn benchSimpleTest() !void {
+    std.debug.print("simple_test:\n", .{});
+    const Variant = struct { name: []const u8, options: cvm_execute.ExecuteOptions };
+    const variants = [_]Variant{
+        .{ .name = "release", .options = .{ .project_path = "simple_test" } },
+        .{ .name = "stats", .options = .{ .project_path = "simple_test", .show_stats = true } },
+        .{ .name = "fused", .options = .{ .project_path = "simple_test", .fuse_brillig = true } },
+    };
+    for (variants) |v| {
+        var best: u64 = std.math.maxInt(u64);
+        for (0..runs) |_| {
+            var t = try std.time.Timer.start();
+            cvm_execute.execute(v.options) catch |err| switch (err) {
+                error.FileNotFound => {
+                    std.debug.print("skipped, run `nargo compile` in simple_test first.\n", .{});
+                    return;
+                },
+                else => return err,
+            };
+            best = @min(best, t.read());
+        }
+        report(v.name, best, null);
+    }
+}
+
+/// A txe test artifact in the release and stats variants, each run in a fresh txe.
+fn benchTxe(allocator: std.mem.Allocator, artifact_path: []const u8) !void {
+    std.debug.print("{s}:\n", .{artifact_path});
+    const Variant = struct { name: []const u8, options: txe_pkg.ExecuteOptions };
+    const variants = [_]Variant{
+        .{ .name = "release", .options = .{} },
+        .{ .name = "stats", .options = .{ .show_stats = true } },
+    };
+    for (variants) |v| {
+        var best: u64 = std.math.maxInt(u64);
+        for (0..runs) |_| {
+            const txe = try Txe.init(allocator, "data/contracts", false);
+            defer txe.deinit();
+            var t = try std.time.Timer.start();
+            try txe.execute(artifact_path, v.options);
+            best = @min(best, t.read());
+        }
+        report(v.name, best, null);
+    }
+}
@@ -7,6 +7,9 @@ pub const DeserializeError = error{
     InvalidEnumTag,
 };
 
+/// Overrides how a struct field is encoded. The field is read as src_type and parsed from hex.
+/// A src_type of void means the field isn't on the wire at all. It's derived from the others by the struct's
+/// `bincodeDerive` method, called once the rest of the struct has been deserialized.
 pub const Meta = struct {
     field: []const u8,
     src_type: type,
@@ -32,6 +35,50 @@ pub fn deserializeBuffer(comptime T: type, source: *[]const u8) T {
     return deserializeBufferImpl(T, source, false);
 }
 
+/// Like deserializeAlloc, but reads from an in-memory buffer and borrows from it where the layout allows.
+/// Slices of bytes (including the hex strings of meta fields) always alias the buffer.
+/// Slices of integers alias it when suitably aligned, or are otherwise copied in one go.
+/// The buffer must outlive the result, and borrowed slices must not be written through unless the buffer is writable.
+pub fn deserializeBufferAlloc(comptime T: type, source: *[]const u8, allocator: std.mem.Allocator) !T {
+    var reader = SliceReader{ .source = source.* };
+    defer source.* = reader.source;
+    return deserializeAllocImpl(&reader, allocator, T, false, 0);
+}
+
+/// A stream over an in-memory buffer, that can also hand out slices of it.
+pub const SliceReader = struct {
+    source: []const u8,
+
+    pub fn readInt(self: *SliceReader, comptime T: type, endian: std.builtin.Endian) error{EndOfStream}!T {
+        const n = @divExact(@typeInfo(T).int.bits, 8);
+        const bytes = try self.borrow(n);
+        return std.mem.readInt(T, bytes[0..n], endian);
+    }
+
+    pub fn readAll(self: *SliceReader, buffer: []u8) error{}!usize {
+        const n = @min(buffer.len, self.source.len);
+        @memcpy(buffer[0..n], self.source[0..n]);
+        self.source = self.source[n..];
+        return n;
+    }
+
+    pub fn borrow(self: *SliceReader, len: usize) error{EndOfStream}![]const u8 {
+        if (len > self.source.len) return error.EndOfStream;
+        defer self.source = self.source[len..];
+        return self.source[0..len];
+    }
+};
+
+fn canBorrow(comptime Stream: type) bool {
+    return Stream == *SliceReader;
+}
+
+/// Whether a slice of the type has the same layout in memory as on the wire.
+fn isWireLayout(comptime T: type) bool {
+    return @typeInfo(T) == .int and @sizeOf(T) * 8 == @bitSizeOf(T) and
+        @import("builtin").cpu.arch.endian() == .little;
+}
+
 pub fn serialize(stream: anytype, value: anytype) @TypeOf(stream).Error!void {
     const T = @TypeOf(value);
     return switch (@typeInfo(T)) {
@@ -350,6 +397,17 @@ fn deserializePointerAlloc(stream: anytype, comptime info: std.builtin.Type.Poin
                 printIndent(level);
                 std.debug.print("[deserializePointerAlloc] slice len: {d}\n", .{len});
             }
+            if (comptime canBorrow(@TypeOf(stream)) and isWireLayout(info.child)) {
+                const size = std.math.mul(usize, len, @sizeOf(info.child)) catch return error.EndOfStream;
+                const bytes = try stream.borrow(size);
+                if (@intFromPtr(bytes.ptr) % @alignOf(info.child) == 0) {
+                    const items: [*]info.child = @ptrCast(@alignCast(@constCast(bytes.ptr)));
+                    return items[0..len];
+                }
+                const memory = try allocator.alloc(info.child, len);
+                @memcpy(std.mem.sliceAsBytes(memory), bytes);
+                return memory;
+            }
             if (len > 1024 * 1024) {
                 return DeserializeError.LargeAlloc;
             }
@@ -423,6 +481,7 @@ fn deserializeStructAlloc(stream: anytype, comptime info: std.builtin.Type.Struc
         if (@hasDecl(T, "meta")) {
             inline for (T.meta) |meta_field| {
                 if (comptime std.mem.eql(u8, meta_field.field, field.name)) {
+                    if (meta_field.src_type == void) continue :outer;
                     const intermediate = try deserializeAllocImpl(stream, allocator, meta_field.src_type, debug, level + 1);
                     @field(value, field.name) = switch (field.type) {
                         u256 => std.fmt.parseInt(u256, intermediate, 16) catch return DeserializeError.ParseIntError,
@@ -435,6 +494,7 @@ fn deserializeStructAlloc(stream: anytype, comptime info: std.builtin.Type.Struc
         }
         @field(value, field.name) = try deserializeAllocImpl(stream, allocator, field.type, debug, level + 1);
     }
+    if (@hasDecl(T, "bincodeDerive")) value.bincodeDerive();
     return value;
 }
 
@@ -445,6 +505,7 @@ fn deserializeStruct(stream: anytype, comptime info: std.builtin.Type.@"struct",
         if (@hasDecl(T, "meta")) {
             inline for (T.meta) |meta_field| {
                 if (comptime std.mem.eql(u8, meta_field.field, field.name)) {
+                    if (meta_field.src_type == void) continue :outer;
                     const intermediate = try deserializeImpl(stream, meta_field.src_type, debug, 1);
                     @field(value, field.name) = switch (field.type) {
                         u256 => std.fmt.parseInt(u256, intermediate, 16) catch return DeserializeError.ParseIntError,
@@ -457,6 +518,7 @@ fn deserializeStruct(stream: anytype, comptime info: std.builtin.Type.@"struct",
         }
         @field(value, field.name) = try deserializeImpl(stream, field.type, debug, 1);
     }
+    if (@hasDecl(T, "bincodeDerive")) value.bincodeDerive();
     return value;
 }
 
@@ -590,6 +652,7 @@ pub fn serializeStruct(stream: anytype, comptime info: std.builtin.Type.Struct,
         if (@hasDecl(T, "meta")) {
             inline for (T.meta) |meta_field| {
                 if (comptime std.mem.eql(u8, meta_field.field, field.name)) {
+                    if (meta_field.src_type == void) continue :outer;
                     var buffer: [64]u8 = undefined;
                     const result = std.fmt.bufPrint(&buffer, "{x:0>64}", .{@field(value, field.name)}) catch unreachable;
                     try serialize(stream, result);
@@ -628,6 +691,70 @@ fn invalidProtocol(comptime message: []const u8) noreturn {
     @panic("Invalid protocol detected: " ++ message);
 }
 
+test "borrowed deserialization" {
+    const Entry = struct {
+        pub const meta = [_]Meta{
+            .{ .field = "value", .src_type = []const u8 },
+        };
+        name: []const u8,
+        ids: []u32,
+        value: u256,
+        children: []const u16,
+    };
+    const entry = Entry{ .name = "entry", .ids = @constCast(&[_]u32{ 1, 2, 3 }), .value = 0xabc, .children = &.{} };
+
+    var arena = std.heap.ArenaAllocator.init(std.testing.allocator);
+    defer arena.deinit();
+    var buf = std.ArrayList(u8).init(arena.allocator());
+    // Offset everything so that ids may or may not be aligned.
+    for (0..3) |offset| {
+        buf.clearRetainingCapacity();
+        try buf.appendNTimes(0, offset);
+        try serialize(buf.writer(), entry);
+        try buf.append(0xff);
+
+        var source: []const u8 = buf.items[offset..];
+        const copy = try deserializeBufferAlloc(Entry, &source, arena.allocator());
+        try std.testing.expectEqualStrings("entry", copy.name);
+        try std.testing.expectEqualSlices(u32, &.{ 1, 2, 3 }, copy.ids);
+        try std.testing.expectEqual(0xabc, copy.value);
+        try std.testing.expectEqual(0, copy.children.len);
+        try std.testing.expectEqualSlices(u8, &.{0xff}, source);
+        // Bytes are borrowed, not copied.
+        try std.testing.expect(@intFromPtr(copy.name.ptr) >= @intFromPtr(buf.items.ptr));
+        try std.testing.expect(@intFromPtr(copy.name.ptr) < @intFromPtr(buf.items.ptr) + buf.items.len);
+    }
+
+    var short: []const u8 = &.{ 5, 0, 0, 0, 0, 0, 0, 0, 'a' };
+    try std.testing.expectError(error.EndOfStream, deserializeBufferAlloc([]const u8, &short, arena.allocator()));
+}
+
+test "derived fields" {
+    const Entry = struct {
+        pub const meta = [_]Meta{
+            .{ .field = "name_len", .src_type = void },
+        };
+        name: []const u8,
+        name_len: usize = 0,
+
+        pub fn bincodeDerive(self: *@This()) void {
+            self.name_len = self.name.len;
+        }
+    };
+
+    var arena = std.heap.ArenaAllocator.init(std.testing.allocator);
+    defer arena.deinit();
+    var buf = std.ArrayList(u8).init(arena.allocator());
+    try serialize(buf.writer(), Entry{ .name = "entry", .name_len = 99 });
+    // Only the name is on the wire.
+    try std.testing.expectEqual(8 + 5, buf.items.len);
+
+    var source: []const u8 = buf.items;
+    const copy = try deserializeBufferAlloc(Entry, &source, arena.allocator());
+    try std.testing.expectEqualStrings("entry", copy.name);
+    try std.testing.expectEqual(5, copy.name_len);
+}
+
 // test "round trip" {
 //     const expectEqualStrings = std.testing.expectEqualStrings;
 //     const expectEqual = std.testing.expectEqual;
@@ -5,15 +5,111 @@ const fieldOps = @import("../blackbox/field.zig");
 const blackbox = @import("../blackbox/blackbox.zig");
 const rdtsc = @import("../timer/rdtsc.zig").rdtsc;
 const Memory = @import("memory.zig").Memory;
+const MemoryPool = @import("memory_pool.zig").MemoryPool;
 const DebugContext = @import("debug_context.zig").DebugContext;
 const BrilligOpcode = io.BrilligOpcode;
 const foreign_call = @import("./foreign_call/package.zig");
+const bytecode = @import("bytecode.zig");
+const Bytecode = bytecode.Bytecode;
+const Instruction = bytecode.Instruction;
+const test_programs = @import("test_programs.zig");
 
 extern fn mlock(addr: ?*u8, len: usize) callconv(.C) i32;
 
-const ExecuteOptions = struct {
+pub const ExecuteOptions = struct {
     // Sample rate for opcode performance measurement.
     sample_rate: u64 = 0,
+    // Count executed opcodes by type.
+    collect_stats: bool = false,
+};
+
+/// Variants of the execute loop, each compiled with only the per-opcode work it needs.
+const LoopMode = enum {
+    release,
+    // Opcode counters.
+    stats,
+    // Opcode counters, and a timing sample every `sample_rate` opcodes.
+    sampled,
+    // Opcode counters and debug hooks.
+    debug,
+};
+
+const num_opcodes = @typeInfo(io.BrilligOpcode).@"union".fields.len;
+const num_blackbox_ops = @typeInfo(io.BlackBoxOp).@"union".fields.len;
+
+/// Execution stats, accumulated over any number of vm runs.
+pub const Stats = struct {
+    calls: u64 = 0,
+    ops_executed: u64 = 0,
+    time_taken: u64 = 0,
+    opcode_counters: [num_opcodes]u64 = [_]u64{0} ** num_opcodes,
+    opcode_time: [num_opcodes]u64 = [_]u64{0} ** num_opcodes,
+    blackbox_counters: [num_blackbox_ops]u64 = [_]u64{0} ** num_blackbox_ops,
+
+    pub fn add(self: *Stats, vm: *const BrilligVm) void {
+        self.calls += 1;
+        self.ops_executed += vm.ops_executed;
+        self.time_taken += vm.time_taken;
+        for (&self.opcode_counters, vm.opcode_counters) |*a, b| a.* += b;
+        for (&self.opcode_time, vm.opcode_time) |*a, b| a.* += b;
+        for (&self.blackbox_counters, vm.blackbox_counters) |*a, b| a.* += b;
+    }
+
+    pub fn dump(self: *const Stats) void {
+        std.debug.print("Brillig calls: {}\n", .{self.calls});
+        std.debug.print("Time taken: {}us\n", .{self.time_taken / 1000});
+        std.debug.print("Opcodes executed: {}\n", .{self.ops_executed});
+
+        var total_cycles: u64 = 0;
+        for (self.opcode_time) |x| total_cycles += x;
+
+        std.debug.print("Opcode hit / time:\n", .{});
+        inline for (@typeInfo(io.BrilligOpcode).@"union".fields, 0..) |enumField, idx| {
+            std.debug.print("  {s}: {} / {d:.2}%\n", .{
+                enumField.name,
+                self.opcode_counters[idx],
+                if (total_cycles == 0) 0 else @as(f64, @floatFromInt(self.opcode_time[idx] * 100)) / @as(f64, @floatFromInt(total_cycles)),
+            });
+        }
+
+        std.debug.print("Blackbox calls:\n", .{});
+        inline for (@typeInfo(io.BlackBoxOp).@"union".fields, 0..) |enumField, idx| {
+            std.debug.print("  {s}: {}\n", .{ enumField.name, self.blackbox_counters[idx] });
+        }
+    }
+
+    /// Writes the stats as a json object, to a std.json.WriteStream.
+    pub fn writeJson(self: *const Stats, ws: anytype) !void {
+        try ws.beginObject();
+        try ws.objectField("calls");
+        try ws.write(self.calls);
+        try ws.objectField("time_ns");
+        try ws.write(self.time_taken);
+        try ws.objectField("ops_executed");
+        try ws.write(self.ops_executed);
+        try ws.objectField("opcodes");
+        try ws.beginObject();
+        inline for (@typeInfo(io.BrilligOpcode).@"union".fields, 0..) |enumField, idx| {
+            try ws.objectField(enumField.name);
+            try ws.write(.{ .count = self.opcode_counters[idx], .cycles = self.opcode_time[idx] });
+        }
+        try ws.endObject();
+        try ws.objectField("blackboxes");
+        try ws.beginObject();
+        inline for (@typeInfo(io.BlackBoxOp).@"union".fields, 0..) |enumField, idx| {
+            try ws.objectField(enumField.name);
+            try ws.write(self.blackbox_counters[idx]);
+        }
+        try ws.endObject();
+        try ws.endObject();
+    }
+};
+
+const InitOptions = struct {
+    // If set, memory is acquired from and released back to the pool, rather than allocated per vm.
+    memory_pool: ?*MemoryPool = null,
+    // Backend of the memory allocated when there's no pool. Pooled memories use the pool's backend.
+    memory_backend: Memory.Backend = .flat,
 };
 
 pub const ErrorContext = struct {
@@ -51,32 +147,25 @@ pub const BrilligVmHooks = struct {
 
 pub const BrilligVm = struct {
     const Self = @This();
+    const Handler = *const fn (*Self, *const Instruction) anyerror!void;
     const mem_size = 1024 * 1024 * 8;
     // const mem_size = 1024 * 1024 * 32;
-    const jump_table = [_]*const fn (*Self, *BrilligOpcode) anyerror!void{
-        &processBinaryFieldOp,
-        &processBinaryIntOp,
-        &processNot,
-        &processCast,
-        &processJumpIfNot,
-        &processJumpIf,
-        &processJump,
-        &processCalldatacopy,
-        &processCall,
-        &processConst,
-        &processIndirectConst,
-        &processReturn,
-        &processForeignCall,
-        &processMov,
-        &processCmov,
-        &processLoad,
-        &processStore,
-        &processBlackbox,
-        &processTrap,
-        &processStop,
+
+    /// A table of instruction handlers per memory backend, with and without debug hooks.
+    /// The table is chosen once on entry to `executeVm`, so the hot loop never dispatches on the backend,
+    /// and only the debug tables check for hooks on memory writes.
+    const jump_tables = blk: {
+        const backends = std.enums.values(Memory.Backend);
+        var tables: [2][backends.len][bytecode.num_handlers]Handler = undefined;
+        for ([_]bool{ false, true }) |debug| {
+            for (backends) |backend| tables[@intFromBool(debug)][@intFromEnum(backend)] = Handlers(backend, debug).jump_table;
+        }
+        break :blk tables;
     };
     allocator: std.mem.Allocator,
     mem: Memory,
+    // If set, memory is acquired from and released back to the pool, rather than allocated per vm.
+    memory_pool: ?*MemoryPool = null,
 
     calldata: []u256,
     callstack: std.ArrayList(usize),
@@ -84,10 +173,13 @@ pub const BrilligVm = struct {
     halted: bool = false,
     trapped: bool = false,
     return_data: []align(32) u256,
+    // The source opcodes and constant pool of the bytecode being executed.
+    opcodes: []BrilligOpcode = &.{},
+    constants: []const u256 = &.{},
     ops_executed: u64 = 0,
-    blackbox_counters: [@typeInfo(io.BlackBoxOp).@"union".fields.len]u64,
-    opcode_counters: [@typeInfo(io.BrilligOpcode).@"union".fields.len]u64,
-    opcode_time: [@typeInfo(io.BrilligOpcode).@"union".fields.len]u64,
+    blackbox_counters: [num_blackbox_ops]u64,
+    opcode_counters: [num_opcodes]u64,
+    opcode_time: [num_opcodes]u64,
     time_taken: u64 = 0,
     fc_handler: foreign_call.ForeignCallDispatcher,
     hooks: ?BrilligVmHooks = null,
@@ -97,15 +189,20 @@ pub const BrilligVm = struct {
         calldata: []u256,
         fc_handler: foreign_call.ForeignCallDispatcher,
         hooks: ?BrilligVmHooks,
+        options: InitOptions,
     ) !@This() {
         const vm = @This(){
             .allocator = allocator,
-            .mem = try Memory.init(allocator, mem_size),
+            .mem = if (options.memory_pool) |pool|
+                try pool.acquire()
+            else
+                try Memory.initBackend(allocator, mem_size, options.memory_backend),
+            .memory_pool = options.memory_pool,
             .calldata = calldata,
             .callstack = try std.ArrayList(usize).initCapacity(allocator, 1024),
-            .blackbox_counters = std.mem.zeroes([@typeInfo(io.BlackBoxOp).@"union".fields.len]u64),
-            .opcode_counters = std.mem.zeroes([@typeInfo(io.BrilligOpcode).@"union".fields.len]u64),
-            .opcode_time = std.mem.zeroes([@typeInfo(io.BrilligOpcode).@"union".fields.len]u64),
+            .blackbox_counters = std.mem.zeroes([num_blackbox_ops]u64),
+            .opcode_counters = std.mem.zeroes([num_opcodes]u64),
+            .opcode_time = std.mem.zeroes([num_opcodes]u64),
             .return_data = &.{},
             .fc_handler = fc_handler,
             .hooks = hooks,
@@ -127,7 +224,16 @@ pub const BrilligVm = struct {
     }
 
     pub fn deinit(self: *Self) void {
-        self.mem.deinit();
+        if (self.memory_pool) |pool| {
+            pool.release(self.mem);
+        } else {
+            self.mem.deinit();
+        }
+    }
+
+    /// Creates a pool of memories sized for this vm.
+    pub fn initMemoryPool(allocator: std.mem.Allocator, backend: Memory.Backend) MemoryPool {
+        return MemoryPool.init(allocator, mem_size, backend);
     }
 
     pub fn getErrorContext(self: *const Self, allocator: std.mem.Allocator) !ErrorContext {
@@ -139,43 +245,70 @@ pub const BrilligVm = struct {
         };
     }
 
-    pub fn executeVm(self: *Self, opcodes: []BrilligOpcode, options: ExecuteOptions) !void {
+    pub fn executeVm(self: *Self, code: *const Bytecode, options: ExecuteOptions) !void {
         var t = try std.time.Timer.start();
+        const jump_table = &jump_tables[@intFromBool(self.hooks != null)][@intFromEnum(std.meta.activeTag(self.mem))];
+        self.opcodes = code.opcodes;
+        self.constants = code.constants;
+
+        // Pick the loop once, so we pay nothing per opcode for features not in use.
+        if (self.hooks != null) {
+            try self.run(.debug, code.instructions, jump_table, options);
+        } else if (options.sample_rate > 0) {
+            try self.run(.sampled, code.instructions, jump_table, options);
+        } else if (options.collect_stats) {
+            try self.run(.stats, code.instructions, jump_table, options);
+        } else {
+            // Superinstructions would skew the per opcode stats, so are only used here.
+            try self.run(.release, code.fused orelse code.instructions, jump_table, options);
+        }
+
+        self.time_taken = t.read();
 
+        if (self.trapped) {
+            return error.Trapped;
+        }
+    }
+
+    fn run(
+        self: *Self,
+        comptime mode: LoopMode,
+        instructions: []const Instruction,
+        jump_table: *const [bytecode.num_handlers]Handler,
+        options: ExecuteOptions,
+    ) !void {
         while (!self.halted) {
             const current_pc = self.pc;
-            const opcode = &opcodes[current_pc];
-
-            const i = @intFromEnum(opcode.*);
-            if (i > Self.jump_table.len - 1) {
-                return error.UnknownOpcode;
-            }
+            const inst = &instructions[current_pc];
+            const idx = @intFromEnum(inst.tag);
 
-            // Take a timing sample every 1000th.
-            const idx = @intFromEnum(opcode.*);
+            // Take a timing sample every sample_rate'th.
+            const sample = mode == .sampled and self.ops_executed % options.sample_rate == 0;
             var before: u64 = 0;
-            if (options.sample_rate > 0 and self.ops_executed % options.sample_rate == 0) {
+            if (sample) {
                 before = rdtsc();
             }
 
-            // Execute opcode.
-            Self.jump_table[i](self, opcode) catch |err| {
+            // Execute instruction.
+            jump_table[inst.handler](self, inst) catch |err| {
                 // Notify debug context about the error before propagating
-                if (self.hooks) |*hooks| {
-                    hooks.onError(self);
+                if (mode == .debug) {
+                    self.hooks.?.onError(self);
                 }
                 return err;
             };
 
-            if (options.sample_rate > 0 and self.ops_executed % options.sample_rate == 0) {
+            if (sample) {
                 self.opcode_time[idx] += rdtsc() - before;
             }
-            self.opcode_counters[idx] += 1;
+            if (mode != .release) {
+                self.opcode_counters[idx] += 1;
+            }
             self.ops_executed += 1;
 
-            // Call hooks if provided.
-            if (self.hooks) |*hooks| {
-                if (!hooks.afterOpcode(opcode.*, self)) {
+            if (mode == .debug) {
+                const hooks = &self.hooks.?;
+                if (!hooks.afterOpcode(self.opcodes[current_pc], self)) {
                     return error.DebuggerTerminated;
                 }
                 if (self.trapped) {
@@ -183,309 +316,448 @@ pub const BrilligVm = struct {
                 }
             }
         }
+    }
 
-        self.time_taken = t.read();
+    /// Instruction handlers specialised for a memory backend, and for whether memory writes are passed to debug hooks.
+    fn Handlers(comptime backend: Memory.Backend, comptime debug: bool) type {
+        return struct {
+            /// Laid out as described by `bytecode.handlerIndex`.
+            /// Opcodes with sub-operations or bit sizes get a handler per combination.
+            const jump_table = blk: {
+                var table: [bytecode.num_handlers]Handler = undefined;
+                for (std.enums.values(io.BinaryFieldOp)) |op| {
+                    table[bytecode.handlerIndex(.BinaryFieldOp, @intFromEnum(op))] = &BinaryFieldOpHandler(op).process;
+                }
+                for (std.enums.values(io.IntegerBitSize)) |bit_size| {
+                    for (std.enums.values(io.BinaryIntOp)) |op| {
+                        table[bytecode.handlerIndex(.BinaryIntOp, bytecode.intOpVariant(bit_size, op))] =
+                            &BinaryIntOpHandler(IntType(bit_size), op).process;
+                    }
+                    table[bytecode.handlerIndex(.Not, @intFromEnum(bit_size))] = &NotHandler(IntType(bit_size)).process;
+                    table[bytecode.handlerIndex(.Cast, bytecode.castVariant(.{ .Integer = bit_size }))] =
+                        &CastHandler(IntType(bit_size)).process;
+                }
+                table[bytecode.handlerIndex(.Cast, bytecode.castVariant(.Field))] = &CastHandler(F).process;
+                table[bytecode.handlerIndex(.JumpIfNot, 0)] = &processJumpIfNot;
+                table[bytecode.handlerIndex(.JumpIf, 0)] = &processJumpIf;
+                table[bytecode.handlerIndex(.Jump, 0)] = &Self.processJump;
+                table[bytecode.handlerIndex(.CalldataCopy, 0)] = &processCalldatacopy;
+                table[bytecode.handlerIndex(.Call, 0)] = &Self.processCall;
+                table[bytecode.handlerIndex(.Const, 0)] = &processConst;
+                table[bytecode.handlerIndex(.IndirectConst, 0)] = &processIndirectConst;
+                table[bytecode.handlerIndex(.Return, 0)] = &Self.processReturn;
+                table[bytecode.handlerIndex(.ForeignCall, 0)] = &Self.processForeignCall;
+                table[bytecode.handlerIndex(.Mov, 0)] = &processMov;
+                table[bytecode.handlerIndex(.ConditionalMov, 0)] = &processCmov;
+                table[bytecode.handlerIndex(.Load, 0)] = &processLoad;
+                table[bytecode.handlerIndex(.Store, 0)] = &processStore;
+                table[bytecode.handlerIndex(.BlackBox, 0)] = &processBlackbox;
+                table[bytecode.handlerIndex(.Trap, 0)] = &processTrap;
+                table[bytecode.handlerIndex(.Stop, 0)] = &processStop;
+
+                // Superinstructions, see `Bytecode.fuse`.
+                for (std.enums.values(io.IntegerBitSize)) |bit_size| {
+                    for (std.enums.values(io.BinaryIntOp)) |op| {
+                        table[bytecode.fusedHandlerIndex(.const_int_op, bytecode.intOpVariant(bit_size, op))] =
+                            &Fused(processConst, BinaryIntOpHandler(IntType(bit_size), op).process).process;
+                    }
+                    for (bytecode.int_cmp_ops) |op| {
+                        table[bytecode.fusedHandlerIndex(.int_cmp_jump_if_not, bytecode.intCmpVariant(bit_size, op).?)] =
+                            &Fused(BinaryIntOpHandler(IntType(bit_size), op).process, processJumpIfNot).process;
+                    }
+                }
+                for (std.enums.values(io.BinaryFieldOp)) |op| {
+                    table[bytecode.fusedHandlerIndex(.load_field_op, @intFromEnum(op))] =
+                        &Fused(processLoad, BinaryFieldOpHandler(op).process).process;
+                }
+                table[bytecode.fusedHandlerIndex(.mov_mov, 0)] = &Fused(processMov, processMov).process;
+                break :blk table;
+            };
 
-        if (self.trapped) {
-            return error.Trapped;
-        }
-    }
+            /// Executes an instruction and the one following it in a single dispatch.
+            /// The first handler never branches, so the pc is left where the second handler puts it.
+            fn Fused(comptime first: anytype, comptime second: anytype) type {
+                return struct {
+                    fn process(self: *Self, inst: *const Instruction) !void {
+                        try @call(.always_inline, first, .{ self, inst });
+                        const next: *const Instruction = @ptrCast(@as([*]const Instruction, @ptrCast(inst)) + 1);
+                        try @call(.always_inline, second, .{ self, next });
+                        self.ops_executed += 1;
+                    }
+                };
+            }
 
-    fn processConst(self: *Self, opcode: *BrilligOpcode) !void {
-        const op = &opcode.Const;
-        // TODO: Move to deserialize time. Convert to montgomery if a field so it happens just once.
-        if (op.bit_size == io.BitSize.Field and (op.value & (1 << 255)) == 0) {
-            op.value = @as(u256, @bitCast(F.from_int(op.value).limbs)) | (1 << 255);
-        }
-        self.setSlot(op.destination, op.value);
-        self.pc += 1;
-        // std.debug.print("({}) set slot {} = {}\n", .{
-        //     op.bit_size,
-        //     op.destination.resolve(self.memory),
-        //     op.value,
-        // });
-    }
+            inline fn mem(self: *Self) *Memory.Type(backend) {
+                return self.mem.as(backend);
+            }
 
-    fn processIndirectConst(self: *Self, opcode: *BrilligOpcode) !void {
-        const op = &opcode.IndirectConst;
-        const dest_ptr_index = self.mem.resolveSlot(op.destination_pointer);
-        const dest_address = self.mem.getSlotAtIndex(dest_ptr_index);
-        // TODO: Move to deserialize time. Convert to montgomery if a field so it happens just once.
-        if (op.bit_size == io.BitSize.Field and (op.value & (1 << 255)) == 0) {
-            op.value = @as(u256, @bitCast(F.from_int(op.value).limbs)) | (1 << 255);
-        }
-        self.setSlotAtIndex(@truncate(dest_address), op.value);
-        self.pc += 1;
-        // std.debug.print("({}) set slot {} = {}\n", .{
-        //     op.bit_size,
-        //     dest_address,
-        //     op.value,
-        // });
-    }
+            inline fn setSlot(self: *Self, mem_address: anytype, value: u256) void {
+                setSlotAtIndex(self, mem(self).resolveSlot(mem_address), value);
+            }
 
-    fn processCalldatacopy(self: *Self, opcode: *BrilligOpcode) !void {
-        const op = &opcode.CalldataCopy;
-        const size: usize = @truncate(self.mem.getSlot(op.size_address));
-        const offset: usize = @truncate(self.mem.getSlot(op.offset_address));
-        if (self.calldata.len < size) {
-            self.trap();
-            return;
-        }
-        for (0..size) |i| {
-            const addr = self.mem.resolveSlot(op.destination_address) + i;
-            const src_index = offset + i;
-            // std.debug.print("copy {} to slot {}\n", .{ calldata[src_index], addr });
-            self.setSlotAtIndex(addr, self.calldata[src_index]);
-        }
-        self.pc += 1;
-    }
+            inline fn setSlotAtIndex(self: *Self, index: usize, value: u256) void {
+                mem(self).setSlotAtIndex(index, value);
 
-    fn processCast(self: *Self, opcode: *BrilligOpcode) !void {
-        const op = &opcode.Cast;
-        switch (op.bit_size) {
-            .Integer => |int_size| {
-                fieldOps.bn254_fr_normalize(@ptrCast(self.mem.getSlotAddr(op.source)));
-                const mask = (@as(u256, 1) << getBitSize(int_size)) - 1;
-                self.setSlot(op.destination, self.mem.getSlot(op.source) & mask);
-            },
-            .Field => {
-                self.setSlot(op.destination, self.mem.getSlot(op.source));
-            },
-        }
-        self.pc += 1;
-    }
+                if (debug) {
+                    var f align(32) = value;
+                    fieldOps.bn254_fr_normalize(@ptrCast(&f));
+                    self.hooks.?.trackMemoryWrite(index, f);
+                }
+            }
 
-    fn processMov(self: *Self, opcode: *BrilligOpcode) !void {
-        const mov = &opcode.Mov;
-        self.setSlot(mov.destination, self.mem.getSlot(mov.source));
-        self.pc += 1;
-        // std.io.getStdOut().writer().print("mov slot {} = {} (value: {})\n", .{
-        //     mov.source.resolve(self.memory),
-        //     mov.destination.resolve(self.memory),
-        //     self.getSlot(mov.source),
-        // }) catch unreachable;
-    }
+            fn processConst(self: *Self, inst: *const Instruction) !void {
+                setSlot(self, inst.a, self.constants[inst.imm]);
+                self.pc += 1;
+            }
 
-    fn processCmov(self: *Self, opcode: *BrilligOpcode) !void {
-        const mov = &opcode.ConditionalMov;
-        self.setSlot(
-            mov.destination,
-            if (self.mem.getSlot(mov.condition) != 0) self.mem.getSlot(mov.source_a) else self.mem.getSlot(mov.source_b),
-        );
-        self.pc += 1;
-    }
+            fn processIndirectConst(self: *Self, inst: *const Instruction) !void {
+                const dest_address = mem(self).getSlot(inst.a);
+                setSlotAtIndex(self, @truncate(dest_address), self.constants[inst.imm]);
+                self.pc += 1;
+            }
 
-    fn processStore(self: *Self, opcode: *BrilligOpcode) !void {
-        const store = &opcode.Store;
-        self.setSlotAtIndex(@truncate(self.mem.getSlot(store.destination_pointer)), self.mem.getSlot(store.source));
-        self.pc += 1;
-    }
+            fn processCalldatacopy(self: *Self, inst: *const Instruction) !void {
+                const size: usize = @truncate(mem(self).getSlot(inst.b));
+                const offset: usize = @truncate(mem(self).getSlot(inst.c));
+                if (self.calldata.len < size) {
+                    self.trap();
+                    return;
+                }
+                const dest = mem(self).resolveSlot(inst.a);
+                for (0..size) |i| {
+                    const src_index = offset + i;
+                    // std.debug.print("copy {} to slot {}\n", .{ calldata[src_index], dest + i });
+                    setSlotAtIndex(self, dest + i, self.calldata[src_index]);
+                }
+                self.pc += 1;
+            }
 
-    fn processLoad(self: *Self, opcode: *BrilligOpcode) !void {
-        const load = &opcode.Load;
-        self.setSlot(load.destination, self.mem.getIndirectSlot(load.source_pointer));
-        self.pc += 1;
-        // std.io.getStdOut().writer().print("load slot {} = {} (value: {})\n", .{
-        //     load.destination.resolve(self.memory),
-        //     self.memory[load.source_pointer.resolve(self.memory)],
-        //     self.memory[@truncate(self.memory[load.source_pointer.resolve(self.memory)])],
-        // }) catch unreachable;
-    }
+            /// Cast to a field when `int_type` is F, otherwise truncate to the integer type.
+            fn CastHandler(comptime int_type: type) type {
+                return struct {
+                    fn process(self: *Self, inst: *const Instruction) !void {
+                        if (int_type == F) {
+                            setSlot(self, inst.a, mem(self).getSlot(inst.b));
+                        } else {
+                            // The source is normalized in place.
+                            const src = mem(self).resolveSlot(inst.b);
+                            var v align(32) = mem(self).getSlotAtIndex(src);
+                            fieldOps.bn254_fr_normalize(@ptrCast(&v));
+                            mem(self).setSlotAtIndex(src, v);
+                            const mask = (@as(u256, 1) << @bitSizeOf(int_type)) - 1;
+                            setSlot(self, inst.a, v & mask);
+                        }
+                        self.pc += 1;
+                    }
+                };
+            }
 
-    fn processCall(self: *Self, opcode: *BrilligOpcode) !void {
-        const call = &opcode.Call;
-        self.callstack.append(self.pc + 1) catch unreachable;
-        self.pc = @truncate(call.location);
-    }
+            fn processMov(self: *Self, inst: *const Instruction) !void {
+                setSlot(self, inst.a, mem(self).getSlot(inst.b));
+                self.pc += 1;
+                // std.io.getStdOut().writer().print("mov slot {} = {} (value: {})\n", .{
+                //     mem(self).resolveSlot(inst.b),
+                //     mem(self).resolveSlot(inst.a),
+                //     mem(self).getSlot(inst.b),
+                // }) catch unreachable;
+            }
 
-    fn processReturn(self: *Self, _: *BrilligOpcode) !void {
-        self.pc = self.callstack.pop() orelse unreachable;
-    }
+            fn processCmov(self: *Self, inst: *const Instruction) !void {
+                setSlot(
+                    self,
+                    inst.a,
+                    if (mem(self).getSlot(inst.d) != 0) mem(self).getSlot(inst.b) else mem(self).getSlot(inst.c),
+                );
+                self.pc += 1;
+            }
 
-    fn processJump(self: *Self, opcode: *BrilligOpcode) !void {
-        const jmp = &opcode.Jump;
-        self.pc = @truncate(jmp.location);
-    }
+            fn processStore(self: *Self, inst: *const Instruction) !void {
+                setSlotAtIndex(self, @truncate(mem(self).getSlot(inst.a)), mem(self).getSlot(inst.b));
+                self.pc += 1;
+            }
 
-    fn processJumpIf(self: *Self, opcode: *BrilligOpcode) !void {
-        const jmp = &opcode.JumpIf;
-        self.pc = if (self.mem.getSlot(jmp.condition) == 1) @truncate(jmp.location) else self.pc + 1;
-    }
+            fn processLoad(self: *Self, inst: *const Instruction) !void {
+                setSlot(self, inst.a, mem(self).getIndirectSlot(inst.b));
+                self.pc += 1;
+            }
 
-    fn processJumpIfNot(self: *Self, opcode: *BrilligOpcode) !void {
-        const jmp = &opcode.JumpIfNot;
-        self.pc = if (self.mem.getSlot(jmp.condition) == 0) @truncate(jmp.location) else self.pc + 1;
-    }
+            fn processJumpIf(self: *Self, inst: *const Instruction) !void {
+                self.pc = if (mem(self).getSlot(inst.a) == 1) inst.imm else self.pc + 1;
+            }
 
-    fn processNot(self: *Self, opcode: *BrilligOpcode) !void {
-        const not = &opcode.Not;
-        // std.io.getStdOut().writer().print("{} = ", .{self.getSlot(not.source)}) catch unreachable;
-        self.setSlot(not.destination, switch (not.bit_size) {
-            .U1 => self.unaryNot(u1, not),
-            .U8 => self.unaryNot(u8, not),
-            .U16 => self.unaryNot(u16, not),
-            .U32 => self.unaryNot(u32, not),
-            .U64 => self.unaryNot(u64, not),
-            .U128 => self.unaryNot(u128, not),
-        });
-        // std.io.getStdOut().writer().print("{}\n", .{self.getSlot(not.destination)}) catch unreachable;
-        self.pc += 1;
-    }
+            fn processJumpIfNot(self: *Self, inst: *const Instruction) !void {
+                self.pc = if (mem(self).getSlot(inst.a) == 0) inst.imm else self.pc + 1;
+            }
 
-    fn processBinaryIntOp(self: *Self, opcode: *BrilligOpcode) !void {
-        const int_op = &opcode.BinaryIntOp;
-        self.setSlot(int_op.destination, switch (int_op.bit_size) {
-            .U1 => self.binaryIntOp(u1, opcode.BinaryIntOp),
-            .U8 => self.binaryIntOp(u8, opcode.BinaryIntOp),
-            .U16 => self.binaryIntOp(u16, opcode.BinaryIntOp),
-            .U32 => self.binaryIntOp(u32, opcode.BinaryIntOp),
-            .U64 => self.binaryIntOp(u64, opcode.BinaryIntOp),
-            .U128 => self.binaryIntOp(u128, opcode.BinaryIntOp),
-        });
-        self.pc += 1;
-    }
+            fn NotHandler(comptime int_type: type) type {
+                return struct {
+                    fn process(self: *Self, inst: *const Instruction) !void {
+                        const r: int_type = @truncate(~mem(self).getSlot(inst.b));
+                        setSlot(self, inst.a, r);
+                        self.pc += 1;
+                    }
+                };
+            }
 
-    fn processBinaryFieldOp(self: *Self, opcode: *BrilligOpcode) !void {
-        const field_op = &opcode.BinaryFieldOp;
-        const lhs = self.mem.getSlotAddr(field_op.lhs);
-        const rhs = self.mem.getSlotAddr(field_op.rhs);
-        const dest = self.mem.getSlotAddr(field_op.destination);
-        switch (field_op.op) {
-            .Add => fieldOps.bn254_fr_add(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
-            .Mul => fieldOps.bn254_fr_mul(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
-            .Sub => fieldOps.bn254_fr_sub(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
-            .Div => if (!fieldOps.bn254_fr_div(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest))) self.trap(),
-            .Equals => fieldOps.bn254_fr_eq(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
-            .LessThan => fieldOps.bn254_fr_lt(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
-            .LessThanEquals => fieldOps.bn254_fr_leq(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
-            .IntegerDiv => {
-                fieldOps.bn254_fr_normalize(@ptrCast(lhs));
-                fieldOps.bn254_fr_normalize(@ptrCast(rhs));
-                dest.* = lhs.* / rhs.*;
-            },
-        }
-        self.pc += 1;
+            fn BinaryIntOpHandler(comptime int_type: type, comptime op: io.BinaryIntOp) type {
+                return struct {
+                    fn process(self: *Self, inst: *const Instruction) !void {
+                        const lhs: int_type = @truncate(mem(self).getSlot(inst.b));
+                        const rhs: int_type = @truncate(mem(self).getSlot(inst.c));
+                        setSlot(self, inst.a, self.binaryIntOp(int_type, op, lhs, rhs));
+                        self.pc += 1;
+                    }
+                };
+            }
+
+            fn BinaryFieldOpHandler(comptime op: io.BinaryFieldOp) type {
+                return struct {
+                    fn process(self: *Self, inst: *const Instruction) !void {
+                        if (backend == .flat) {
+                            const lhs = mem(self).getSlotAddr(inst.b);
+                            const rhs = mem(self).getSlotAddr(inst.c);
+                            const dest = mem(self).getSlotAddrForWrite(inst.a);
+                            if (!binaryFieldOp(op, lhs, rhs, dest)) self.trap();
+                        } else {
+                            // Slots can't be addressed, so operate on copies.
+                            // IntegerDiv normalizes its operands in place, so write them back.
+                            var lhs align(32) = mem(self).getSlot(inst.b);
+                            var rhs align(32) = mem(self).getSlot(inst.c);
+                            var dest: u256 align(32) = 0;
+                            if (!binaryFieldOp(op, &lhs, &rhs, &dest)) self.trap();
+                            if (op == .IntegerDiv) {
+                                mem(self).setSlot(inst.b, lhs);
+                                mem(self).setSlot(inst.c, rhs);
+                            }
+                            mem(self).setSlot(inst.a, dest);
+                        }
+                        self.pc += 1;
+                    }
+                };
+            }
+
+            /// Slots handed to a blackbox by pointer.
+            /// Flat memory hands out pointers directly.
+            /// Compact memory stages the slots contiguously, and writes outputs back on `commit`.
+            const Staging = struct {
+                vm: *Self,
+                outputs: [2]struct { index: usize, slots: []align(32) u256 } = undefined,
+                num_outputs: usize = 0,
+
+                fn in(s: *Staging, mem_address: anytype) !*align(32) u256 {
+                    const m = mem(s.vm);
+                    if (backend == .flat) return m.getSlotAddr(mem_address);
+                    return @ptrCast((try m.stage(m.resolveSlot(mem_address), 1)).ptr);
+                }
+
+                fn indirectIn(s: *Staging, mem_address: anytype, n: usize) !*align(32) u256 {
+                    const m = mem(s.vm);
+                    if (backend == .flat) return m.getIndirectSlotAddr(mem_address);
+                    return @ptrCast((try m.stage(@truncate(m.getSlot(mem_address)), n)).ptr);
+                }
+
+                fn out(s: *Staging, mem_address: anytype) !*align(32) u256 {
+                    const m = mem(s.vm);
+                    if (backend == .flat) return m.getSlotAddrForWrite(mem_address);
+                    return s.stageOutput(m.resolveSlot(mem_address), 1);
+                }
+
+                fn indirectOut(s: *Staging, mem_address: anytype, n: usize) !*align(32) u256 {
+                    const m = mem(s.vm);
+                    if (backend == .flat) return m.getIndirectSlotAddrForWrite(mem_address, n);
+                    return s.stageOutput(@truncate(m.getSlot(mem_address)), n);
+                }
+
+                fn stageOutput(s: *Staging, index: usize, n: usize) !*align(32) u256 {
+                    const slots = try mem(s.vm).stage(index, n);
+                    s.outputs[s.num_outputs] = .{ .index = index, .slots = slots };
+                    s.num_outputs += 1;
+                    return @ptrCast(slots.ptr);
+                }
+
+                fn commit(s: *Staging) void {
+                    if (backend == .flat) return;
+                    const m = mem(s.vm);
+                    for (s.outputs[0..s.num_outputs]) |o| m.unstage(o.index, o.slots);
+                    m.releaseStaged();
+                }
+            };
+
+            fn processBlackbox(self: *Self, _: *const Instruction) !void {
+                const blackbox_op = &self.opcodes[self.pc].BlackBox;
+
+                const idx = @intFromEnum(blackbox_op.*);
+                self.blackbox_counters[idx] += 1;
+
+                const m = mem(self);
+                var s = Staging{ .vm = self };
+                switch (blackbox_op.*) {
+                    .Sha256Compression => |op| {
+                        blackbox.blackbox_sha256_compression(
+                            @ptrCast(try s.indirectIn(op.input.pointer, op.input.size)),
+                            @ptrCast(try s.indirectIn(op.hash_values.pointer, op.hash_values.size)),
+                            @ptrCast(try s.indirectOut(op.output.pointer, op.output.size)),
+                        );
+                    },
+                    .Blake2s => |op| {
+                        const size: usize = @truncate(m.getSlot(op.message.size));
+                        blackbox.blackbox_blake2s(
+                            @ptrCast(try s.indirectIn(op.message.pointer, size)),
+                            size,
+                            @ptrCast(try s.indirectOut(op.output.pointer, op.output.size)),
+                        );
+                    },
+                    .Blake3 => |op| {
+                        const size: usize = @truncate(m.getSlot(op.message.size));
+                        blackbox.blackbox_blake3(
+                            @ptrCast(try s.indirectIn(op.message.pointer, size)),
+                            size,
+                            @ptrCast(try s.indirectOut(op.output.pointer, op.output.size)),
+                        );
+                    },
+                    .Keccakf1600 => |op| {
+                        blackbox.blackbox_keccak1600(
+                            @ptrCast(try s.indirectIn(op.message.pointer, op.message.size)),
+                            @truncate(m.getSlotAtIndex(op.message.size)),
+                            @ptrCast(try s.indirectOut(op.output.pointer, op.output.size)),
+                        );
+                    },
+                    .Poseidon2Permutation => |op| {
+                        const size: usize = @truncate(m.getSlot(op.message.size));
+                        blackbox.blackbox_poseidon2_permutation(
+                            @ptrCast(try s.indirectIn(op.message.pointer, size)),
+                            @ptrCast(try s.indirectOut(op.output.pointer, op.output.size)),
+                            size,
+                        );
+                    },
+                    .ToRadix => |op| {
+                        const num_limbs: usize = @truncate(m.getSlot(op.num_limbs));
+                        blackbox.blackbox_to_radix(
+                            @ptrCast(try s.in(op.input)),
+                            @ptrCast(try s.indirectOut(op.output_pointer, num_limbs)),
+                            num_limbs,
+                            @truncate(m.getSlot(op.radix)),
+                        );
+                    },
+                    .AES128Encrypt => |op| {
+                        const size: usize = @truncate(m.getSlot(op.inputs.size));
+                        blackbox.blackbox_aes_encrypt(
+                            @ptrCast(try s.indirectIn(op.inputs.pointer, size)),
+                            @ptrCast(try s.indirectIn(op.iv.pointer, op.iv.size)),
+                            @ptrCast(try s.indirectIn(op.key.pointer, op.key.size)),
+                            size,
+                            // Padding adds at most one block to the ciphertext.
+                            @ptrCast(try s.indirectOut(op.outputs.pointer, size + 16)),
+                            @ptrCast(try s.out(op.outputs.size)),
+                        );
+                    },
+                    .EcdsaSecp256k1 => |op| {
+                        const size: usize = @truncate(m.getSlot(op.hashed_msg.size));
+                        blackbox.blackbox_secp256k1_verify_signature(
+                            @ptrCast(try s.indirectIn(op.hashed_msg.pointer, size)),
+                            size,
+                            @ptrCast(try s.indirectIn(op.public_key_x.pointer, op.public_key_x.size)),
+                            @ptrCast(try s.indirectIn(op.public_key_y.pointer, op.public_key_y.size)),
+                            @ptrCast(try s.indirectIn(op.signature.pointer, op.signature.size)),
+                            @ptrCast(try s.out(op.result)),
+                        );
+                    },
+                    .EcdsaSecp256r1 => |op| {
+                        const size: usize = @truncate(m.getSlot(op.hashed_msg.size));
+                        blackbox.blackbox_secp256r1_verify_signature(
+                            @ptrCast(try s.indirectIn(op.hashed_msg.pointer, size)),
+                            size,
+                            @ptrCast(try s.indirectIn(op.public_key_x.pointer, op.public_key_x.size)),
+                            @ptrCast(try s.indirectIn(op.public_key_y.pointer, op.public_key_y.size)),
+                            @ptrCast(try s.indirectIn(op.signature.pointer, op.signature.size)),
+                            @ptrCast(try s.out(op.result)),
+                        );
+                    },
+                    // .SchnorrVerify => |op| {
+                    //     blackbox.blackbox_schnorr_verify_signature(
+                    //         @ptrCast(self.mem.getIndirectSlotAddr(op.message.pointer)),
+                    //         @truncate(self.mem.getSlot(op.message.size)),
+                    //         @ptrCast(self.mem.getSlotAddr(op.public_key_x)),
+                    //         @ptrCast(self.mem.getSlotAddr(op.public_key_y)),
+                    //         @ptrCast(self.mem.getIndirectSlotAddr(op.signature.pointer)),
+                    //         @ptrCast(self.mem.getSlotAddr(op.result)),
+                    //     );
+                    // },
+                    .MultiScalarMul => |op| {
+                        const num_points: usize = @truncate(m.getSlot(op.points.size));
+                        const num_scalars: usize = @truncate(m.getSlot(op.scalars.size));
+                        blackbox.blackbox_msm(
+                            @ptrCast(try s.indirectIn(op.points.pointer, num_points)),
+                            num_points,
+                            @ptrCast(try s.indirectIn(op.scalars.pointer, num_scalars)),
+                            @ptrCast(try s.indirectOut(op.outputs.pointer, op.outputs.size)),
+                        );
+                    },
+                    .EmbeddedCurveAdd => |op| {
+                        blackbox.blackbox_ecc_add(
+                            @ptrCast(try s.in(op.input1_x)),
+                            @ptrCast(try s.in(op.input1_y)),
+                            @ptrCast(try s.in(op.input1_infinite)),
+                            @ptrCast(try s.in(op.input2_x)),
+                            @ptrCast(try s.in(op.input2_y)),
+                            @ptrCast(try s.in(op.input2_infinite)),
+                            @ptrCast(try s.indirectOut(op.result.pointer, op.result.size)),
+                        );
+                    },
+                    else => {
+                        std.debug.print("Unimplemented: {}\n", .{blackbox_op});
+                        unreachable;
+                    },
+                }
+                s.commit();
+                self.pc += 1;
+            }
+
+            /// Returns `size` slots from `index`, normalized, for use as return or revert data.
+            fn returnData(self: *Self, index: usize, size: usize) ![]align(32) u256 {
+                const data = if (backend == .flat)
+                    mem(self).memory[index .. index + size]
+                else
+                    try mem(self).stage(index, size);
+                for (data) |*v| fieldOps.bn254_fr_normalize(@ptrCast(v));
+                return data;
+            }
+
+            fn processStop(self: *Self, _: *const Instruction) !void {
+                const op = &self.opcodes[self.pc].Stop;
+                self.halted = true;
+                const slot: usize = @intCast(mem(self).getSlot(op.return_data.pointer));
+                const size: usize = @intCast(mem(self).getSlot(op.return_data.size));
+                self.return_data = try returnData(self, slot, size);
+            }
+
+            fn processTrap(self: *Self, _: *const Instruction) !void {
+                const op = &self.opcodes[self.pc].Trap;
+                self.trap();
+                const slot = mem(self).resolveSlot(op.revert_data.pointer);
+                const size = mem(self).resolveSlot(op.revert_data.size);
+                self.return_data = try returnData(self, slot, size);
+                std.debug.print("Trap! PC: {}, Ops executed: {}\n", .{ self.pc, self.ops_executed });
+                std.debug.print("Callstack ({} items): {any}\n", .{ self.callstack.items.len, self.callstack.items });
+            }
+        };
     }
 
-    fn processBlackbox(self: *Self, opcode: *BrilligOpcode) !void {
-        const blackbox_op = &opcode.BlackBox;
+    fn processCall(self: *Self, inst: *const Instruction) !void {
+        self.callstack.append(self.pc + 1) catch unreachable;
+        self.pc = inst.imm;
+    }
 
-        const idx = @intFromEnum(blackbox_op.*);
-        self.blackbox_counters[idx] += 1;
+    fn processReturn(self: *Self, _: *const Instruction) !void {
+        self.pc = self.callstack.pop() orelse unreachable;
+    }
 
-        switch (blackbox_op.*) {
-            .Sha256Compression => |op| {
-                blackbox.blackbox_sha256_compression(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.input.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.hash_values.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.output.pointer)),
-                );
-            },
-            .Blake2s => |op| {
-                blackbox.blackbox_blake2s(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.message.pointer)),
-                    @truncate(self.mem.getSlot(op.message.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.output.pointer)),
-                );
-            },
-            .Blake3 => |op| {
-                blackbox.blackbox_blake3(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.message.pointer)),
-                    @truncate(self.mem.getSlot(op.message.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.output.pointer)),
-                );
-            },
-            .Keccakf1600 => |op| {
-                blackbox.blackbox_keccak1600(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.message.pointer)),
-                    @truncate(self.mem.getSlotAtIndex(op.message.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.output.pointer)),
-                );
-            },
-            .Poseidon2Permutation => |op| {
-                blackbox.blackbox_poseidon2_permutation(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.message.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.output.pointer)),
-                    @truncate(self.mem.getSlot(op.message.size)),
-                );
-            },
-            .ToRadix => |op| {
-                blackbox.blackbox_to_radix(
-                    @ptrCast(self.mem.getSlotAddr(op.input)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.output_pointer)),
-                    @truncate(self.mem.getSlot(op.num_limbs)),
-                    @truncate(self.mem.getSlot(op.radix)),
-                );
-            },
-            .AES128Encrypt => |op| {
-                blackbox.blackbox_aes_encrypt(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.inputs.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.iv.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.key.pointer)),
-                    @truncate(self.mem.getSlot(op.inputs.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.outputs.pointer)),
-                    @ptrCast(self.mem.getSlotAddr(op.outputs.size)),
-                );
-            },
-            .EcdsaSecp256k1 => |op| {
-                blackbox.blackbox_secp256k1_verify_signature(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.hashed_msg.pointer)),
-                    @truncate(self.mem.getSlot(op.hashed_msg.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.public_key_x.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.public_key_y.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.signature.pointer)),
-                    @ptrCast(self.mem.getSlotAddr(op.result)),
-                );
-            },
-            .EcdsaSecp256r1 => |op| {
-                blackbox.blackbox_secp256r1_verify_signature(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.hashed_msg.pointer)),
-                    @truncate(self.mem.getSlot(op.hashed_msg.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.public_key_x.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.public_key_y.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.signature.pointer)),
-                    @ptrCast(self.mem.getSlotAddr(op.result)),
-                );
-            },
-            // .SchnorrVerify => |op| {
-            //     blackbox.blackbox_schnorr_verify_signature(
-            //         @ptrCast(self.mem.getIndirectSlotAddr(op.message.pointer)),
-            //         @truncate(self.mem.getSlot(op.message.size)),
-            //         @ptrCast(self.mem.getSlotAddr(op.public_key_x)),
-            //         @ptrCast(self.mem.getSlotAddr(op.public_key_y)),
-            //         @ptrCast(self.mem.getIndirectSlotAddr(op.signature.pointer)),
-            //         @ptrCast(self.mem.getSlotAddr(op.result)),
-            //     );
-            // },
-            .MultiScalarMul => |op| {
-                blackbox.blackbox_msm(
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.points.pointer)),
-                    @truncate(self.mem.getSlot(op.points.size)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.scalars.pointer)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.outputs.pointer)),
-                );
-            },
-            .EmbeddedCurveAdd => |op| {
-                blackbox.blackbox_ecc_add(
-                    @ptrCast(self.mem.getSlotAddr(op.input1_x)),
-                    @ptrCast(self.mem.getSlotAddr(op.input1_y)),
-                    @ptrCast(self.mem.getSlotAddr(op.input1_infinite)),
-                    @ptrCast(self.mem.getSlotAddr(op.input2_x)),
-                    @ptrCast(self.mem.getSlotAddr(op.input2_y)),
-                    @ptrCast(self.mem.getSlotAddr(op.input2_infinite)),
-                    @ptrCast(self.mem.getIndirectSlotAddr(op.result.pointer)),
-                );
-            },
-            else => {
-                std.debug.print("Unimplemented: {}\n", .{blackbox_op});
-                unreachable;
-            },
-        }
-        self.pc += 1;
+    fn processJump(self: *Self, inst: *const Instruction) !void {
+        self.pc = inst.imm;
     }
 
-    fn processForeignCall(self: *Self, opcode: *BrilligOpcode) !void {
-        const fc = &opcode.ForeignCall;
+    fn processForeignCall(self: *Self, _: *const Instruction) !void {
+        const fc = &self.opcodes[self.pc].ForeignCall;
         self.fc_handler.handleForeignCall(&self.mem, fc) catch |err| {
             std.debug.print("Foreign call '{s}' failed with error: {}\n", .{ fc.function, err });
             return err;
@@ -493,54 +765,16 @@ pub const BrilligVm = struct {
         self.pc += 1;
     }
 
-    fn processStop(self: *Self, opcode: *BrilligOpcode) !void {
-        const op = &opcode.Stop;
-        self.halted = true;
-        const slot: usize = @intCast(self.mem.getSlot(op.return_data.pointer));
-        const size: usize = @intCast(self.mem.getSlot(op.return_data.size));
-        self.return_data = self.mem.memory[slot .. slot + size];
-        for (self.return_data) |*v| fieldOps.bn254_fr_normalize(@ptrCast(v));
-    }
-
-    fn processTrap(self: *Self, opcode: *BrilligOpcode) !void {
-        const op = &opcode.Trap;
-        self.trap();
-        const slot = self.mem.resolveSlot(op.revert_data.pointer);
-        const size = self.mem.resolveSlot(op.revert_data.size);
-        self.return_data = self.mem.memory[slot .. slot + size];
-        for (self.return_data) |*v| fieldOps.bn254_fr_normalize(@ptrCast(v));
-        std.debug.print("Trap! PC: {}, Ops executed: {}\n", .{ self.pc, self.ops_executed });
-        std.debug.print("Callstack ({} items): {any}\n", .{ self.callstack.items.len, self.callstack.items });
-    }
-
     pub fn dumpStats(self: *Self) void {
-        std.debug.print("Time taken: {}us\n", .{self.time_taken / 1000});
-        std.debug.print("Opcodes executed: {}\n", .{self.ops_executed});
-        std.debug.print("Max slot set: {}\n", .{self.mem.max_slot_set});
-
-        var total_cycles: u64 = 0;
-        for (self.opcode_time) |x| total_cycles += x;
-
-        std.debug.print("Opcode hit / time:\n", .{});
-        inline for (@typeInfo(io.BrilligOpcode).@"union".fields, 0..) |enumField, idx| {
-            std.debug.print("  {s}: {} / {d:.2}%\n", .{
-                enumField.name,
-                self.opcode_counters[idx],
-                @as(f64, @floatFromInt(self.opcode_time[idx] * 100)) / @as(f64, @floatFromInt(total_cycles)),
-            });
-        }
-
-        std.debug.print("Blackbox calls:\n", .{});
-        inline for (@typeInfo(io.BlackBoxOp).@"union".fields, 0..) |enumField, idx| {
-            std.debug.print("  {s}: {}\n", .{ enumField.name, self.blackbox_counters[idx] });
-        }
+        var stats = Stats{};
+        stats.add(self);
+        stats.dump();
+        std.debug.print("Max slot set: {}\n", .{self.mem.maxSlotSet()});
     }
 
-    fn binaryIntOp(self: *Self, comptime int_type: type, op: anytype) int_type {
-        const lhs: int_type = @truncate(self.mem.getSlot(op.lhs));
-        const rhs: int_type = @truncate(self.mem.getSlot(op.rhs));
+    inline fn binaryIntOp(self: *Self, comptime int_type: type, comptime op: io.BinaryIntOp, lhs: int_type, rhs: int_type) int_type {
         const bit_size = @bitSizeOf(int_type);
-        const r = switch (op.op) {
+        const r = switch (op) {
             .Add => lhs +% rhs,
             .Sub => lhs -% rhs,
             .Div => if (rhs != 0) lhs / rhs else blk: {
@@ -561,37 +795,110 @@ pub const BrilligVm = struct {
         return r;
     }
 
-    inline fn unaryNot(self: *Self, comptime int_type: type, op: anytype) int_type {
-        return @truncate(~self.mem.getSlot(op.source));
+    /// Returns false on division by zero.
+    inline fn binaryFieldOp(
+        comptime op: io.BinaryFieldOp,
+        lhs: *align(32) u256,
+        rhs: *align(32) u256,
+        dest: *align(32) u256,
+    ) bool {
+        switch (op) {
+            .Add => fieldOps.bn254_fr_add(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .Mul => fieldOps.bn254_fr_mul(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .Sub => fieldOps.bn254_fr_sub(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .Div => return fieldOps.bn254_fr_div(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .Equals => fieldOps.bn254_fr_eq(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .LessThan => fieldOps.bn254_fr_lt(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .LessThanEquals => fieldOps.bn254_fr_leq(@ptrCast(lhs), @ptrCast(rhs), @ptrCast(dest)),
+            .IntegerDiv => {
+                fieldOps.bn254_fr_normalize(@ptrCast(lhs));
+                fieldOps.bn254_fr_normalize(@ptrCast(rhs));
+                dest.* = lhs.* / rhs.*;
+            },
+        }
+        return true;
     }
 
     inline fn trap(self: *Self) void {
         self.trapped = true;
         self.halted = true;
     }
-
-    pub inline fn setSlot(self: *Self, mem_address: io.MemoryAddress, value: u256) void {
-        self.setSlotAtIndex(mem_address.resolve(self.mem.memory), value);
-    }
-
-    inline fn setSlotAtIndex(self: *Self, index: usize, value: u256) void {
-        self.mem.setSlotAtIndex(index, value);
-
-        if (self.hooks) |*hooks| {
-            var f align(32) = value;
-            fieldOps.bn254_fr_normalize(@ptrCast(&f));
-            hooks.trackMemoryWrite(index, f);
-        }
-    }
 };
 
-fn getBitSize(int_size: io.IntegerBitSize) u8 {
+fn IntType(comptime int_size: io.IntegerBitSize) type {
     return switch (int_size) {
-        .U1 => 1,
-        .U8 => 8,
-        .U16 => 16,
-        .U32 => 32,
-        .U64 => 64,
-        .U128 => 128,
+        .U1 => u1,
+        .U8 => u8,
+        .U16 => u16,
+        .U32 => u32,
+        .U64 => u64,
+        .U128 => u128,
+    };
+}
+
+test "brillig execute loop variants agree" {
+    const allocator = std.testing.allocator;
+    const n = 1000;
+    var opcodes = test_programs.countingLoop(n);
+    var code = try Bytecode.init(allocator, &opcodes);
+    defer code.deinit();
+    var fc_handler = try foreign_call.Dispatcher.init(allocator);
+    defer fc_handler.deinit();
+    var pool = MemoryPool.init(allocator, 1024, .flat);
+    defer pool.deinit();
+    var calldata = [_]u256{};
+
+    const Run = struct { options: ExecuteOptions, hooks: ?BrilligVmHooks };
+    const runs = [_]Run{
+        .{ .options = .{}, .hooks = null },
+        .{ .options = .{ .collect_stats = true }, .hooks = null },
+        .{ .options = .{ .sample_rate = 10 }, .hooks = null },
+        .{ .options = .{}, .hooks = test_programs.noopHooks() },
     };
+    var ops_executed: ?u64 = null;
+    for (runs) |r| {
+        var vm = try BrilligVm.init(allocator, &calldata, fc_handler.fcDispatcher(), r.hooks, .{ .memory_pool = &pool });
+        defer vm.deinit();
+        try vm.executeVm(&code, r.options);
+        try std.testing.expectEqual(n, vm.return_data[0]);
+        if (ops_executed) |ops| try std.testing.expectEqual(ops, vm.ops_executed);
+        ops_executed = vm.ops_executed;
+    }
+
+    // Only the debug tables pass memory writes to hooks, so the other loops never touch them.
+    const Writes = struct {
+        var count: usize = 0;
+        fn track(_: *anyopaque, _: usize, _: u256) void {
+            count += 1;
+        }
+    };
+    var hooks = test_programs.noopHooks();
+    hooks.trackMemoryWriteFn = &Writes.track;
+    for ([_]bool{ false, true }) |debug| {
+        var vm = try BrilligVm.init(allocator, &calldata, fc_handler.fcDispatcher(), hooks, .{ .memory_pool = &pool });
+        defer vm.deinit();
+        Writes.count = 0;
+        vm.opcodes = code.opcodes;
+        vm.constants = code.constants;
+        const jump_table = &BrilligVm.jump_tables[@intFromBool(debug)][@intFromEnum(Memory.Backend.flat)];
+        if (debug) {
+            try vm.run(.debug, code.instructions, jump_table, .{});
+        } else {
+            try vm.run(.release, code.instructions, jump_table, .{});
+        }
+        try std.testing.expectEqual(n, vm.return_data[0]);
+        try std.testing.expectEqual(debug, Writes.count > 0);
+    }
+
+    // Fuse the pairs that were hot in a training run. The result and op count must be unchanged.
+    var training = try BrilligVm.init(allocator, &calldata, fc_handler.fcDispatcher(), null, .{ .memory_pool = &pool });
+    defer training.deinit();
+    try training.executeVm(&code, .{ .collect_stats = true });
+    try code.fuse(&training.opcode_counters);
+    try std.testing.expect(code.fused != null);
+    var vm = try BrilligVm.init(allocator, &calldata, fc_handler.fcDispatcher(), null, .{ .memory_pool = &pool });
+    defer vm.deinit();
+    try vm.executeVm(&code, .{});
+    try std.testing.expectEqual(n, vm.return_data[0]);
+    try std.testing.expectEqual(ops_executed.?, vm.ops_executed);
 }
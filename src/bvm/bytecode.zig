@@ -0,0 +1,390 @@
+const std = @import("std");
+const io = @import("io.zig");
+const F = @import("../bn254/fr.zig").Fr;
+const BrilligOpcode = io.BrilligOpcode;
+
+pub const Tag = std.meta.Tag(BrilligOpcode);
+
+const num_field_ops = @typeInfo(io.BinaryFieldOp).@"enum".fields.len;
+const num_int_ops = @typeInfo(io.BinaryIntOp).@"enum".fields.len;
+const num_int_sizes = @typeInfo(io.IntegerBitSize).@"enum".fields.len;
+const num_tags = @typeInfo(Tag).@"enum".fields.len;
+
+/// A pre-decoded memory address.
+/// Relative operands are offset by the stack pointer held in slot 0, so can only be resolved at execution time.
+pub const Operand = packed struct(u32) {
+    value: u31 = 0,
+    relative: bool = false,
+
+    pub fn init(addr: io.MemoryAddress) !Operand {
+        if (addr.value > std.math.maxInt(u31)) return error.OperandOutOfRange;
+        return .{ .value = @intCast(addr.value), .relative = addr.relative == 1 };
+    }
+
+    pub inline fn resolve(self: Operand, mem: anytype) usize {
+        if (self.relative) {
+            return @as(usize, @truncate(mem[0] + self.value));
+        } else {
+            return self.value;
+        }
+    }
+};
+
+/// A single lowered instruction.
+/// There is exactly one instruction per source opcode, so a pc indexes both the instructions and the opcodes.
+/// This keeps debug info, error contexts and the callstack in terms of the original bytecode.
+pub const Instruction = struct {
+    /// Index into the VM's table of specialised handlers (see `handlerIndex`).
+    handler: u16,
+    /// Tag of the source opcode, used for stats.
+    tag: Tag,
+    a: Operand = .{},
+    b: Operand = .{},
+    c: Operand = .{},
+    d: Operand = .{},
+    /// Jump target, or index into the constant pool.
+    imm: u32 = 0,
+};
+
+/// How many specialised handlers exist for a given opcode.
+/// Opcodes with a sub-operation or bit size get a handler per combination, so no decoding happens at execution time.
+pub fn variantCount(tag: Tag) u16 {
+    return switch (tag) {
+        .BinaryFieldOp => num_field_ops,
+        .BinaryIntOp => num_int_sizes * num_int_ops,
+        .Not => num_int_sizes,
+        .Cast => 1 + num_int_sizes,
+        else => 1,
+    };
+}
+
+const handler_base = blk: {
+    var base: [num_tags]u16 = undefined;
+    var n: u16 = 0;
+    for (0..num_tags) |i| {
+        base[i] = n;
+        n += variantCount(@enumFromInt(i));
+    }
+    break :blk base;
+};
+
+const num_opcode_handlers = handler_base[num_tags - 1] + variantCount(@enumFromInt(num_tags - 1));
+
+/// Pairs of adjacent opcodes that can be executed as a single superinstruction.
+/// The first opcode of each pair never branches or traps, so the second always follows it.
+pub const Fusion = enum {
+    /// Const then BinaryIntOp, e.g. bumping a loop counter.
+    const_int_op,
+    /// Load then BinaryFieldOp, e.g. accumulating over an array.
+    load_field_op,
+    /// An integer comparison then JumpIfNot, e.g. a loop condition.
+    int_cmp_jump_if_not,
+    /// Mov then Mov, e.g. shuffling call arguments.
+    mov_mov,
+
+    /// The tags of the fused pair.
+    pub fn tags(self: Fusion) [2]Tag {
+        return switch (self) {
+            .const_int_op => .{ .Const, .BinaryIntOp },
+            .load_field_op => .{ .Load, .BinaryFieldOp },
+            .int_cmp_jump_if_not => .{ .BinaryIntOp, .JumpIfNot },
+            .mov_mov => .{ .Mov, .Mov },
+        };
+    }
+
+    /// How many specialised handlers exist for the fusion, one per variant of the specialised opcode.
+    pub fn variantCount(self: Fusion) u16 {
+        return switch (self) {
+            .const_int_op => num_int_sizes * num_int_ops,
+            .load_field_op => num_field_ops,
+            .int_cmp_jump_if_not => num_int_sizes * int_cmp_ops.len,
+            .mov_mov => 1,
+        };
+    }
+};
+
+/// Comparisons that can be fused with a following JumpIfNot.
+pub const int_cmp_ops = [_]io.BinaryIntOp{ .Equals, .LessThan, .LessThanEquals };
+
+const num_fusions = @typeInfo(Fusion).@"enum".fields.len;
+
+const fusion_base = blk: {
+    var base: [num_fusions]u16 = undefined;
+    var n: u16 = num_opcode_handlers;
+    for (0..num_fusions) |i| {
+        base[i] = n;
+        n += Fusion.variantCount(@enumFromInt(i));
+    }
+    break :blk base;
+};
+
+pub const num_handlers = fusion_base[num_fusions - 1] + Fusion.variantCount(@enumFromInt(num_fusions - 1));
+
+pub fn handlerIndex(tag: Tag, variant: u16) u16 {
+    return handler_base[@intFromEnum(tag)] + variant;
+}
+
+pub fn fusedHandlerIndex(fusion: Fusion, variant: u16) u16 {
+    return fusion_base[@intFromEnum(fusion)] + variant;
+}
+
+pub fn intOpVariant(bit_size: io.IntegerBitSize, op: io.BinaryIntOp) u16 {
+    return @as(u16, @intFromEnum(bit_size)) * num_int_ops + @intFromEnum(op);
+}
+
+pub fn intCmpVariant(bit_size: io.IntegerBitSize, op: io.BinaryIntOp) ?u16 {
+    const i = std.mem.indexOfScalar(io.BinaryIntOp, &int_cmp_ops, op) orelse return null;
+    return @as(u16, @intFromEnum(bit_size)) * int_cmp_ops.len + @as(u16, @intCast(i));
+}
+
+pub fn castVariant(bit_size: io.BitSize) u16 {
+    return switch (bit_size) {
+        .Field => 0,
+        .Integer => |s| 1 + @as(u16, @intFromEnum(s)),
+    };
+}
+
+/// Converts a constant to the representation the VM holds in memory.
+/// Fields are held in montgomery form, with the high bit set to mark them as such.
+fn constValue(bit_size: io.BitSize, value: u256) u256 {
+    return switch (bit_size) {
+        .Field => @as(u256, @bitCast(F.from_int(value).limbs)) | (1 << 255),
+        .Integer => value,
+    };
+}
+
+/// An unconstrained function lowered into a dense instruction stream.
+/// Built once per function, and executed by `BrilligVm.executeVm`.
+/// Holds a reference to the source opcodes, which must outlive it.
+pub const Bytecode = struct {
+    allocator: std.mem.Allocator,
+    opcodes: []BrilligOpcode,
+    instructions: []Instruction,
+    constants: []u256,
+    /// Whether the function makes foreign calls, and so may not be a pure function of its calldata.
+    has_foreign_calls: bool,
+    /// A copy of `instructions` with hot opcode pairs fused, if `fuse` has been called.
+    /// Only the first instruction of a pair is replaced, so jumps into the middle of a pair still work.
+    fused: ?[]Instruction = null,
+
+    pub fn init(allocator: std.mem.Allocator, opcodes: []BrilligOpcode) !Bytecode {
+        const instructions = try allocator.alloc(Instruction, opcodes.len);
+        errdefer allocator.free(instructions);
+        var constants = std.ArrayList(u256).init(allocator);
+        errdefer constants.deinit();
+        var has_foreign_calls = false;
+
+        for (opcodes, instructions) |*opcode, *inst| {
+            const tag: Tag = opcode.*;
+            inst.* = .{ .handler = handlerIndex(tag, 0), .tag = tag };
+            switch (opcode.*) {
+                .BinaryFieldOp => |op| {
+                    inst.handler = handlerIndex(tag, @intFromEnum(op.op));
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.lhs);
+                    inst.c = try Operand.init(op.rhs);
+                },
+                .BinaryIntOp => |op| {
+                    inst.handler = handlerIndex(tag, intOpVariant(op.bit_size, op.op));
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.lhs);
+                    inst.c = try Operand.init(op.rhs);
+                },
+                .Not => |op| {
+                    inst.handler = handlerIndex(tag, @intFromEnum(op.bit_size));
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.source);
+                },
+                .Cast => |op| {
+                    inst.handler = handlerIndex(tag, castVariant(op.bit_size));
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.source);
+                },
+                .JumpIfNot => |op| {
+                    inst.a = try Operand.init(op.condition);
+                    inst.imm = try jumpTarget(op.location, opcodes.len);
+                },
+                .JumpIf => |op| {
+                    inst.a = try Operand.init(op.condition);
+                    inst.imm = try jumpTarget(op.location, opcodes.len);
+                },
+                .Jump => |op| inst.imm = try jumpTarget(op.location, opcodes.len),
+                .Call => |op| inst.imm = try jumpTarget(op.location, opcodes.len),
+                .CalldataCopy => |op| {
+                    inst.a = try Operand.init(op.destination_address);
+                    inst.b = try Operand.init(op.size_address);
+                    inst.c = try Operand.init(op.offset_address);
+                },
+                .Const => |op| {
+                    inst.a = try Operand.init(op.destination);
+                    inst.imm = @intCast(constants.items.len);
+                    try constants.append(constValue(op.bit_size, op.value));
+                },
+                .IndirectConst => |op| {
+                    inst.a = try Operand.init(op.destination_pointer);
+                    inst.imm = @intCast(constants.items.len);
+                    try constants.append(constValue(op.bit_size, op.value));
+                },
+                .Mov => |op| {
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.source);
+                },
+                .ConditionalMov => |op| {
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.source_a);
+                    inst.c = try Operand.init(op.source_b);
+                    inst.d = try Operand.init(op.condition);
+                },
+                .Load => |op| {
+                    inst.a = try Operand.init(op.destination);
+                    inst.b = try Operand.init(op.source_pointer);
+                },
+                .Store => |op| {
+                    inst.a = try Operand.init(op.destination_pointer);
+                    inst.b = try Operand.init(op.source);
+                },
+                // These are rare or heavyweight, and are executed from the source opcode.
+                .ForeignCall => has_foreign_calls = true,
+                .Return, .BlackBox, .Trap, .Stop => {},
+            }
+        }
+
+        return .{
+            .allocator = allocator,
+            .opcodes = opcodes,
+            .instructions = instructions,
+            .constants = try constants.toOwnedSlice(),
+            .has_foreign_calls = has_foreign_calls,
+        };
+    }
+
+    pub fn deinit(self: *Bytecode) void {
+        self.allocator.free(self.instructions);
+        self.allocator.free(self.constants);
+        if (self.fused) |fused| self.allocator.free(fused);
+    }
+
+    /// Builds the fused instruction stream.
+    /// Given the opcode counters of a training run, only pairs whose opcodes are both hot are fused.
+    /// Without counters, every fusable pair is fused.
+    pub fn fuse(self: *Bytecode, opcode_counters: ?[]const u64) !void {
+        var enabled = std.EnumSet(Fusion).initFull();
+        if (opcode_counters) |counters| {
+            var total: u64 = 0;
+            for (counters) |c| total += c;
+            for (std.enums.values(Fusion)) |fusion| {
+                for (fusion.tags()) |tag| {
+                    if (counters[@intFromEnum(tag)] * 100 < total * hot_percent) enabled.remove(fusion);
+                }
+            }
+        }
+
+        const fused = try self.allocator.dupe(Instruction, self.instructions);
+        if (fused.len > 1) {
+            for (fused[0 .. fused.len - 1], self.instructions[1..]) |*inst, next| {
+                if (fusedHandler(inst.*, next, enabled)) |handler| inst.handler = handler;
+            }
+        }
+        if (self.fused) |old| self.allocator.free(old);
+        self.fused = fused;
+    }
+};
+
+/// The share of executed opcodes (in percent) an opcode must account for to be considered for fusion.
+const hot_percent = 1;
+
+fn fusedHandler(first: Instruction, second: Instruction, enabled: std.EnumSet(Fusion)) ?u16 {
+    const variant = second.handler - handlerIndex(second.tag, 0);
+    var fusion: Fusion = undefined;
+    var fused_variant: u16 = 0;
+    switch (first.tag) {
+        .Const => {
+            if (second.tag != .BinaryIntOp) return null;
+            fusion = .const_int_op;
+            fused_variant = variant;
+        },
+        .Load => {
+            if (second.tag != .BinaryFieldOp) return null;
+            fusion = .load_field_op;
+            fused_variant = variant;
+        },
+        .Mov => {
+            if (second.tag != .Mov) return null;
+            fusion = .mov_mov;
+        },
+        .BinaryIntOp => {
+            if (second.tag != .JumpIfNot) return null;
+            const first_variant = first.handler - handlerIndex(first.tag, 0);
+            const bit_size: io.IntegerBitSize = @enumFromInt(first_variant / num_int_ops);
+            const op: io.BinaryIntOp = @enumFromInt(first_variant % num_int_ops);
+            fusion = .int_cmp_jump_if_not;
+            fused_variant = intCmpVariant(bit_size, op) orelse return null;
+        },
+        else => return null,
+    }
+    if (!enabled.contains(fusion)) return null;
+    return fusedHandlerIndex(fusion, fused_variant);
+}
+
+fn jumpTarget(location: u64, len: usize) !u32 {
+    if (location >= len) return error.InvalidJumpTarget;
+    return @intCast(location);
+}
+
+test "lowering" {
+    var opcodes = [_]BrilligOpcode{
+        .{ .Const = .{ .destination = .{ .relative = 0, .value = 1 }, .bit_size = .Field, .value = 5 } },
+        .{ .Const = .{ .destination = .{ .relative = 1, .value = 2 }, .bit_size = .{ .Integer = .U32 }, .value = 7 } },
+        .{ .Jump = .{ .location = 0 } },
+    };
+    var bytecode = try Bytecode.init(std.testing.allocator, &opcodes);
+    defer bytecode.deinit();
+
+    try std.testing.expectEqual(3, bytecode.instructions.len);
+    try std.testing.expectEqual(2, bytecode.constants.len);
+    var f align(32) = bytecode.constants[0];
+    @import("../blackbox/field.zig").bn254_fr_normalize(@ptrCast(&f));
+    try std.testing.expectEqual(5, f);
+    try std.testing.expectEqual(7, bytecode.constants[1]);
+    try std.testing.expect(bytecode.instructions[1].a.relative);
+    try std.testing.expectEqual(0, bytecode.instructions[2].imm);
+
+    opcodes[2].Jump.location = 3;
+    try std.testing.expectError(error.InvalidJumpTarget, Bytecode.init(std.testing.allocator, &opcodes));
+}
+
+test "fusion" {
+    const at = struct {
+        fn f(slot: u64) io.MemoryAddress {
+            return .{ .relative = 0, .value = slot };
+        }
+    }.f;
+    var opcodes = [_]BrilligOpcode{
+        .{ .Const = .{ .destination = at(1), .bit_size = .{ .Integer = .U32 }, .value = 1 } },
+        .{ .BinaryIntOp = .{ .destination = at(2), .op = .LessThan, .bit_size = .U32, .lhs = at(1), .rhs = at(1) } },
+        .{ .JumpIfNot = .{ .condition = at(2), .location = 0 } },
+        .{ .Mov = .{ .destination = at(3), .source = at(1) } },
+        .{ .Stop = .{ .return_data = .{ .pointer = at(0), .size = at(0) } } },
+    };
+    var bytecode = try Bytecode.init(std.testing.allocator, &opcodes);
+    defer bytecode.deinit();
+
+    try bytecode.fuse(null);
+    const fused = bytecode.fused.?;
+    try std.testing.expectEqual(
+        fusedHandlerIndex(.const_int_op, intOpVariant(.U32, .LessThan)),
+        fused[0].handler,
+    );
+    try std.testing.expectEqual(fusedHandlerIndex(.int_cmp_jump_if_not, intCmpVariant(.U32, .LessThan).?), fused[1].handler);
+    // The second of each pair is left intact, so it can still be jumped to.
+    try std.testing.expectEqual(bytecode.instructions[2], fused[2]);
+    try std.testing.expectEqual(bytecode.instructions[3], fused[3]);
+
+    // Pairs with a cold opcode aren't fused.
+    var counters = [_]u64{0} ** num_tags;
+    counters[@intFromEnum(Tag.Const)] = 100;
+    counters[@intFromEnum(Tag.BinaryIntOp)] = 100;
+    try bytecode.fuse(&counters);
+    try std.testing.expect(bytecode.fused.?[0].handler != bytecode.instructions[0].handler);
+    try std.testing.expectEqual(bytecode.instructions[1], bytecode.fused.?[1]);
+}
@@ -0,0 +1,156 @@
+const std = @import("std");
+
+/// A memory backend that separates the narrow integer slots from the wide ones.
+/// The low 64 bits of every slot are held densely, which is all most integers (u1..u64) ever need.
+/// The rest of a wider value (a u128 or field element) spills into pages of high halves, flagged by a bit per slot.
+/// Pages are only allocated once a slot in them goes wide, so memory used only for integers costs 8 bytes a slot.
+/// Integer heavy code (loops, indexing, bit twiddling) therefore touches a quarter of the cache lines of the flat
+/// layout, and never touches the high pages at all.
+/// Slots can't be addressed by pointer, so callers that need contiguous `u256`s (e.g. blackboxes) stage them.
+pub const CompactMemory = struct {
+    const page_slots = 512;
+    const HiPage = [page_slots]u192;
+
+    allocator: std.mem.Allocator,
+    lo: []align(4096) u64,
+    // The high bits of wide slots, a page per page_slots slots, allocated on first use.
+    hi_pages: []?*HiPage,
+    // One bit per slot, set if its high bits in `hi_pages` are in use.
+    wide: []u64,
+    max_slot_set: u64 = 0,
+    // Backs staged slots. Released once the staging caller is done.
+    scratch: std.heap.ArenaAllocator,
+
+    pub fn init(allocator: std.mem.Allocator, num_slots: usize) !CompactMemory {
+        const lo = try allocator.alignedAlloc(u64, 4096, num_slots);
+        errdefer allocator.free(lo);
+        const hi_pages = try allocator.alloc(?*HiPage, (num_slots + page_slots - 1) / page_slots);
+        errdefer allocator.free(hi_pages);
+        @memset(hi_pages, null);
+        const wide = try allocator.alloc(u64, (num_slots + 63) / 64);
+        @memset(wide, 0);
+        return .{
+            .allocator = allocator,
+            .lo = lo,
+            .hi_pages = hi_pages,
+            .wide = wide,
+            .scratch = std.heap.ArenaAllocator.init(allocator),
+        };
+    }
+
+    pub fn deinit(self: *CompactMemory) void {
+        for (self.hi_pages) |page| if (page) |p| self.allocator.destroy(p);
+        self.allocator.free(self.lo);
+        self.allocator.free(self.hi_pages);
+        self.allocator.free(self.wide);
+        self.scratch.deinit();
+    }
+
+    /// Zeroes every slot up to the highest slot set.
+    /// High pages are kept for reuse. Their stale contents are unreachable once the wide bits are cleared.
+    pub fn reset(self: *CompactMemory) void {
+        const n = @min(self.max_slot_set + 1, self.lo.len);
+        @memset(self.lo[0..n], 0);
+        @memset(self.wide[0 .. (n + 63) / 64], 0);
+        self.max_slot_set = 0;
+        _ = self.scratch.reset(.retain_capacity);
+    }
+
+    pub inline fn resolveSlot(self: *CompactMemory, mem_address: anytype) usize {
+        return mem_address.resolve(self.lo);
+    }
+
+    pub inline fn getSlot(self: *CompactMemory, mem_address: anytype) u256 {
+        return self.getSlotAtIndex(mem_address.resolve(self.lo));
+    }
+
+    pub inline fn getSlotAtIndex(self: *CompactMemory, index: usize) u256 {
+        const lo: u256 = self.lo[index];
+        if (self.wide[index / 64] & wideBit(index) != 0) {
+            return (@as(u256, self.hi_pages[index / page_slots].?[index % page_slots]) << 64) | lo;
+        }
+        return lo;
+    }
+
+    pub inline fn getIndirectSlot(self: *CompactMemory, mem_address: anytype) u256 {
+        return self.getSlotAtIndex(@truncate(self.getSlot(mem_address)));
+    }
+
+    pub inline fn setSlot(self: *CompactMemory, mem_address: anytype, value: u256) void {
+        self.setSlotAtIndex(mem_address.resolve(self.lo), value);
+    }
+
+    pub inline fn setSlotAtIndex(self: *CompactMemory, index: usize, value: u256) void {
+        if (self.max_slot_set < index) {
+            self.max_slot_set = index;
+        }
+        self.lo[index] = @truncate(value);
+        const high: u192 = @truncate(value >> 64);
+        if (high != 0) {
+            self.hiPage(index)[index % page_slots] = high;
+            self.wide[index / 64] |= wideBit(index);
+        } else {
+            self.wide[index / 64] &= ~wideBit(index);
+        }
+    }
+
+    /// Copies `n` slots from `index` into contiguous scratch space.
+    /// Write any changes back with `unstage`, and free the scratch space with `releaseStaged`.
+    pub fn stage(self: *CompactMemory, index: usize, n: usize) ![]align(32) u256 {
+        const slots = try self.scratch.allocator().alignedAlloc(u256, 32, n);
+        for (slots, 0..) |*s, i| s.* = self.getSlotAtIndex(index + i);
+        return slots;
+    }
+
+    pub fn unstage(self: *CompactMemory, index: usize, slots: []const u256) void {
+        for (slots, 0..) |s, i| self.setSlotAtIndex(index + i, s);
+    }
+
+    pub fn releaseStaged(self: *CompactMemory) void {
+        _ = self.scratch.reset(.retain_capacity);
+    }
+
+    inline fn hiPage(self: *CompactMemory, index: usize) *HiPage {
+        const page = &self.hi_pages[index / page_slots];
+        if (page.* == null) page.* = self.allocator.create(HiPage) catch unreachable;
+        return page.*.?;
+    }
+
+    inline fn wideBit(index: usize) u64 {
+        return @as(u64, 1) << @as(u6, @truncate(index));
+    }
+};
+
+test "narrow and wide slots" {
+    var mem = try CompactMemory.init(std.testing.allocator, 2048);
+    defer mem.deinit();
+    @memset(mem.lo, 0);
+
+    const field: u256 = (1 << 255) | 12345;
+    mem.setSlotAtIndex(3, 42);
+    mem.setSlotAtIndex(70, field);
+    try std.testing.expectEqual(42, mem.getSlotAtIndex(3));
+    try std.testing.expectEqual(field, mem.getSlotAtIndex(70));
+    mem.setSlotAtIndex(600, 1 << 100);
+    try std.testing.expectEqual(1 << 100, mem.getSlotAtIndex(600));
+    // A page of only narrow integers never allocates high bits.
+    mem.setSlotAtIndex(1100, std.math.maxInt(u64));
+    try std.testing.expectEqual(std.math.maxInt(u64), mem.getSlotAtIndex(1100));
+    try std.testing.expect(mem.hi_pages[0] != null and mem.hi_pages[1] != null);
+    try std.testing.expectEqual(null, mem.hi_pages[2]);
+
+    // Narrowing a wide slot must drop its high half.
+    mem.setSlotAtIndex(70, 7);
+    try std.testing.expectEqual(7, mem.getSlotAtIndex(70));
+
+    const staged = try mem.stage(2, 2);
+    try std.testing.expectEqual(42, staged[1]);
+    staged[0] = field;
+    mem.unstage(2, staged);
+    mem.releaseStaged();
+    try std.testing.expectEqual(field, mem.getSlotAtIndex(2));
+
+    mem.reset();
+    try std.testing.expectEqual(0, mem.getSlotAtIndex(2));
+    try std.testing.expectEqual(0, mem.getSlotAtIndex(3));
+}
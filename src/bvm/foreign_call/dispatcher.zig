@@ -4,6 +4,7 @@ const marshal = @import("marshal.zig");
 const F = @import("../../bn254/fr.zig").Fr;
 const io = @import("../io.zig");
 const Mocker = @import("./mocker.zig").Mocker;
+const ForeignCallStats = @import("./stats.zig").ForeignCallStats;
 const structDispatcher = @import("./struct_dispatcher.zig").structDispatcher;
 
 pub const ForeignCallDispatcher = struct {
@@ -18,6 +19,8 @@ pub const ForeignCallDispatcher = struct {
 pub const Dispatcher = struct {
     allocator: std.mem.Allocator,
     mocker: Mocker,
+    // If set, every call is recorded.
+    stats: ?*ForeignCallStats = null,
 
     pub fn fcDispatcher(self: *Dispatcher) ForeignCallDispatcher {
         return .{
@@ -39,21 +42,32 @@ pub const Dispatcher = struct {
 
     pub fn handleForeignCall(context: *anyopaque, mem: *Memory, fc: *const io.ForeignCall) !void {
         const self: *Dispatcher = @alignCast(@ptrCast(context));
+        const stats = self.stats orelse return self.dispatch(mem, fc);
 
+        const in_slots = marshal.inputSlots(mem, fc);
+        var t = try std.time.Timer.start();
+        const result = self.dispatch(mem, fc);
+        const elapsed_ns = t.read();
+        // A failed call may not have written its outputs.
+        const out_slots = if (result) |_| marshal.outputSlots(mem, fc) else |_| 0;
+        try stats.record(fc, in_slots, out_slots, elapsed_ns);
+        return result;
+    }
+
+    fn dispatch(self: *Dispatcher, mem: *Memory, fc: *const io.ForeignCall) !void {
         // This arena allocator is for the transient memory needed for processing the call.
         var arena = std.heap.ArenaAllocator.init(self.allocator);
         defer arena.deinit();
 
-        // Extract from the VM memory, a slice of ForeignCallParam's, one per argument.
-        const params = try marshal.extractParams(arena.allocator(), mem, fc);
-
         // First see if this is a mock setup call, or a mocked call.
-        if (try self.mocker.handleForeignCall(arena.allocator(), mem, fc, params)) {
+        if (try self.mocker.handleForeignCall(arena.allocator(), mem, fc)) {
             return;
         }
 
         // We didn't find a matching function. Fallback on default foreign call handler.
         std.debug.print("Foreign call not found in txe or mocker: '{s}'\n", .{fc.function});
+        // Extract from the VM memory, a slice of ForeignCallParam's, one per argument.
+        const params = try marshal.extractParams(arena.allocator(), mem, fc);
         try marshal.handleForeignCall(arena.allocator(), mem, fc, params);
     }
 };
@@ -165,6 +165,22 @@ fn writeSliceOfValuesToMemory(
     }
 }
 
+/// Writes the leaves of the param to consecutive slots from index, without flattening it first.
+/// Returns the number of slots written.
+fn writeFlattened(mem: *Memory, index: usize, param: ForeignCallParam) usize {
+    switch (param) {
+        .Single => |value| {
+            mem.setSlotAtIndex(index, value);
+            return 1;
+        },
+        .Array => |arr| {
+            var n: usize = 0;
+            for (arr) |elem| n += writeFlattened(mem, index + n, elem);
+            return n;
+        },
+    }
+}
+
 pub fn marshalForeignCallParam(
     output: []ForeignCallParam,
     mem: *Memory,
@@ -195,19 +211,12 @@ pub fn marshalForeignCallParam(
                                 var values_idx: usize = 0;
                                 writeSliceOfValuesToMemory(mem, dst_idx, flattened, &values_idx, &value_type);
                             } else {
-                                // Simple array - but may still have nested structure in the ForeignCallParam
-                                // Need to flatten it first
-                                const flattened = fcp.flatten(arena.allocator()) catch unreachable;
-                                for (0..flattened.len) |i| {
-                                    mem.setSlotAtIndex(dst_idx + i, flattened[i]);
-                                }
+                                // Simple array - but may still have nested structure in the ForeignCallParam.
+                                _ = writeFlattened(mem, dst_idx, fcp);
                             }
                         } else {
-                            // No type info, need to flatten in case of nested structure
-                            const flattened = fcp.flatten(arena.allocator()) catch unreachable;
-                            for (0..flattened.len) |i| {
-                                mem.setSlotAtIndex(dst_idx + i, flattened[i]);
-                            }
+                            // No type info, so write it flattened in case of nested structure.
+                            _ = writeFlattened(mem, dst_idx, fcp);
                         }
                     },
                     .HeapVector => {
@@ -223,14 +232,10 @@ pub fn marshalForeignCallParam(
                                 var values_idx: usize = 0;
                                 writeSliceOfValuesToMemory(mem, dst_idx, flattened, &values_idx, &value_type);
                             } else {
-                                const flattened = fcp.flatten(arena.allocator()) catch unreachable;
-                                for (0..flattened.len) |i|
-                                    mem.setSlotAtIndex(dst_idx + i, flattened[i]);
+                                _ = writeFlattened(mem, dst_idx, fcp);
                             }
                         } else {
-                            const flattened = fcp.flatten(arena.allocator()) catch unreachable;
-                            for (0..flattened.len) |i|
-                                mem.setSlotAtIndex(dst_idx + i, flattened[i]);
+                            _ = writeFlattened(mem, dst_idx, fcp);
                         }
                     },
                     else => unreachable,
@@ -240,89 +245,6 @@ pub fn marshalForeignCallParam(
     }
 }
 
-pub fn structToForeignCallParams(allocator: std.mem.Allocator, value: anytype) ![]ForeignCallParam {
-    const T = @TypeOf(value);
-    const info = @typeInfo(T);
-
-    var result = std.ArrayList(ForeignCallParam).init(allocator);
-
-    // Check for special types first
-    if (T == F) {
-        try result.append(ForeignCallParam{ .Single = value.to_int() });
-        return result.toOwnedSlice();
-    } else if (T == ForeignCallParam) {
-        try result.append(value);
-        return result.toOwnedSlice();
-    }
-
-    switch (info) {
-        .@"struct" => |s| {
-            // Check if this struct has a toForeignCallParams method (returns array of params)
-            if (@hasDecl(T, "toForeignCallParams")) {
-                const params = value.toForeignCallParams();
-                const params_type_info = @typeInfo(@TypeOf(params));
-                if (params_type_info == .array) {
-                    try result.appendSlice(&params);
-                } else {
-                    try result.appendSlice(params);
-                }
-            } else if (@hasDecl(T, "toForeignCallParam")) {
-                // Check if this struct has a toForeignCallParam method (returns single param)
-                const func_info = @typeInfo(@TypeOf(T.toForeignCallParam));
-                if (func_info.@"fn".params.len == 1) {
-                    // Method takes no allocator
-                    try result.append(value.toForeignCallParam());
-                } else {
-                    // Method takes allocator
-                    const return_type_info = @typeInfo(func_info.@"fn".return_type.?);
-                    if (return_type_info == .error_union) {
-                        try result.append(try value.toForeignCallParam(allocator));
-                    } else {
-                        try result.append(value.toForeignCallParam(allocator));
-                    }
-                }
-            } else if (@hasDecl(T, "to_int")) {
-                // Check if this struct has a to_int method (like Field types)
-                try result.append(ForeignCallParam{ .Single = value.to_int() });
-            } else {
-                inline for (s.fields) |field| {
-                    const field_value = @field(value, field.name);
-                    const field_params = try structToForeignCallParams(allocator, field_value);
-                    try result.appendSlice(field_params);
-                }
-            }
-        },
-        .bool => {
-            try result.append(ForeignCallParam{ .Single = if (value) 1 else 0 });
-        },
-        .array => {
-            for (value) |elem| {
-                const elem_params = try structToForeignCallParams(allocator, elem);
-                try result.appendSlice(elem_params);
-            }
-        },
-        .int => {
-            try result.append(ForeignCallParam{ .Single = value });
-        },
-        .pointer => |ptr| {
-            if (ptr.size == .slice) {
-                // Handle slices by converting each element
-                for (value) |elem| {
-                    const elem_params = try structToForeignCallParams(allocator, elem);
-                    try result.appendSlice(elem_params);
-                }
-            } else {
-                @compileError("Unsupported pointer type in structToForeignCallParams: " ++ @typeName(T));
-            }
-        },
-        else => {
-            @compileError("Unsupported type in structToForeignCallParams: " ++ @typeName(T));
-        },
-    }
-
-    return result.toOwnedSlice();
-}
-
 pub fn marshalOutput(
     output: anytype,
     mem: *Memory,
@@ -339,11 +261,9 @@ pub fn marshalOutput(
     const info = @typeInfo(output_type);
     switch (info) {
         .@"struct" => {
-            // Structs need to be flattened into ForeignCallParams for marshaling
-            var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
-            defer arena.deinit();
-            const flattened = structToForeignCallParams(arena.allocator(), output.*) catch unreachable;
-            marshalForeignCallParam(flattened, mem, destinations, destination_value_types);
+            // Structs are written field by field straight into their destinations.
+            var out = OutputWriter.init(mem, destinations, destination_value_types);
+            out.write(output.*);
         },
         .array => |arr_info| {
             std.debug.assert(destinations[0] == .HeapArray);
@@ -429,14 +349,6 @@ pub fn marshalOutput(
         .void => {},
         .pointer => |ptr| {
             if (ptr.size == .slice) {
-                // // Handle slices by converting to ForeignCallParams
-                // var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
-                // defer arena.deinit();
-
-                // // Convert the slice to ForeignCallParams using the existing function
-                // const slice_value = output.*;
-                // const params = structToForeignCallParams(arena.allocator(), slice_value) catch unreachable;
-                // marshalForeignCallParam(params, mem, destinations, destination_value_types);
                 if (ptr.child == ForeignCallParam) {
                     // If the pointer is to ForeignCallParam, we can directly marshal it
                     const params = output.*;
@@ -462,6 +374,158 @@ pub fn marshalOutput(
     }
 }
 
+/// A view over the destinations of a foreign call, that results are written into in place, in order.
+/// Scalars each take a destination, structs are written field by field, and arrays are written into an
+/// array destination if that's next, or else element by element.
+/// A type can write itself differently with a `writeOutput(self, out: anytype) void` method.
+pub const OutputWriter = struct {
+    mem: *Memory,
+    destinations: []const io.ValueOrArray,
+    value_types: []const io.HeapValueType,
+    index: usize = 0,
+
+    pub fn init(mem: *Memory, destinations: []const io.ValueOrArray, value_types: []const io.HeapValueType) OutputWriter {
+        return .{ .mem = mem, .destinations = destinations, .value_types = value_types };
+    }
+
+    /// Writes a single value to the next destination.
+    pub fn writeSlot(self: *OutputWriter, value: u256) void {
+        const destination = self.destinations[self.index];
+        std.debug.assert(destination == .MemoryAddress);
+        self.mem.setSlot(destination.MemoryAddress, value);
+        self.index += 1;
+    }
+
+    /// Starts writing the next destination in place, which must be an array or vector.
+    /// A vector has its size set to len, while an array has a fixed size.
+    pub fn array(self: *OutputWriter, len: usize) ArrayWriter {
+        const destination = self.destinations[self.index];
+        const item_types = itemTypes(self.value_types[self.index]);
+        self.index += 1;
+        switch (destination) {
+            .HeapArray => |arr| return ArrayWriter.init(self.mem, @intCast(self.mem.getSlot(arr.pointer)), arr.size, item_types),
+            .HeapVector => |vec| {
+                self.mem.setSlot(vec.size, len);
+                return ArrayWriter.init(self.mem, @intCast(self.mem.getSlot(vec.pointer)), len, item_types);
+            },
+            .MemoryAddress => unreachable,
+        }
+    }
+
+    pub fn write(self: *OutputWriter, value: anytype) void {
+        const is_array = comptime switch (@typeInfo(@TypeOf(value))) {
+            .array => true,
+            .pointer => |p| p.size == .slice,
+            else => false,
+        };
+        if (is_array) {
+            if (self.destinations[self.index] != .MemoryAddress) {
+                var items = self.array(value.len);
+                for (value) |item| items.write(item);
+                return;
+            }
+        }
+        writeValue(self, value);
+    }
+};
+
+/// Writes the leaves of values in order into an array destination, following the pointers of any nested arrays.
+pub const ArrayWriter = struct {
+    mem: *Memory,
+    // The arrays being written, from the destination down to the innermost nested array.
+    frames: [max_depth]Frame = undefined,
+    depth: usize = 1,
+
+    const max_depth = 8;
+    const Frame = struct {
+        start: usize,
+        size: usize,
+        value_types: []const io.HeapValueType,
+        i: usize = 0,
+    };
+
+    fn init(mem: *Memory, start: usize, size: usize, value_types: []const io.HeapValueType) ArrayWriter {
+        var writer = ArrayWriter{ .mem = mem };
+        writer.frames[0] = .{ .start = start, .size = size, .value_types = value_types };
+        return writer;
+    }
+
+    /// The index of the next simple slot, or null if the array is full.
+    fn nextSlot(self: *ArrayWriter) ?usize {
+        while (true) {
+            const frame = &self.frames[self.depth - 1];
+            if (frame.i == frame.size) {
+                if (self.depth == 1) return null;
+                self.depth -= 1;
+                continue;
+            }
+            const slot = frame.start + frame.i;
+            const value_type = frame.value_types[frame.i % frame.value_types.len];
+            frame.i += 1;
+            switch (value_type) {
+                .Simple => return slot,
+                .Array => |arr| {
+                    std.debug.assert(self.depth < max_depth);
+                    // The slot points to the nested array, whose items follow its reference count.
+                    const nested: usize = @intCast(self.mem.getSlotAtIndex(slot));
+                    self.frames[self.depth] = .{ .start = nested + 1, .size = arr.size, .value_types = arr.value_types };
+                    self.depth += 1;
+                },
+                .Vector => std.debug.panic("Vectors in nested types not yet supported", .{}),
+            }
+        }
+    }
+
+    /// Writes a single value to the next slot.
+    pub fn writeSlot(self: *ArrayWriter, value: u256) void {
+        self.mem.setSlotAtIndex(self.nextSlot() orelse unreachable, value);
+    }
+
+    /// Fills the rest of the array with zeros.
+    pub fn pad(self: *ArrayWriter) void {
+        while (self.nextSlot()) |slot| self.mem.setSlotAtIndex(slot, 0);
+    }
+
+    pub fn write(self: *ArrayWriter, value: anytype) void {
+        writeValue(self, value);
+    }
+};
+
+// Array destinations without type info are taken to hold simple values.
+const simple_items = [_]io.HeapValueType{.{ .Simple = .Field }};
+
+fn itemTypes(value_type: io.HeapValueType) []const io.HeapValueType {
+    return switch (value_type) {
+        .Array => |arr| arr.value_types,
+        .Vector => |vec| vec.value_types,
+        .Simple => &simple_items,
+    };
+}
+
+/// Writes a value through an OutputWriter or ArrayWriter, as its leaves in order.
+fn writeValue(out: anytype, value: anytype) void {
+    const T = @TypeOf(value);
+    switch (@typeInfo(T)) {
+        .@"struct" => |s| {
+            if (comptime @hasDecl(T, "writeOutput")) {
+                value.writeOutput(out);
+            } else if (comptime @hasDecl(T, "to_int")) {
+                out.writeSlot(value.to_int());
+            } else {
+                inline for (s.fields) |field| out.write(@field(value, field.name));
+            }
+        },
+        .bool => out.writeSlot(if (value) 1 else 0),
+        .int, .comptime_int => out.writeSlot(value),
+        .array => for (value) |item| out.write(item),
+        .pointer => |p| {
+            if (p.size != .slice) @compileError("Unsupported pointer type in output: " ++ @typeName(T));
+            for (value) |item| out.write(item);
+        },
+        else => @compileError("Unsupported type in output: " ++ @typeName(T)),
+    }
+}
+
 /// If the structure is only known at runtime (i.e. described in the ForeignCall), use this.
 /// The return value will have the shape as described by the input value types.
 pub fn extractParams(allocator: std.mem.Allocator, mem: *Memory, fc: *const io.ForeignCall) ![]ForeignCallParam {
@@ -472,6 +536,39 @@ pub fn extractParams(allocator: std.mem.Allocator, mem: *Memory, fc: *const io.F
     return params;
 }
 
+/// Reads back the outputs a foreign call wrote to vm memory, in the shape described by its destination value types.
+pub fn extractResults(allocator: std.mem.Allocator, mem: *Memory, fc: *const io.ForeignCall) ![]ForeignCallParam {
+    const results = try allocator.alloc(ForeignCallParam, fc.destinations.len);
+    for (fc.destinations, fc.destination_value_types, results) |*destination, *t, *r| {
+        r.* = try getMemoryValues(allocator, mem, destination, t);
+    }
+    return results;
+}
+
+/// The number of vm memory slots the call reads as inputs.
+/// Arrays count their top level slots, so nested arrays only count their pointers.
+pub fn inputSlots(mem: *Memory, fc: *const io.ForeignCall) usize {
+    return countSlots(mem, fc.inputs, fc.input_value_types);
+}
+
+/// The number of vm memory slots the call writes as outputs, once made.
+pub fn outputSlots(mem: *Memory, fc: *const io.ForeignCall) usize {
+    return countSlots(mem, fc.destinations, fc.destination_value_types);
+}
+
+fn countSlots(mem: *Memory, values: []const io.ValueOrArray, types: []const io.HeapValueType) usize {
+    var n: usize = 0;
+    for (values, types) |value, t| {
+        const slots: usize = switch (t) {
+            .Simple => 1,
+            .Array => |arr| @intCast(arr.size),
+            .Vector => @intCast(mem.getSlot(value.HeapVector.size)),
+        };
+        n += slots;
+    }
+    return n;
+}
+
 fn getMemoryValues(
     allocator: std.mem.Allocator,
     mem: *Memory,
@@ -523,3 +620,150 @@ fn readSliceOfValuesFromMemory(
     }
     return ForeignCallParam{ .Array = try result.toOwnedSlice() };
 }
+
+/// A flat array argument of a foreign call, viewed in place in vm memory rather than copied out.
+/// Handlers take one in place of a slice, when they only read it during the call.
+/// It's only valid for the duration of the call, so anything kept must be copied out with toSlice.
+pub const MemorySlice = struct {
+    mem: *Memory,
+    start: usize,
+    len: usize,
+
+    pub fn get(self: MemorySlice, i: usize) u256 {
+        return norm(self.mem.getSlotAtIndex(self.start + i));
+    }
+
+    pub fn getField(self: MemorySlice, i: usize) F {
+        return F.from_int(self.get(i));
+    }
+
+    pub fn toSlice(self: MemorySlice, comptime T: type, allocator: std.mem.Allocator) ![]T {
+        const out = try allocator.alloc(T, self.len);
+        for (out, 0..) |*o, i| o.* = if (T == F) self.getField(i) else @intCast(self.get(i));
+        return out;
+    }
+
+    pub fn format(self: MemorySlice, comptime _: []const u8, _: std.fmt.FormatOptions, writer: anytype) !void {
+        try writer.writeAll("[");
+        for (0..self.len) |i| {
+            if (i > 0) try writer.writeAll(", ");
+            try writer.print("0x{x}", .{self.get(i)});
+        }
+        try writer.writeAll("]");
+    }
+};
+
+/// Returns a view of the input if it's an array of simple values, i.e. has no nested arrays.
+fn flatArray(mem: *Memory, input: *const io.ValueOrArray, t: *const io.HeapValueType) ?MemorySlice {
+    var value_types: []const io.HeapValueType = undefined;
+    var start: u256 = undefined;
+    var len: u256 = undefined;
+    switch (t.*) {
+        .Simple => return null,
+        .Array => |arr| {
+            value_types = arr.value_types;
+            start = mem.getSlot(input.HeapArray.pointer);
+            len = arr.size;
+        },
+        .Vector => |vec| {
+            value_types = vec.value_types;
+            start = mem.getSlot(input.HeapVector.pointer);
+            len = mem.getSlot(input.HeapVector.size);
+        },
+    }
+    for (value_types) |value_type| if (value_type != .Simple) return null;
+    return .{ .mem = mem, .start = @intCast(start), .len = @intCast(len) };
+}
+
+/// Reads one input of a foreign call straight from vm memory into a handler argument.
+/// Simple values and flat arrays are converted directly, without building ForeignCallParams,
+/// and MemorySlice arguments are views that aren't copied at all.
+/// Anything else is extracted as a ForeignCallParam and marshalled by marshalInput.
+/// Slices are allocated with the given allocator.
+pub fn readInput(
+    arg: anytype,
+    allocator: std.mem.Allocator,
+    mem: *Memory,
+    fc: *const io.ForeignCall,
+    index: usize,
+) !void {
+    const T = @TypeOf(arg.*);
+    const input = &fc.inputs[index];
+    const t = &fc.input_value_types[index];
+
+    if (T == MemorySlice) {
+        arg.* = flatArray(mem, input, t) orelse return error.ExpectedFlatArray;
+        return;
+    }
+    if (comptime T == F or T == bool or @typeInfo(T) == .int) {
+        if (t.* == .Simple) {
+            const value = norm(mem.getSlot(input.MemoryAddress));
+            if (T == F) {
+                arg.* = F.from_int(value);
+            } else if (T == bool) {
+                arg.* = value == 1;
+            } else {
+                arg.* = @intCast(value);
+            }
+            return;
+        }
+    }
+    switch (@typeInfo(T)) {
+        .pointer => |p| if (p.size == .slice and (p.child == F or @typeInfo(p.child) == .int)) {
+            if (flatArray(mem, input, t)) |view| {
+                arg.* = try view.toSlice(p.child, allocator);
+                return;
+            }
+        },
+        else => {},
+    }
+    try marshalInput(arg, allocator, try getMemoryValues(allocator, mem, input, t));
+}
+
+/// Extracts one input of a foreign call as a ForeignCallParam.
+pub fn extractParam(allocator: std.mem.Allocator, mem: *Memory, fc: *const io.ForeignCall, index: usize) !ForeignCallParam {
+    return getMemoryValues(allocator, mem, &fc.inputs[index], &fc.input_value_types[index]);
+}
+
+test "output writer" {
+    var mem = try Memory.init(std.testing.allocator, 64);
+    defer mem.deinit();
+
+    var simple = [_]io.HeapValueType{.{ .Simple = .{ .Integer = .U32 } }};
+    var nested = [_]io.HeapValueType{.{ .Array = .{ .value_types = &simple, .size = 2 } }};
+    const destinations = [_]io.ValueOrArray{
+        .{ .MemoryAddress = .{ .relative = 0, .value = 1 } },
+        .{ .MemoryAddress = .{ .relative = 0, .value = 2 } },
+        .{ .HeapArray = .{ .pointer = .{ .relative = 0, .value = 3 }, .size = 2 } },
+        .{ .HeapArray = .{ .pointer = .{ .relative = 0, .value = 4 }, .size = 2 } },
+    };
+    const value_types = [_]io.HeapValueType{
+        .{ .Simple = .Field },
+        .{ .Simple = .Field },
+        .{ .Array = .{ .value_types = &simple, .size = 2 } },
+        .{ .Array = .{ .value_types = &nested, .size = 2 } },
+    };
+    mem.setSlotAtIndex(3, 10);
+    mem.setSlotAtIndex(4, 20);
+    mem.setSlotAtIndex(20, 30);
+    mem.setSlotAtIndex(21, 40);
+
+    // A struct's fields go to a destination each, with its array written in place.
+    const Output = struct { a: F, b: bool, c: [2]u32 };
+    const output = Output{ .a = F.from_int(7), .b = true, .c = .{ 4, 5 } };
+    marshalOutput(&output, &mem, destinations[0..3], value_types[0..3]);
+    try std.testing.expectEqual(7, mem.getSlotAtIndex(1));
+    try std.testing.expectEqual(1, mem.getSlotAtIndex(2));
+    try std.testing.expectEqual(4, mem.getSlotAtIndex(10));
+    try std.testing.expectEqual(5, mem.getSlotAtIndex(11));
+
+    // Nested arrays are written through their pointers, and padded with zeros.
+    var out = OutputWriter.init(&mem, destinations[3..], value_types[3..]);
+    var items = out.array(0);
+    items.write([3]u32{ 1, 2, 3 });
+    items.pad();
+    try std.testing.expectEqual(1, mem.getSlotAtIndex(31));
+    try std.testing.expectEqual(2, mem.getSlotAtIndex(32));
+    try std.testing.expectEqual(3, mem.getSlotAtIndex(41));
+    try std.testing.expectEqual(0, mem.getSlotAtIndex(42));
+}
@@ -11,6 +11,8 @@ const MockedCall = struct {
     id: usize,
     /// The oracle it's mocking
     name: []const u8,
+    /// The oracle id of the name
+    function_id: u64,
     /// Optionally match the parameters
     params: ?[]ForeignCallParam,
     /// The parameters with which the mock was last called
@@ -27,6 +29,8 @@ pub const Mocker = struct {
     allocator: std.mem.Allocator,
     mock_id: u64 = 0,
     mock_calls: std.ArrayList(?MockedCall),
+    // The number of mocks that haven't been cleared or used up. Calls skip the mock search when zero.
+    num_active: usize = 0,
 
     pub fn init(allocator: std.mem.Allocator) Mocker {
         return .{
@@ -43,51 +47,57 @@ pub const Mocker = struct {
     /// Uses comptime meta foo to marshal data in and out of vm memory, and call functions with the same name on self.
     /// Handler functions arguments and return types must match the layout as described by the foreign call.
     /// The given allocator is used for transient data and is freed by the caller.
+    /// Params are only extracted from vm memory when a mock matches the oracle, so unmocked calls pay nothing.
     /// Note the use of ForeignCallParam.sliceDeepCopy to copy data that needs to become long-lived into self.allocator.
     pub fn handleForeignCall(
         self: *Mocker,
         allocator: std.mem.Allocator,
         mem: *Memory,
         fc: *const io.ForeignCall,
-        params: []ForeignCallParam,
     ) !bool {
         // If the foreign call has been mocked, handle the mock and return.
-        for (self.mock_calls.items) |*maybe_call| {
-            if (maybe_call.*) |*call| {
-                if (std.mem.eql(u8, call.name, fc.function) and
-                    (call.params == null or ForeignCallParam.sliceEql(call.params.?, params)))
-                {
-                    // std.debug.print("Calling mocked function: {s} with params: {any}\n", .{ fc.function, params });
-                    std.debug.print("Calling mocked function: {s}\n", .{fc.function});
-                    std.debug.print("Destination value types: {any}\n", .{fc.destination_value_types});
-                    call.last_called_params = try ForeignCallParam.sliceDeepCopy(params, self.allocator);
-                    call.times_called += 1;
-                    marshal.marshalForeignCallParam(call.result, mem, fc.destinations, fc.destination_value_types);
-                    if (call.times_left) |*left| {
-                        left.* -= 1;
-                        if (left.* == 0) {
-                            maybe_call.* = null;
+        if (self.num_active > 0) {
+            var params: ?[]ForeignCallParam = null;
+            for (self.mock_calls.items) |*maybe_call| {
+                if (maybe_call.*) |*call| {
+                    if (call.function_id != fc.function_id or !std.mem.eql(u8, call.name, fc.function)) continue;
+                    if (params == null) params = try marshal.extractParams(allocator, mem, fc);
+                    if (call.params == null or ForeignCallParam.sliceEql(call.params.?, params.?)) {
+                        // std.debug.print("Calling mocked function: {s} with params: {any}\n", .{ fc.function, params });
+                        std.debug.print("Calling mocked function: {s}\n", .{fc.function});
+                        std.debug.print("Destination value types: {any}\n", .{fc.destination_value_types});
+                        call.last_called_params = try ForeignCallParam.sliceDeepCopy(params.?, self.allocator);
+                        call.times_called += 1;
+                        marshal.marshalForeignCallParam(call.result, mem, fc.destinations, fc.destination_value_types);
+                        if (call.times_left) |*left| {
+                            left.* -= 1;
+                            if (left.* == 0) {
+                                maybe_call.* = null;
+                                self.num_active -= 1;
+                            }
                         }
+                        return true;
                     }
-                    return true;
                 }
             }
         }
 
         // Special case function handlers that can't be genericised.
-        if (std.mem.eql(u8, "set_mock_returns", fc.function)) {
+        if (fc.function_id == comptime io.oracleId("set_mock_returns") and std.mem.eql(u8, "set_mock_returns", fc.function)) {
+            const params = try marshal.extractParams(allocator, mem, fc);
             std.debug.print("Making foreign call to: set_mock_returns with params: {any}\n", .{params[1..]});
             const id: usize = @intCast(params[0].Single);
             self.mock_calls.items[id].?.result = try ForeignCallParam.sliceDeepCopy(params[1..], self.allocator);
             return true;
-        } else if (std.mem.eql(u8, "set_mock_params", fc.function)) {
+        } else if (fc.function_id == comptime io.oracleId("set_mock_params") and std.mem.eql(u8, "set_mock_params", fc.function)) {
             std.debug.print("Making foreign call to: set_mock_params\n", .{});
+            const params = try marshal.extractParams(allocator, mem, fc);
             const id: usize = @intCast(params[0].Single);
             self.mock_calls.items[id].?.params = try ForeignCallParam.sliceDeepCopy(params[1..], self.allocator);
             return true;
         }
 
-        return try structDispatcher(self, allocator, mem, fc, params);
+        return try structDispatcher(self, allocator, mem, fc);
     }
 
     pub fn create_mock(
@@ -99,6 +109,7 @@ pub const Mocker = struct {
         try self.mock_calls.append(.{
             .id = self.mock_id,
             .name = try self.allocator.dupe(u8, oracle_name),
+            .function_id = io.oracleId(oracle_name),
             .params = null,
             .last_called_params = null,
             .result = &[_]ForeignCallParam{},
@@ -107,6 +118,7 @@ pub const Mocker = struct {
         });
         const id = F.from_int(self.mock_id);
         self.mock_id += 1;
+        self.num_active += 1;
         return id;
     }
 
@@ -133,6 +145,7 @@ pub const Mocker = struct {
         _: std.mem.Allocator,
         id: u64,
     ) !void {
+        if (self.mock_calls.items[id] != null) self.num_active -= 1;
         self.mock_calls.items[id] = null;
     }
 
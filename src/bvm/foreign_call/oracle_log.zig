@@ -0,0 +1,206 @@
+const std = @import("std");
+const bincode = @import("../../bincode/bincode.zig");
+const Memory = @import("../memory.zig").Memory;
+const io = @import("../io.zig");
+const marshal = @import("marshal.zig");
+const ForeignCallParam = @import("param.zig").ForeignCallParam;
+const ForeignCallDispatcher = @import("dispatcher.zig").ForeignCallDispatcher;
+
+/// A log of the foreign calls made by an execution, and their results, so it can be re-run without its oracles.
+/// It's the magic, followed by one bincode Entry per call, in call order.
+const magic = "zbfclog1";
+
+const Entry = struct {
+    function_id: u64,
+    function: []const u8,
+    params: []ForeignCallParam,
+    results: []ForeignCallParam,
+};
+
+/// Logs every call made through it, and what the wrapped dispatcher wrote back to vm memory.
+/// Only the calls of the vm it's given to are logged. Nested vms that use the wrapped dispatcher directly aren't.
+pub const OracleRecorder = struct {
+    allocator: std.mem.Allocator,
+    inner: ForeignCallDispatcher,
+    file: std.fs.File,
+    writer: std.io.BufferedWriter(4096, std.fs.File.Writer),
+    num_calls: u64 = 0,
+
+    pub fn init(allocator: std.mem.Allocator, path: []const u8, inner: ForeignCallDispatcher) !OracleRecorder {
+        const file = try std.fs.cwd().createFile(path, .{});
+        errdefer file.close();
+        var recorder = OracleRecorder{
+            .allocator = allocator,
+            .inner = inner,
+            .file = file,
+            .writer = std.io.bufferedWriter(file.writer()),
+        };
+        try recorder.writer.writer().writeAll(magic);
+        return recorder;
+    }
+
+    pub fn deinit(self: *OracleRecorder) void {
+        self.writer.flush() catch |err| std.debug.print("Failed to write oracle log: {}\n", .{err});
+        self.file.close();
+    }
+
+    pub fn fcDispatcher(self: *OracleRecorder) ForeignCallDispatcher {
+        return .{
+            .context = self,
+            .handleForeignCallFn = handleForeignCall,
+        };
+    }
+
+    fn handleForeignCall(context: *anyopaque, mem: *Memory, fc: *const io.ForeignCall) !void {
+        const self: *OracleRecorder = @alignCast(@ptrCast(context));
+
+        var arena = std.heap.ArenaAllocator.init(self.allocator);
+        defer arena.deinit();
+
+        // Read before the call, as its results may overwrite them.
+        const params = try marshal.extractParams(arena.allocator(), mem, fc);
+        try self.inner.handleForeignCall(mem, fc);
+        try bincode.serialize(self.writer.writer(), Entry{
+            .function_id = fc.function_id,
+            .function = fc.function,
+            .params = params,
+            .results = try marshal.extractResults(arena.allocator(), mem, fc),
+        });
+        self.num_calls += 1;
+    }
+};
+
+/// Serves calls from a log made by OracleRecorder, writing the logged results to vm memory as a mock would.
+/// No oracle is called, so nothing but the vm's memory is touched.
+/// Fails with error.OracleLogDiverged if the execution makes a call other than the next one logged, with the same params.
+pub const OracleReplayer = struct {
+    allocator: std.mem.Allocator,
+    data: []const u8,
+    // The entries not yet replayed.
+    remaining: []const u8,
+    num_calls: u64 = 0,
+
+    pub fn init(allocator: std.mem.Allocator, path: []const u8) !OracleReplayer {
+        const data = try std.fs.cwd().readFileAlloc(allocator, path, std.math.maxInt(usize));
+        errdefer allocator.free(data);
+        if (!std.mem.startsWith(u8, data, magic)) return error.InvalidOracleLog;
+        return .{
+            .allocator = allocator,
+            .data = data,
+            .remaining = data[magic.len..],
+        };
+    }
+
+    pub fn deinit(self: *OracleReplayer) void {
+        self.allocator.free(self.data);
+    }
+
+    pub fn fcDispatcher(self: *OracleReplayer) ForeignCallDispatcher {
+        return .{
+            .context = self,
+            .handleForeignCallFn = handleForeignCall,
+        };
+    }
+
+    /// Checks the execution made every logged call.
+    pub fn finish(self: *const OracleReplayer) !void {
+        if (self.remaining.len == 0) return;
+        std.debug.print("Oracle log diverged: execution finished after {} calls, but more were logged.\n", .{self.num_calls});
+        return error.OracleLogDiverged;
+    }
+
+    fn handleForeignCall(context: *anyopaque, mem: *Memory, fc: *const io.ForeignCall) !void {
+        const self: *OracleReplayer = @alignCast(@ptrCast(context));
+
+        if (self.remaining.len == 0) {
+            std.debug.print("Oracle log diverged at call {}: {s} was made after the last logged call.\n", .{
+                self.num_calls,
+                fc.function,
+            });
+            return error.OracleLogDiverged;
+        }
+
+        var arena = std.heap.ArenaAllocator.init(self.allocator);
+        defer arena.deinit();
+
+        const entry = try bincode.deserializeBufferAlloc(Entry, &self.remaining, arena.allocator());
+        if (entry.function_id != fc.function_id or !std.mem.eql(u8, entry.function, fc.function)) {
+            std.debug.print("Oracle log diverged at call {}: expected {s}, got {s}.\n", .{
+                self.num_calls,
+                entry.function,
+                fc.function,
+            });
+            return error.OracleLogDiverged;
+        }
+        const params = try marshal.extractParams(arena.allocator(), mem, fc);
+        if (!ForeignCallParam.sliceEql(entry.params, params)) {
+            std.debug.print("Oracle log diverged at call {} to {s}: expected params {any}, got {any}.\n", .{
+                self.num_calls,
+                fc.function,
+                entry.params,
+                params,
+            });
+            return error.OracleLogDiverged;
+        }
+        marshal.marshalForeignCallParam(entry.results, mem, fc.destinations, fc.destination_value_types);
+        self.num_calls += 1;
+    }
+};
+
+test "record and replay" {
+    const allocator = std.testing.allocator;
+    var tmp = std.testing.tmpDir(.{});
+    defer tmp.cleanup();
+    const path = try tmp.dir.realpathAlloc(allocator, ".");
+    defer allocator.free(path);
+    const log_path = try std.fs.path.join(allocator, &.{ path, "oracles.log" });
+    defer allocator.free(log_path);
+
+    // An oracle that returns its input plus one.
+    const Increment = struct {
+        calls: u32 = 0,
+
+        fn handleForeignCall(context: *anyopaque, mem: *Memory, fc: *const io.ForeignCall) !void {
+            const self: *@This() = @alignCast(@ptrCast(context));
+            self.calls += 1;
+            mem.setSlot(fc.destinations[0].MemoryAddress, mem.getSlot(fc.inputs[0].MemoryAddress) + 1);
+        }
+    };
+    var inputs = [_]io.ValueOrArray{.{ .MemoryAddress = .{ .relative = 0, .value = 1 } }};
+    var destinations = [_]io.ValueOrArray{.{ .MemoryAddress = .{ .relative = 0, .value = 2 } }};
+    var types = [_]io.HeapValueType{.{ .Simple = .Field }};
+    const fc = io.ForeignCall{
+        .function = "increment",
+        .function_id = io.oracleId("increment"),
+        .destinations = &destinations,
+        .destination_value_types = &types,
+        .inputs = &inputs,
+        .input_value_types = &types,
+    };
+
+    var mem = try Memory.init(allocator, 4);
+    defer mem.deinit();
+    mem.setSlotAtIndex(0, 0);
+
+    var oracle = Increment{};
+    {
+        var recorder = try OracleRecorder.init(allocator, log_path, .{ .context = &oracle, .handleForeignCallFn = Increment.handleForeignCall });
+        defer recorder.deinit();
+        var dispatcher = recorder.fcDispatcher();
+        mem.setSlotAtIndex(1, 41);
+        try dispatcher.handleForeignCall(&mem, &fc);
+        try std.testing.expectEqual(42, mem.getSlotAtIndex(2));
+    }
+
+    var replayer = try OracleReplayer.init(allocator, log_path);
+    defer replayer.deinit();
+    var dispatcher = replayer.fcDispatcher();
+    mem.setSlotAtIndex(2, 0);
+    try dispatcher.handleForeignCall(&mem, &fc);
+    try std.testing.expectEqual(42, mem.getSlotAtIndex(2));
+    try std.testing.expectEqual(1, oracle.calls);
+    try replayer.finish();
+
+    // A call beyond the end of the log diverges.
+    try std.testing.expectError(error.OracleLogDiverged, dispatcher.handleForeignCall(&mem, &fc));
+}
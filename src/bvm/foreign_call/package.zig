@@ -4,8 +4,13 @@ pub const Dispatcher = @import("dispatcher.zig").Dispatcher;
 pub const Mocker = @import("mocker.zig").Mocker;
 pub const structDispatcher = @import("struct_dispatcher.zig").structDispatcher;
 pub const marshal = @import("marshal.zig");
+pub const MemorySlice = marshal.MemorySlice;
+pub const OutputWriter = marshal.OutputWriter;
 pub const ForeignCallParam = @import("param.zig").ForeignCallParam;
 pub const convert = @import("convert.zig");
+pub const ForeignCallStats = @import("stats.zig").ForeignCallStats;
+pub const OracleRecorder = @import("oracle_log.zig").OracleRecorder;
+pub const OracleReplayer = @import("oracle_log.zig").OracleReplayer;
 
 test {
     std.testing.refAllDecls(@This());
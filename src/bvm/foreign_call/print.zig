@@ -18,7 +18,7 @@ fn convertSlice(comptime T: type, allocator: std.mem.Allocator, in: []ForeignCal
 }
 
 /// Brain-dead printing function as I can't be bothered with all the formatting logic.
-pub fn handlePrint(allocator: std.mem.Allocator, mem: *Memory, params: []ForeignCallParam) !void {
+pub fn handlePrint(allocator: std.mem.Allocator, _: *Memory, params: []ForeignCallParam) !void {
     var buf = std.ArrayList(u8).init(allocator);
     var writer = buf.writer();
     try writer.print("{{ ", .{});
@@ -27,7 +27,7 @@ pub fn handlePrint(allocator: std.mem.Allocator, mem: *Memory, params: []Foreign
         switch (p) {
             .Array => |arr| {
                 if (every(ForeignCallParam, arr, printable)) {
-                    try writer.print("{s}", .{convertSlice(u8, mem.allocator, arr)});
+                    try writer.print("{s}", .{convertSlice(u8, allocator, arr)});
                 } else {
                     try writer.print("{any}", .{arr});
                 }
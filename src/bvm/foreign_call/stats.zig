@@ -0,0 +1,185 @@
+const std = @import("std");
+const io = @import("../io.zig");
+const BrilligStats = @import("../brillig_vm.zig").Stats;
+
+/// Per oracle call counts, latencies, and bytes marshalled in and out of vm memory, of the calls made through a dispatcher.
+/// Latencies are inclusive, so an oracle that executes nested vms (e.g. a private call) includes their foreign calls.
+pub const ForeignCallStats = struct {
+    const Oracle = struct {
+        name: []const u8,
+        bytes_in: u64 = 0,
+        bytes_out: u64 = 0,
+        // Of every call, in ns.
+        latencies: std.ArrayListUnmanaged(u64) = .{},
+    };
+
+    /// What's reported of each oracle. Times are in ns.
+    pub const Summary = struct {
+        name: []const u8,
+        calls: u64,
+        total_ns: u64,
+        mean_ns: u64,
+        p50_ns: u64,
+        p90_ns: u64,
+        p99_ns: u64,
+        max_ns: u64,
+        bytes_in: u64,
+        bytes_out: u64,
+    };
+
+    allocator: std.mem.Allocator,
+    // By oracle id.
+    oracles: std.AutoArrayHashMapUnmanaged(u64, Oracle) = .{},
+
+    pub fn init(allocator: std.mem.Allocator) ForeignCallStats {
+        return .{ .allocator = allocator };
+    }
+
+    pub fn deinit(self: *ForeignCallStats) void {
+        for (self.oracles.values()) |*oracle| {
+            self.allocator.free(oracle.name);
+            oracle.latencies.deinit(self.allocator);
+        }
+        self.oracles.deinit(self.allocator);
+    }
+
+    /// Records a call that read in_slots and wrote out_slots of vm memory.
+    pub fn record(self: *ForeignCallStats, fc: *const io.ForeignCall, in_slots: usize, out_slots: usize, elapsed_ns: u64) !void {
+        const entry = try self.oracles.getOrPut(self.allocator, fc.function_id);
+        if (!entry.found_existing) {
+            errdefer _ = self.oracles.swapRemove(fc.function_id);
+            entry.value_ptr.* = .{ .name = try self.allocator.dupe(u8, fc.function) };
+        }
+        const oracle = entry.value_ptr;
+        oracle.bytes_in += in_slots * @sizeOf(u256);
+        oracle.bytes_out += out_slots * @sizeOf(u256);
+        try oracle.latencies.append(self.allocator, elapsed_ns);
+    }
+
+    /// Returns a summary of each oracle, slowest in total first.
+    pub fn summaries(self: *ForeignCallStats, allocator: std.mem.Allocator) ![]Summary {
+        const result = try allocator.alloc(Summary, self.oracles.count());
+        for (self.oracles.values(), result) |*oracle, *s| {
+            const latencies = oracle.latencies.items;
+            std.mem.sort(u64, latencies, {}, std.sort.asc(u64));
+            var total: u64 = 0;
+            for (latencies) |l| total += l;
+            s.* = .{
+                .name = oracle.name,
+                .calls = latencies.len,
+                .total_ns = total,
+                .mean_ns = total / latencies.len,
+                .p50_ns = percentile(latencies, 50),
+                .p90_ns = percentile(latencies, 90),
+                .p99_ns = percentile(latencies, 99),
+                .max_ns = latencies[latencies.len - 1],
+                .bytes_in = oracle.bytes_in,
+                .bytes_out = oracle.bytes_out,
+            };
+        }
+        std.mem.sort(Summary, result, {}, struct {
+            fn greaterThan(_: void, a: Summary, b: Summary) bool {
+                return a.total_ns > b.total_ns;
+            }
+        }.greaterThan);
+        return result;
+    }
+
+    pub fn dump(self: *ForeignCallStats) void {
+        const oracles = self.summaries(self.allocator) catch return;
+        defer self.allocator.free(oracles);
+
+        var calls: u64 = 0;
+        var total_ns: u64 = 0;
+        for (oracles) |s| {
+            calls += s.calls;
+            total_ns += s.total_ns;
+        }
+        std.debug.print("Foreign calls: {} in {}us\n", .{ calls, total_ns / 1000 });
+        std.debug.print("Oracle calls / total / mean / p50 / p90 / p99 / max (us) / bytes in / out:\n", .{});
+        for (oracles) |s| {
+            std.debug.print("  {s}: {} / {d:.1} / {d:.1} / {d:.1} / {d:.1} / {d:.1} / {d:.1} / {} / {}\n", .{
+                s.name,
+                s.calls,
+                us(s.total_ns),
+                us(s.mean_ns),
+                us(s.p50_ns),
+                us(s.p90_ns),
+                us(s.p99_ns),
+                us(s.max_ns),
+                s.bytes_in,
+                s.bytes_out,
+            });
+        }
+    }
+
+    /// Writes the stats as json, along with the brillig stats if given.
+    pub fn writeJson(self: *ForeignCallStats, writer: anytype, brillig_stats: ?*const BrilligStats) !void {
+        const oracles = try self.summaries(self.allocator);
+        defer self.allocator.free(oracles);
+
+        var ws = std.json.writeStream(writer, .{ .whitespace = .indent_2 });
+        defer ws.deinit();
+        try ws.beginObject();
+        if (brillig_stats) |stats| {
+            try ws.objectField("brillig");
+            try stats.writeJson(&ws);
+        }
+        try ws.objectField("foreign_calls");
+        try ws.write(oracles);
+        try ws.endObject();
+    }
+
+    pub fn writeJsonFile(self: *ForeignCallStats, path: []const u8, brillig_stats: ?*const BrilligStats) !void {
+        const file = try std.fs.cwd().createFile(path, .{});
+        defer file.close();
+        var bw = std.io.bufferedWriter(file.writer());
+        try self.writeJson(bw.writer(), brillig_stats);
+        try bw.writer().writeByte('\n');
+        try bw.flush();
+    }
+
+    // Nearest rank percentile of the sorted latencies.
+    fn percentile(sorted: []const u64, p: u64) u64 {
+        const rank = (sorted.len * p + 99) / 100;
+        return sorted[@max(rank, 1) - 1];
+    }
+
+    fn us(ns: u64) f64 {
+        return @as(f64, @floatFromInt(ns)) / 1000;
+    }
+};
+
+test "foreign call stats" {
+    var stats = ForeignCallStats.init(std.testing.allocator);
+    defer stats.deinit();
+
+    var fc = io.ForeignCall{
+        .function = "getNotes",
+        .function_id = io.oracleId("getNotes"),
+        .destinations = &.{},
+        .destination_value_types = &.{},
+        .inputs = &.{},
+        .input_value_types = &.{},
+    };
+    for (1..101) |i| try stats.record(&fc, 2, 1, i * 1000);
+    fc.function = "debugLog";
+    fc.function_id = io.oracleId("debugLog");
+    try stats.record(&fc, 1, 0, 500);
+
+    const oracles = try stats.summaries(std.testing.allocator);
+    defer std.testing.allocator.free(oracles);
+    try std.testing.expectEqual(2, oracles.len);
+    try std.testing.expectEqualStrings("getNotes", oracles[0].name);
+    try std.testing.expectEqual(100, oracles[0].calls);
+    try std.testing.expectEqual(50_000, oracles[0].p50_ns);
+    try std.testing.expectEqual(99_000, oracles[0].p99_ns);
+    try std.testing.expectEqual(100_000, oracles[0].max_ns);
+    try std.testing.expectEqual(6400, oracles[0].bytes_in);
+    try std.testing.expectEqual(500, oracles[1].total_ns);
+
+    var json = std.ArrayList(u8).init(std.testing.allocator);
+    defer json.deinit();
+    try stats.writeJson(json.writer(), null);
+    try std.testing.expect(std.mem.indexOf(u8, json.items, "\"foreign_calls\"") != null);
+}
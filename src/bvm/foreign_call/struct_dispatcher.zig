@@ -7,114 +7,160 @@ const io = @import("../io.zig");
 /// Dispatch function for foreign calls.
 /// Uses comptime meta foo to marshal data in and out of vm memory, and call functions with the same name on self.
 /// Handler functions arguments and return types must match the layout as described by the foreign call.
-/// The given allocator is used for transient data and is freed by the caller.
+/// The given allocator is passed on to handlers, for any data they keep beyond the call.
+/// Arguments are read straight from vm memory into a per call arena, so handlers must copy anything they keep.
+/// Results are written straight into vm memory, and a handler can also take a *marshal.OutputWriter to write them itself.
+/// Handlers are found by binary search of a comptime table of their oracle ids, rather than comparing names.
 pub fn structDispatcher(
     target: anytype,
     allocator: std.mem.Allocator,
     mem: *Memory,
     fc: *const io.ForeignCall,
-    params: []ForeignCallParam,
 ) !bool {
-    // Transient memory required only for this call.
-    // var arena = std.heap.ArenaAllocator.init(allocator);
-    // defer arena.deinit();
+    const T = @TypeOf(target.*);
+    const names = comptime handlerNames(T);
+    if (names.len == 0) return false;
+    const ids = comptime handlerIds(names);
 
-    // Get the type information of the target struct.
-    const info = @typeInfo(@TypeOf(target.*)).@"struct";
+    const index = std.sort.binarySearch(u64, &ids, fc.function_id, orderIds) orelse return false;
+    switch (index) {
+        // Expands to a jump table, with each case calling its handler directly.
+        inline 0...names.len - 1 => |i| {
+            // Ids are hashes, so make sure it really is this function.
+            if (!std.mem.eql(u8, names[i], fc.function)) return false;
+            try callHandler(target, names[i], allocator, mem, fc);
+            return true;
+        },
+        else => unreachable,
+    }
+}
 
-    // Compile time loop over each declaration in the Txe struct.
-    // Filtering for relevant functions at compile-time, we dispatch at runtime to function with matching name.
-    inline for (info.decls) |decl| {
+/// The names of the target's handler functions, i.e. those taking at least (self, allocator), in order of oracle id.
+fn handlerNames(comptime T: type) []const []const u8 {
+    @setEvalBranchQuota(1_000_000);
+    var names: []const []const u8 = &.{};
+    for (@typeInfo(T).@"struct".decls) |decl| {
         // Skip any special functions.
-        if (comptime (std.mem.eql(u8, decl.name, "init") or
+        if (std.mem.eql(u8, decl.name, "init") or
             std.mem.eql(u8, decl.name, "deinit") or
-            std.mem.eql(u8, decl.name, "handleForeignCall")))
+            std.mem.eql(u8, decl.name, "handleForeignCall"))
         {
             continue;
         }
-        // Get the declaration by name from the type, not the instance
-        const field = @field(@TypeOf(target.*), decl.name);
-        // Get the type, and type info of the field.
-        const field_type = @TypeOf(field);
-        const field_info = @typeInfo(field_type);
-        // Compile time check:
-        // - This field is a function.
-        // - With at least two args (self, allocator).
+        const field_info = @typeInfo(@TypeOf(@field(T, decl.name)));
         if (field_info == .@"fn" and field_info.@"fn".params.len >= 2) {
-            // Runtime check for matching function name.
-            if (std.mem.eql(u8, decl.name, fc.function)) {
-                std.debug.print("\nMaking foreign call to: {s}\n", .{decl.name});
+            names = names ++ &[_][]const u8{decl.name};
+        }
+    }
+
+    // Insertion sort, as std.mem.sort isn't usable at comptime.
+    var sorted: [names.len][]const u8 = names[0..names.len].*;
+    var ids = handlerIds(&sorted);
+    for (1..sorted.len) |i| {
+        var j = i;
+        while (j > 0 and ids[j - 1] > ids[j]) : (j -= 1) {
+            std.mem.swap([]const u8, &sorted[j], &sorted[j - 1]);
+            std.mem.swap(u64, &ids[j], &ids[j - 1]);
+        }
+    }
+    for (1..ids.len) |i| {
+        if (ids[i - 1] == ids[i]) @compileError("Oracle id collision between " ++ sorted[i - 1] ++ " and " ++ sorted[i]);
+    }
+    const final = sorted;
+    return &final;
+}
 
-                // There is a function name matching the call on ourself.
-                // Get a tuple to hold the values of the argument types for the function.
-                const Args = std.meta.ArgsTuple(@TypeOf(field));
-                var args: Args = undefined;
-                // Check that the number of parameters matches the number of arguments in the foreign call.
-                // For functions with optional parameters, each optional is represented as 2 values.
-                var expected_param_count: usize = 0;
-                inline for (field_info.@"fn".params[2..]) |param_info| {
-                    if (@typeInfo(param_info.type.?) == .optional) {
-                        expected_param_count += 2; // Optional params are [is_some, value]
-                    } else {
-                        expected_param_count += 1;
-                    }
-                }
+fn handlerIds(comptime names: []const []const u8) [names.len]u64 {
+    @setEvalBranchQuota(1_000_000);
+    var ids: [names.len]u64 = undefined;
+    for (names, 0..) |name, i| ids[i] = io.oracleId(name);
+    return ids;
+}
 
-                if (params.len != expected_param_count) {
-                    std.debug.print("Parameter count mismatch for {s}: Received {} expected {}.\n", .{
-                        decl.name,
-                        params.len,
-                        expected_param_count,
-                    });
-                    // Debug: print all parameters
-                    std.debug.print("Parameters received:\n", .{});
-                    for (params, 0..) |param, i| {
-                        switch (param) {
-                            .Single => |v| std.debug.print("  [{}] Single: {x}\n", .{ i, v }),
-                            .Array => |arr| std.debug.print("  [{}] Array: {} elements\n", .{ i, arr.len }),
-                        }
-                    }
-                    return error.ForeignCallParameterCountMismatch;
-                }
-                // First arg should be this Txe struct.
-                args[0] = target;
-                args[1] = allocator;
+fn orderIds(id: u64, item: u64) std.math.Order {
+    return std.math.order(id, item);
+}
 
-                // Marshal each parameter
-                var param_idx: usize = 0;
-                inline for (2..args.len) |i| {
-                    const param_type = field_info.@"fn".params[i].type.?;
-                    if (@typeInfo(param_type) == .optional) {
-                        // Optional parameter - create array from two consecutive params
-                        var opt_array = [_]ForeignCallParam{
-                            params[param_idx], // is_some
-                            params[param_idx + 1], // value
-                        };
-                        const opt_param = ForeignCallParam{ .Array = &opt_array };
-                        // std.debug.print("Marshal into {s} arg {} (optional): {any}\n", .{ decl.name, i, opt_param });
-                        marshal.marshalInput(&args[i], allocator, opt_param) catch |err| {
-                            // std.debug.print("Failed to marshal into {s} arg {}: {any}\n", .{ decl.name, i, opt_param });
-                            return err;
-                        };
-                        param_idx += 2;
-                    } else {
-                        // std.debug.print("Marshal into {s} arg {}: {any}\n", .{ decl.name, i, params[param_idx] });
-                        // Marshal the ForeignCallParam into the argument type.
-                        marshal.marshalInput(&args[i], allocator, params[param_idx]) catch |err| {
-                            // std.debug.print("Failed to marshal into {s} arg {}: {any}\n", .{ decl.name, i, params[param_idx] });
-                            return err;
-                        };
-                        param_idx += 1;
-                    }
-                }
-                // Make the function call.
-                const r = try @call(.auto, field, args);
-                // std.debug.print("Function {s} returned: {any}\n", .{ decl.name, r });
-                marshal.marshalOutput(&r, mem, fc.destinations, fc.destination_value_types);
-                return true;
+/// Reads the call's inputs into the arguments of the named handler, calls it, and marshals its result into vm memory.
+fn callHandler(
+    target: anytype,
+    comptime name: []const u8,
+    allocator: std.mem.Allocator,
+    mem: *Memory,
+    fc: *const io.ForeignCall,
+) !void {
+    const field = @field(@TypeOf(target.*), name);
+    const field_info = @typeInfo(@TypeOf(field));
+    std.debug.print("\nMaking foreign call to: {s}\n", .{name});
+
+    // The arguments only live for the duration of the call.
+    var arena = std.heap.ArenaAllocator.init(allocator);
+    defer arena.deinit();
+
+    // There is a function name matching the call on ourself.
+    // Get a tuple to hold the values of the argument types for the function.
+    const Args = std.meta.ArgsTuple(@TypeOf(field));
+    var args: Args = undefined;
+    // Check that the number of inputs matches the number of arguments in the foreign call.
+    // For functions with optional parameters, each optional is represented as 2 values.
+    comptime var expected_param_count: usize = 0;
+    inline for (field_info.@"fn".params[2..]) |param_info| {
+        if (param_info.type.? == *marshal.OutputWriter) {
+            continue; // Not an input.
+        } else if (@typeInfo(param_info.type.?) == .optional) {
+            expected_param_count += 2; // Optional params are [is_some, value]
+        } else {
+            expected_param_count += 1;
+        }
+    }
+
+    if (fc.inputs.len != expected_param_count) {
+        std.debug.print("Parameter count mismatch for {s}: Received {} expected {}.\n", .{
+            name,
+            fc.inputs.len,
+            expected_param_count,
+        });
+        // Debug: print all parameters
+        std.debug.print("Parameters received:\n", .{});
+        const params = try marshal.extractParams(arena.allocator(), mem, fc);
+        for (params, 0..) |param, i| {
+            switch (param) {
+                .Single => |v| std.debug.print("  [{}] Single: {x}\n", .{ i, v }),
+                .Array => |arr| std.debug.print("  [{}] Array: {} elements\n", .{ i, arr.len }),
             }
         }
+        return error.ForeignCallParameterCountMismatch;
     }
+    // First arg should be this Txe struct.
+    args[0] = target;
+    args[1] = allocator;
+
+    var out = marshal.OutputWriter.init(mem, fc.destinations, fc.destination_value_types);
 
-    return false;
+    // Read each input
+    comptime var input_idx: usize = 0;
+    inline for (2..args.len) |i| {
+        const param_type = field_info.@"fn".params[i].type.?;
+        if (param_type == *marshal.OutputWriter) {
+            // The handler writes its results in place itself.
+            args[i] = &out;
+        } else if (@typeInfo(param_type) == .optional) {
+            // Optional parameter - create array from two consecutive inputs
+            var opt_array = [_]ForeignCallParam{
+                try marshal.extractParam(arena.allocator(), mem, fc, input_idx), // is_some
+                try marshal.extractParam(arena.allocator(), mem, fc, input_idx + 1), // value
+            };
+            const opt_param = ForeignCallParam{ .Array = &opt_array };
+            try marshal.marshalInput(&args[i], arena.allocator(), opt_param);
+            input_idx += 2;
+        } else {
+            // Read the input directly from memory into the argument type.
+            try marshal.readInput(&args[i], arena.allocator(), mem, fc, input_idx);
+            input_idx += 1;
+        }
+    }
+    // Make the function call.
+    const r = try @call(.auto, field, args);
+    // std.debug.print("Function {s} returned: {any}\n", .{ name, r });
+    marshal.marshalOutput(&r, mem, fc.destinations, fc.destination_value_types);
 }
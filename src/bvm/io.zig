@@ -10,7 +10,8 @@ pub const MemoryAddress = struct {
         try writer.print("{s}{}", .{ if (self.relative == 1) "+" else "", self.value });
     }
 
-    pub inline fn resolve(self: MemoryAddress, mem: []u256) usize {
+    /// Only the stack pointer at slot 0 is read, so `mem` can be a slice of slots of any width.
+    pub inline fn resolve(self: MemoryAddress, mem: anytype) usize {
         if (self.relative == 1) {
             return @as(usize, @truncate(mem[0] + self.value));
         } else {
@@ -39,7 +40,7 @@ const HeapVector = struct {
     }
 };
 
-const BinaryFieldOp = enum {
+pub const BinaryFieldOp = enum {
     Add,
     Sub,
     Mul,
@@ -54,7 +55,7 @@ const BinaryFieldOp = enum {
     }
 };
 
-const BinaryIntOp = enum {
+pub const BinaryIntOp = enum {
     Add,
     Sub,
     Mul,
@@ -230,13 +231,28 @@ pub const BlackBoxOp = union(enum) {
 };
 
 pub const ForeignCall = struct {
+    pub const meta = [_]bincode.Meta{
+        .{ .field = "function_id", .src_type = void },
+    };
     function: []const u8,
+    // The interned function name, so handlers can be found without comparing strings.
+    function_id: u64 = 0,
     destinations: []ValueOrArray,
     destination_value_types: []HeapValueType,
     inputs: []ValueOrArray,
     input_value_types: []HeapValueType,
+
+    pub fn bincodeDerive(self: *ForeignCall) void {
+        self.function_id = oracleId(self.function);
+    }
 };
 
+/// The id a foreign call's function name is interned to.
+/// A hash rather than an index into a table, so ids agree across programs and threads, and can be computed at comptime.
+pub fn oracleId(name: []const u8) u64 {
+    return std.hash.Wyhash.hash(0, name);
+}
+
 pub const BrilligOpcode = union(enum) {
     BinaryFieldOp: struct {
         destination: MemoryAddress,
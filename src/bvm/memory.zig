@@ -2,18 +2,118 @@ const std = @import("std");
 const fieldOps = @import("../blackbox/field.zig");
 const io = @import("io.zig");
 const DebugContext = @import("debug_context.zig").DebugContext;
+const CompactMemory = @import("compact_memory.zig").CompactMemory;
 
 /// Provides a view of machine memory.
 /// The memory view is a contiguous range of slots.
 /// Each slot can hold a field, or an integer of particular width.
+/// How slots are stored is up to the backend, chosen when the memory is created.
+/// Generic code can use the methods here, which dispatch on the backend.
+/// Hot paths should instead switch once and use the backend directly via `as`.
+pub const Memory = union(Backend) {
+    flat: FlatMemory,
+    compact: CompactMemory,
+
+    pub const Backend = enum {
+        /// Every slot is 32 bytes regardless of its type.
+        flat,
+        /// Integers are held in narrow slots, with field elements spilling into a separate array.
+        compact,
+    };
+
+    pub fn Type(comptime backend: Backend) type {
+        return switch (backend) {
+            .flat => FlatMemory,
+            .compact => CompactMemory,
+        };
+    }
+
+    pub fn init(allocator: std.mem.Allocator, num_slots: usize) !Memory {
+        return initBackend(allocator, num_slots, .flat);
+    }
+
+    pub fn initBackend(allocator: std.mem.Allocator, num_slots: usize, backend: Backend) !Memory {
+        return switch (backend) {
+            .flat => .{ .flat = try FlatMemory.init(allocator, num_slots) },
+            .compact => .{ .compact = try CompactMemory.init(allocator, num_slots) },
+        };
+    }
+
+    pub fn deinit(self: *Memory) void {
+        switch (self.*) {
+            inline else => |*m| m.deinit(),
+        }
+    }
+
+    pub fn reset(self: *Memory) void {
+        switch (self.*) {
+            inline else => |*m| m.reset(),
+        }
+    }
+
+    pub inline fn as(self: *Memory, comptime backend: Backend) *Type(backend) {
+        return &@field(self, @tagName(backend));
+    }
+
+    pub fn maxSlotSet(self: *const Memory) u64 {
+        return switch (self.*) {
+            inline else => |*m| m.max_slot_set,
+        };
+    }
+
+    pub fn dumpMem(self: *Memory, offset: usize, n: usize) void {
+        for (offset..offset + n) |i| {
+            var f align(32) = self.getSlotAtIndex(i);
+            fieldOps.bn254_fr_normalize(@ptrCast(&f));
+            std.debug.print("{:0>3}: 0x{x:0>64}\n", .{ i, f });
+        }
+    }
+
+    pub fn resolveSlot(self: *Memory, mem_address: anytype) usize {
+        return switch (self.*) {
+            inline else => |*m| m.resolveSlot(mem_address),
+        };
+    }
+
+    pub fn getSlot(self: *Memory, mem_address: anytype) u256 {
+        return switch (self.*) {
+            inline else => |*m| m.getSlot(mem_address),
+        };
+    }
+
+    pub fn getSlotAtIndex(self: *Memory, index: usize) u256 {
+        return switch (self.*) {
+            inline else => |*m| m.getSlotAtIndex(index),
+        };
+    }
+
+    pub fn getIndirectSlot(self: *Memory, mem_address: anytype) u256 {
+        return switch (self.*) {
+            inline else => |*m| m.getIndirectSlot(mem_address),
+        };
+    }
+
+    pub fn setSlot(self: *Memory, mem_address: anytype, value: u256) void {
+        switch (self.*) {
+            inline else => |*m| m.setSlot(mem_address, value),
+        }
+    }
+
+    pub fn setSlotAtIndex(self: *Memory, index: usize, value: u256) void {
+        switch (self.*) {
+            inline else => |*m| m.setSlotAtIndex(index, value),
+        }
+    }
+};
+
 /// In this simple implementation each slot is 32 bytes regardless of its type.
-/// One could imagine a more efficient implementation which separated specific types and used indexes to resolve.
-pub const Memory = struct {
+/// Addresses can be anything with a `resolve(memory)` method, i.e. an `io.MemoryAddress` or a lowered `bytecode.Operand`.
+pub const FlatMemory = struct {
     allocator: std.mem.Allocator,
     memory: []align(4096) u256,
     max_slot_set: u64 = 0,
 
-    pub fn init(allocator: std.mem.Allocator, num_slots: usize) !Memory {
+    pub fn init(allocator: std.mem.Allocator, num_slots: usize) !FlatMemory {
         // std.debug.print("{}\n",.{@alignOf(std.c.max_align_t)});
         return .{
             .allocator = allocator,
@@ -21,11 +121,18 @@ pub const Memory = struct {
         };
     }
 
-    pub fn deinit(self: *Memory) void {
+    pub fn deinit(self: *FlatMemory) void {
         self.allocator.free(self.memory);
     }
 
-    pub fn dumpMem(self: *Memory, offset: usize, n: usize) void {
+    /// Zeroes every slot up to the highest slot set, returning memory to its freshly allocated state.
+    /// Only valid if all writes have been tracked, i.e. made via `setSlot*` or a `*ForWrite` address.
+    pub fn reset(self: *FlatMemory) void {
+        @memset(self.memory[0..@min(self.max_slot_set + 1, self.memory.len)], 0);
+        self.max_slot_set = 0;
+    }
+
+    pub fn dumpMem(self: *FlatMemory, offset: usize, n: usize) void {
         for (offset..offset + n) |i| {
             var f align(32) = self.memory[i];
             fieldOps.bn254_fr_normalize(@ptrCast(&f));
@@ -33,39 +140,59 @@ pub const Memory = struct {
         }
     }
 
-    pub inline fn resolveSlot(self: *Memory, mem_address: io.MemoryAddress) usize {
+    pub inline fn resolveSlot(self: *FlatMemory, mem_address: anytype) usize {
         return mem_address.resolve(self.memory);
     }
 
-    pub inline fn getSlot(self: *Memory, mem_address: io.MemoryAddress) u256 {
+    pub inline fn getSlot(self: *FlatMemory, mem_address: anytype) u256 {
         return self.memory[mem_address.resolve(self.memory)];
     }
 
-    pub inline fn getSlotAtIndex(self: *Memory, index: usize) u256 {
+    pub inline fn getSlotAtIndex(self: *FlatMemory, index: usize) u256 {
         return self.memory[index];
     }
 
-    pub inline fn getSlotAddrAtIndex(self: *Memory, index: usize) *u256 {
+    pub inline fn getSlotAddrAtIndex(self: *FlatMemory, index: usize) *u256 {
         return &self.memory[index];
     }
 
-    pub inline fn getSlotAddr(self: *Memory, mem_address: io.MemoryAddress) *align(32) u256 {
+    pub inline fn getSlotAddr(self: *FlatMemory, mem_address: anytype) *align(32) u256 {
         return &self.memory[mem_address.resolve(self.memory)];
     }
 
-    pub inline fn getIndirectSlot(self: *Memory, mem_address: io.MemoryAddress) u256 {
+    pub inline fn getIndirectSlot(self: *FlatMemory, mem_address: anytype) u256 {
         return self.memory[@truncate(self.getSlot(mem_address))];
     }
 
-    pub inline fn getIndirectSlotAddr(self: *Memory, mem_address: io.MemoryAddress) *align(32) u256 {
+    pub inline fn getIndirectSlotAddr(self: *FlatMemory, mem_address: anytype) *align(32) u256 {
         return &self.memory[@truncate(self.getSlot(mem_address))];
     }
 
-    pub inline fn setSlot(self: *Memory, mem_address: io.MemoryAddress, value: u256) void {
+    /// As `getSlotAddr`, for a slot the caller is about to write.
+    pub inline fn getSlotAddrForWrite(self: *FlatMemory, mem_address: anytype) *align(32) u256 {
+        const index = mem_address.resolve(self.memory);
+        self.markSlotsSet(index, 1);
+        return &self.memory[index];
+    }
+
+    /// As `getIndirectSlotAddr`, for an array of `n` slots the caller is about to write.
+    pub inline fn getIndirectSlotAddrForWrite(self: *FlatMemory, mem_address: anytype, n: usize) *align(32) u256 {
+        const index: usize = @truncate(self.getSlot(mem_address));
+        self.markSlotsSet(index, n);
+        return &self.memory[index];
+    }
+
+    inline fn markSlotsSet(self: *FlatMemory, index: usize, n: usize) void {
+        if (n > 0 and self.max_slot_set < index + n - 1) {
+            self.max_slot_set = index + n - 1;
+        }
+    }
+
+    pub inline fn setSlot(self: *FlatMemory, mem_address: anytype, value: u256) void {
         self.setSlotAtIndex(mem_address.resolve(self.memory), value);
     }
 
-    pub inline fn setSlotAtIndex(self: *Memory, index: usize, value: u256) void {
+    pub inline fn setSlotAtIndex(self: *FlatMemory, index: usize, value: u256) void {
         if (self.max_slot_set < index) {
             self.max_slot_set = index;
         }
@@ -74,7 +201,7 @@ pub const Memory = struct {
     }
 
     /// Caller should free returned slice.
-    pub fn getMemSlice(self: *Memory, comptime T: type, offset: usize, n: usize) []const T {
+    pub fn getMemSlice(self: *FlatMemory, comptime T: type, offset: usize, n: usize) []const T {
         const slice = self.allocator.alloc(T, n) catch unreachable;
         for (self.memory[offset .. offset + n], 0..) |e, i| slice[i] = @intCast(e);
         return slice;
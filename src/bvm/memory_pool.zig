@@ -0,0 +1,62 @@
+const std = @import("std");
+const Memory = @import("memory.zig").Memory;
+
+/// A pool of VM memories, so executing many Brillig calls doesn't allocate (and page fault in) a fresh memory each time.
+/// Memories are reset on release, and only the range that was actually written is cleared.
+/// Calls can nest (e.g. a foreign call executing another circuit), so any number of memories can be acquired at once.
+pub const MemoryPool = struct {
+    allocator: std.mem.Allocator,
+    num_slots: usize,
+    backend: Memory.Backend,
+    free: std.ArrayList(Memory),
+    mutex: std.Thread.Mutex = .{},
+
+    pub fn init(allocator: std.mem.Allocator, num_slots: usize, backend: Memory.Backend) MemoryPool {
+        return .{
+            .allocator = allocator,
+            .num_slots = num_slots,
+            .backend = backend,
+            .free = std.ArrayList(Memory).init(allocator),
+        };
+    }
+
+    pub fn deinit(self: *MemoryPool) void {
+        for (self.free.items) |*mem| mem.deinit();
+        self.free.deinit();
+    }
+
+    /// Returns a free memory, which has been zeroed, or else allocates a new one.
+    /// A new memory is only zeroed if the pool's allocator returns zeroed pages, as page_allocator does.
+    /// Its pages are left untouched, so they're only faulted in as they're used.
+    pub fn acquire(self: *MemoryPool) !Memory {
+        self.mutex.lock();
+        defer self.mutex.unlock();
+        return self.free.pop() orelse try Memory.initBackend(self.allocator, self.num_slots, self.backend);
+    }
+
+    /// Returns a memory to the pool. It must have been acquired from this pool.
+    pub fn release(self: *MemoryPool, mem: Memory) void {
+        var m = mem;
+        m.reset();
+        self.mutex.lock();
+        defer self.mutex.unlock();
+        self.free.append(m) catch m.deinit();
+    }
+};
+
+test "memories are reused and reset" {
+    var pool = MemoryPool.init(std.heap.page_allocator, 1024, .flat);
+    defer pool.deinit();
+
+    var mem = try pool.acquire();
+    try std.testing.expectEqual(0, mem.getSlotAtIndex(10));
+    mem.setSlotAtIndex(10, 42);
+    const ptr = mem.flat.memory.ptr;
+    pool.release(mem);
+
+    var again = try pool.acquire();
+    defer pool.release(again);
+    try std.testing.expectEqual(ptr, again.flat.memory.ptr);
+    try std.testing.expectEqual(0, again.getSlotAtIndex(10));
+    try std.testing.expectEqual(0, again.maxSlotSet());
+}
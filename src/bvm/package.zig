@@ -3,16 +3,25 @@ const std = @import("std");
 // const execute = @import("./execute.zig");
 pub const io = @import("io.zig");
 pub const brillig_vm = @import("brillig_vm.zig");
+pub const bytecode = @import("bytecode.zig");
 pub const memory = @import("memory.zig");
+pub const compact_memory = @import("compact_memory.zig");
+pub const memory_pool = @import("memory_pool.zig");
 pub const foreign_call = @import("foreign_call/package.zig");
 pub const debug_context = @import("debug_context.zig");
+pub const test_programs = @import("test_programs.zig");
 
 pub const DebugContext = debug_context.DebugContext;
 pub const BrilligVm = brillig_vm.BrilligVm;
+pub const Bytecode = bytecode.Bytecode;
+pub const MemoryPool = memory_pool.MemoryPool;
 
 test {
     std.testing.refAllDecls(@This());
     _ = io;
     _ = brillig_vm;
+    _ = bytecode;
     _ = memory;
+    _ = compact_memory;
+    _ = memory_pool;
 }
@@ -0,0 +1,46 @@
+const std = @import("std");
+const io = @import("io.zig");
+const BrilligOpcode = io.BrilligOpcode;
+const brillig_vm = @import("brillig_vm.zig");
+const BrilligVm = brillig_vm.BrilligVm;
+const BrilligVmHooks = brillig_vm.BrilligVmHooks;
+
+fn at(slot: u64) io.MemoryAddress {
+    return .{ .relative = 0, .value = slot };
+}
+
+/// Counts slot 1 up to n, and returns it. Almost all its ops are a compare, branch, add and jump.
+pub fn countingLoop(n: u32) [9]BrilligOpcode {
+    const u32_size: io.BitSize = .{ .Integer = .U32 };
+    return .{
+        .{ .Const = .{ .destination = at(1), .bit_size = u32_size, .value = 0 } },
+        .{ .Const = .{ .destination = at(2), .bit_size = u32_size, .value = n } },
+        .{ .Const = .{ .destination = at(3), .bit_size = u32_size, .value = 1 } },
+        .{ .Const = .{ .destination = at(5), .bit_size = u32_size, .value = 1 } },
+        .{ .BinaryIntOp = .{ .destination = at(4), .op = .LessThan, .bit_size = .U32, .lhs = at(1), .rhs = at(2) } },
+        .{ .JumpIfNot = .{ .condition = at(4), .location = 8 } },
+        .{ .BinaryIntOp = .{ .destination = at(1), .op = .Add, .bit_size = .U32, .lhs = at(1), .rhs = at(3) } },
+        .{ .Jump = .{ .location = 4 } },
+        .{ .Stop = .{ .return_data = .{ .pointer = at(5), .size = at(3) } } },
+    };
+}
+
+const NoopHooks = struct {
+    var context: u8 = 0;
+
+    fn afterOpcode(_: *anyopaque, _: BrilligOpcode, _: *BrilligVm) bool {
+        return true;
+    }
+    fn onError(_: *anyopaque, _: *BrilligVm) void {}
+    fn trackMemoryWrite(_: *anyopaque, _: usize, _: u256) void {}
+};
+
+/// Hooks that do nothing, to run the debug loop without a debugger.
+pub fn noopHooks() BrilligVmHooks {
+    return .{
+        .context = &NoopHooks.context,
+        .afterOpcodeFn = &NoopHooks.afterOpcode,
+        .onErrorFn = &NoopHooks.onError,
+        .trackMemoryWriteFn = &NoopHooks.trackMemoryWrite,
+    };
+}
@@ -0,0 +1,168 @@
+const std = @import("std");
+const ThreadPool = @import("../thread/thread_pool.zig").ThreadPool;
+const runAll = @import("../thread/thread_pool.zig").runAll;
+
+/// A gzip compressor that deflates fixed size chunks of its input in parallel.
+/// Each chunk is deflated independently and ends on a byte boundary (a sync flush), so the compressed chunks
+/// concatenate into a single deflate stream, within a standard single member gzip file (as pigz does).
+/// Matches can't reach back across chunks, so output is marginally larger than a serial compressor's.
+pub fn ParallelGzip(comptime WriterType: type) type {
+    return struct {
+        const Self = @This();
+        pub const Writer = std.io.Writer(*Self, anyerror, write);
+
+        pub const chunk_size = 1 << 20;
+        // Deflate falls back to stored blocks, so output never grows much beyond the input.
+        const max_chunk_output = chunk_size + chunk_size / 16 + 1024;
+        // Deflate, no flags, no mtime, no extra flags, unix.
+        const header = [_]u8{ 0x1f, 0x8b, 0x08, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x03 };
+
+        const Chunk = struct {
+            input: []u8,
+            input_len: usize = 0,
+            output: []u8,
+            output_len: usize = 0,
+            // The last chunk of the stream.
+            final: bool = false,
+            result: anyerror!void = {},
+
+            fn run(self: *Chunk) void {
+                self.result = self.deflate();
+            }
+
+            fn deflate(self: *Chunk) !void {
+                var out = std.io.fixedBufferStream(self.output);
+                var compressor = try std.compress.flate.compressor(out.writer(), .{});
+                try compressor.writer().writeAll(self.input[0..self.input_len]);
+                if (self.final) {
+                    try compressor.finish();
+                } else {
+                    try compressor.flush();
+                }
+                self.output_len = out.pos;
+            }
+        };
+
+        allocator: std.mem.Allocator,
+        inner: WriterType,
+        pool: ?*ThreadPool,
+        inputs: []u8,
+        outputs: []u8,
+        chunks: []Chunk,
+        // The chunk being filled.
+        current: usize = 0,
+        crc: std.hash.Crc32 = std.hash.Crc32.init(),
+        size: u32 = 0,
+
+        /// Buffers up to `num_chunks` chunks of input, and then compresses them at once on the pool.
+        /// Without a pool, chunks are compressed on the calling thread.
+        pub fn init(allocator: std.mem.Allocator, inner: WriterType, pool: ?*ThreadPool, num_chunks: usize) !Self {
+            const n = @max(num_chunks, 1);
+            const inputs = try allocator.alloc(u8, n * chunk_size);
+            errdefer allocator.free(inputs);
+            const outputs = try allocator.alloc(u8, n * max_chunk_output);
+            errdefer allocator.free(outputs);
+            const chunks = try allocator.alloc(Chunk, n);
+            errdefer allocator.free(chunks);
+            for (chunks, 0..) |*c, i| {
+                c.* = .{
+                    .input = inputs[i * chunk_size ..][0..chunk_size],
+                    .output = outputs[i * max_chunk_output ..][0..max_chunk_output],
+                };
+            }
+            try inner.writeAll(&header);
+            return .{
+                .allocator = allocator,
+                .inner = inner,
+                .pool = pool,
+                .inputs = inputs,
+                .outputs = outputs,
+                .chunks = chunks,
+            };
+        }
+
+        pub fn deinit(self: *Self) void {
+            self.allocator.free(self.inputs);
+            self.allocator.free(self.outputs);
+            self.allocator.free(self.chunks);
+        }
+
+        pub fn writer(self: *Self) Writer {
+            return .{ .context = self };
+        }
+
+        pub fn write(self: *Self, bytes: []const u8) anyerror!usize {
+            const chunk = &self.chunks[self.current];
+            const n = @min(bytes.len, chunk_size - chunk.input_len);
+            @memcpy(chunk.input[chunk.input_len..][0..n], bytes[0..n]);
+            chunk.input_len += n;
+            self.crc.update(bytes[0..n]);
+            self.size +%= @truncate(n);
+            if (chunk.input_len == chunk_size) {
+                self.current += 1;
+                if (self.current == self.chunks.len) try self.deflateChunks();
+            }
+            return n;
+        }
+
+        /// Compresses any remaining input, and writes the gzip footer.
+        pub fn finish(self: *Self) !void {
+            self.chunks[self.current].final = true;
+            self.current += 1;
+            try self.deflateChunks();
+            var footer: [8]u8 = undefined;
+            std.mem.writeInt(u32, footer[0..4], self.crc.final(), .little);
+            std.mem.writeInt(u32, footer[4..8], self.size, .little);
+            try self.inner.writeAll(&footer);
+        }
+
+        fn deflateChunks(self: *Self) !void {
+            const chunks = self.chunks[0..self.current];
+            try runAll(self.allocator, self.pool, Chunk, chunks, Chunk.run);
+
+            for (chunks) |*c| {
+                try c.result;
+                try self.inner.writeAll(c.output[0..c.output_len]);
+                c.input_len = 0;
+                c.final = false;
+            }
+            self.current = 0;
+        }
+    };
+}
+
+pub fn parallelGzip(
+    allocator: std.mem.Allocator,
+    writer: anytype,
+    pool: ?*ThreadPool,
+    num_chunks: usize,
+) !ParallelGzip(@TypeOf(writer)) {
+    return ParallelGzip(@TypeOf(writer)).init(allocator, writer, pool, num_chunks);
+}
+
+test "parallel gzip round trip" {
+    const allocator = std.testing.allocator;
+    var pool = ThreadPool.init(.{ .max_threads = 4 });
+    defer {
+        pool.shutdown();
+        pool.deinit();
+    }
+
+    // A few chunks worth of compressible data, not a multiple of the chunk size.
+    const data = try allocator.alloc(u8, 5 * (1 << 20) + 12345);
+    defer allocator.free(data);
+    for (data, 0..) |*b, i| b.* = @truncate((i % 251) ^ (i / 4096));
+
+    var compressed = std.ArrayList(u8).init(allocator);
+    defer compressed.deinit();
+    var gz = try parallelGzip(allocator, compressed.writer(), &pool, 2);
+    defer gz.deinit();
+    try gz.writer().writeAll(data);
+    try gz.finish();
+
+    var decompressed = std.ArrayList(u8).init(allocator);
+    defer decompressed.deinit();
+    var stream = std.io.fixedBufferStream(compressed.items);
+    try std.compress.gzip.decompress(stream.reader(), decompressed.writer());
+    try std.testing.expectEqualSlices(u8, data, decompressed.items);
+}
@@ -0,0 +1,78 @@
+const std = @import("std");
+const Lru = @import("../lru/lru.zig").Lru;
+
+/// Return data of unconstrained function calls, keyed by function id and calldata.
+/// Only valid for functions whose result depends solely on their calldata, i.e. that make no foreign calls.
+/// Holds at most `capacity` results, evicting the least recently used.
+pub const BrilligCache = struct {
+    const Key = struct {
+        id: u32,
+        calldata: []const u256,
+    };
+
+    const KeyContext = struct {
+        pub fn hash(_: KeyContext, key: Key) u64 {
+            return std.hash.Wyhash.hash(key.id, std.mem.sliceAsBytes(key.calldata));
+        }
+
+        pub fn eql(_: KeyContext, a: Key, b: Key) bool {
+            return a.id == b.id and std.mem.eql(u256, a.calldata, b.calldata);
+        }
+    };
+
+    const Map = Lru(Key, []const u256, KeyContext);
+
+    allocator: std.mem.Allocator,
+    map: Map,
+
+    pub fn init(allocator: std.mem.Allocator, capacity: usize) BrilligCache {
+        return .{ .allocator = allocator, .map = Map.init(allocator, capacity) };
+    }
+
+    pub fn deinit(self: *BrilligCache) void {
+        while (self.map.popOldest()) |entry| self.freeEntry(entry);
+        self.map.deinit();
+    }
+
+    /// Returns the cached return data of the call, if any.
+    /// The slice is owned by the cache, and is only valid until the next `put`.
+    pub fn get(self: *BrilligCache, id: u32, calldata: []const u256) ?[]const u256 {
+        return self.map.get(.{ .id = id, .calldata = calldata });
+    }
+
+    /// Caches a copy of the call's return data, evicting the least recently used result if full.
+    pub fn put(self: *BrilligCache, id: u32, calldata: []const u256, return_data: []const u256) !void {
+        if (self.map.capacity == 0 or self.map.contains(.{ .id = id, .calldata = calldata })) return;
+        const key_calldata = try self.allocator.dupe(u256, calldata);
+        errdefer self.allocator.free(key_calldata);
+        const data = try self.allocator.dupe(u256, return_data);
+        errdefer self.allocator.free(data);
+        if (try self.map.put(.{ .id = id, .calldata = key_calldata }, data)) |evicted| self.freeEntry(evicted);
+    }
+
+    pub fn dump(self: *const BrilligCache) void {
+        std.debug.print("Brillig cache hits / misses: {} / {}\n", .{ self.map.hits, self.map.misses });
+    }
+
+    fn freeEntry(self: *BrilligCache, entry: Map.Entry) void {
+        self.allocator.free(entry.key.calldata);
+        self.allocator.free(entry.value);
+    }
+};
+
+test "lru eviction" {
+    var cache = BrilligCache.init(std.testing.allocator, 2);
+    defer cache.deinit();
+
+    try cache.put(0, &.{ 1, 2 }, &.{3});
+    try cache.put(1, &.{ 1, 2 }, &.{4});
+    try std.testing.expectEqualSlices(u256, &.{3}, cache.get(0, &.{ 1, 2 }).?);
+
+    // Function 1 is now the least recently used, so is evicted.
+    try cache.put(0, &.{5}, &.{6});
+    try std.testing.expectEqual(null, cache.get(1, &.{ 1, 2 }));
+    try std.testing.expectEqualSlices(u256, &.{3}, cache.get(0, &.{ 1, 2 }).?);
+    try std.testing.expectEqualSlices(u256, &.{6}, cache.get(0, &.{5}).?);
+    try std.testing.expectEqual(3, cache.map.hits);
+    try std.testing.expectEqual(1, cache.map.misses);
+}
@@ -3,7 +3,7 @@ const io = @import("io.zig");
 const Fr = @import("../bn254/fr.zig").Fr;
 const GrumpkinFr = @import("../grumpkin/fr.zig").Fr;
 const solve = @import("./expression_solver.zig").solve;
-const evaluate = @import("./expression_solver.zig").evaluate;
+const evaluateConst = @import("./expression_solver.zig").evaluateConst;
 const bvm = @import("../bvm/package.zig");
 const debug_context = @import("../bvm/debug_context.zig");
 const DebugContext = debug_context.DebugContext;
@@ -11,10 +11,13 @@ const sha256 = @import("../blackbox/sha256_compress.zig");
 const aes = @import("../aes/encrypt_cbc.zig");
 const WitnessMap = @import("./witness_map.zig").WitnessMap;
 const MemoryOpSolver = @import("./memory_op_solver.zig").MemoryOpSolver;
+const BrilligCache = @import("./brillig_cache.zig").BrilligCache;
 const G1 = @import("../grumpkin/g1.zig").G1;
 const Poseidon2 = @import("../poseidon2/permutation.zig").Poseidon2;
 const verify_signature = @import("../blackbox/ecdsa.zig").verify_signature;
 const msm = @import("../msm/naive.zig").msm;
+const ThreadPool = @import("../thread/thread_pool.zig").ThreadPool;
+const runAll = @import("../thread/thread_pool.zig").runAll;
 
 pub const CircuitVm = struct {
     allocator: std.mem.Allocator,
@@ -24,6 +27,20 @@ pub const CircuitVm = struct {
     fc_handler: bvm.foreign_call.ForeignCallDispatcher,
     debug_ctx: ?bvm.brillig_vm.BrilligVmHooks,
     brillig_error_context: ?bvm.brillig_vm.ErrorContext = null,
+    // Unconstrained functions lowered on first call, indexed by function id.
+    brillig_bytecode: []?bvm.Bytecode,
+    // Memories handed out to brillig vms. Owned by us unless provided by the caller.
+    memory_pool: *bvm.MemoryPool,
+    owns_memory_pool: bool,
+    // If set, brillig calls collect opcode stats and accumulate them here.
+    brillig_stats: ?*bvm.brillig_vm.Stats = null,
+    // If set, the first call of each unconstrained function is a training run.
+    // Its opcode counts decide which opcode pairs are fused for later calls.
+    fuse_brillig: bool = false,
+    // If set, results of unconstrained functions without foreign calls are reused for identical calldata.
+    brillig_cache: ?*BrilligCache = null,
+    // If set, runs of independent expensive blackboxes are solved in parallel.
+    thread_pool: ?*ThreadPool = null,
 
     pub fn init(
         allocator: std.mem.Allocator,
@@ -31,12 +48,24 @@ pub const CircuitVm = struct {
         calldata: []Fr,
         fc_handler: bvm.foreign_call.ForeignCallDispatcher,
         debug_ctx: ?bvm.brillig_vm.BrilligVmHooks,
+        memory_pool: ?*bvm.MemoryPool,
     ) !CircuitVm {
-        var witnesses = WitnessMap.init(allocator);
+        var num_witnesses: usize = calldata.len;
+        for (program.functions) |f| num_witnesses = @max(num_witnesses, @as(usize, f.current_witness_index) + 1);
+        var witnesses = try WitnessMap.initCapacity(allocator, num_witnesses);
+        errdefer witnesses.deinit();
         // Load our calldata into first elements of the witness map.
         for (calldata, 0..) |e, i| {
             try witnesses.put(@truncate(i), e);
         }
+        const brillig_bytecode = try allocator.alloc(?bvm.Bytecode, program.unconstrained_functions.len);
+        @memset(brillig_bytecode, null);
+        errdefer allocator.free(brillig_bytecode);
+        const pool = memory_pool orelse blk: {
+            const p = try allocator.create(bvm.MemoryPool);
+            p.* = bvm.BrilligVm.initMemoryPool(allocator, .flat);
+            break :blk p;
+        };
         return CircuitVm{
             .allocator = allocator,
             .program = program,
@@ -44,26 +73,74 @@ pub const CircuitVm = struct {
             .memory_solvers = std.AutoHashMap(u32, MemoryOpSolver).init(allocator),
             .fc_handler = fc_handler,
             .debug_ctx = debug_ctx,
+            .brillig_bytecode = brillig_bytecode,
+            .memory_pool = pool,
+            .owns_memory_pool = memory_pool == null,
         };
     }
 
     pub fn deinit(self: *CircuitVm) void {
         self.witnesses.deinit();
+        for (self.brillig_bytecode) |*b| if (b.*) |*code| code.deinit();
+        self.allocator.free(self.brillig_bytecode);
+        if (self.owns_memory_pool) {
+            self.memory_pool.deinit();
+            self.allocator.destroy(self.memory_pool);
+        }
+    }
+
+    /// Returns the lowered form of the given unconstrained function, lowering it on first use.
+    fn getBrilligBytecode(self: *CircuitVm, id: u32) !*bvm.Bytecode {
+        const entry = &self.brillig_bytecode[id];
+        if (entry.* == null) {
+            entry.* = try bvm.Bytecode.init(self.allocator, self.program.unconstrained_functions[id]);
+        }
+        return &entry.*.?;
+    }
+
+    /// Copies the return data of an unconstrained function call into its output witnesses.
+    fn putBrilligOutputs(self: *CircuitVm, outputs: []const io.BrilligOutputs, return_data: []const u256) !void {
+        var return_data_idx: u32 = 0;
+        for (outputs) |o| {
+            const witnesses = switch (o) {
+                .Simple => &[_]io.Witness{o.Simple},
+                .Array => o.Array,
+            };
+            for (witnesses) |w| {
+                // std.debug.print("copying brillig result {} to witness {}\n", .{ return_data[return_data_idx], w });
+                try self.witnesses.put(w, Fr.from_int(return_data[return_data_idx]));
+                return_data_idx += 1;
+            }
+        }
     }
 
     pub fn executeVm(self: *CircuitVm, function_index: usize) !void {
-        for (self.program.functions[function_index].opcodes) |opcode| {
+        const opcodes = self.program.functions[function_index].opcodes;
+        var i: usize = 0;
+        // The end of the last blackbox run that wasn't worth parallelising.
+        // Runs starting within it are suffixes of it, so aren't worth scanning for either.
+        var run_end: usize = 0;
+        while (i < opcodes.len) : (i += 1) {
+            const opcode = opcodes[i];
             // if (options.show_trace) {
             //     const stdout = std.io.getStdOut().writer();
             //     try stdout.print("{:0>4}: {any}\n", .{ i, opcode });
             // }
 
+            if (i >= run_end) {
+                const run = try self.solveBlackBoxRun(opcodes[i..]);
+                if (run.solved) {
+                    i += run.len - 1;
+                    continue;
+                }
+                run_end = i + run.len;
+            }
+
             switch (opcode) {
                 .AssertZero => |op| try solve(self.allocator, &self.witnesses, &op),
                 .BrilligCall => |op| {
                     if (op.predicate) |*p| {
-                        const e = evaluate(self.allocator, p, &self.witnesses).toConst() orelse
-                            return error.OpcodeNotSolvable;
+                        const e = evaluateConst(p, &self.witnesses) orelse return error.OpcodeNotSolvable;
                         if (e.is_zero()) {
                             for (op.outputs) |o| {
                                 const witnesses = switch (o) {
@@ -82,12 +159,10 @@ pub const CircuitVm = struct {
                     for (op.inputs) |input| {
                         if (input == .MemoryArray) {
                             const block_id = input.MemoryArray;
-                            const block = self.memory_solvers.get(block_id) orelse return error.MemBlockNotFound;
-                            for (0..block.block_len) |mem_idx| {
-                                const value = block.block_value.get(@intCast(mem_idx)) orelse
-                                    return error.UninitializedMemory;
-                                try calldata.append(value.to_int());
-                            }
+                            const block = self.memory_solvers.getPtr(block_id) orelse return error.MemBlockNotFound;
+                            const values = block.values() orelse return error.UninitializedMemory;
+                            try calldata.ensureUnusedCapacity(values.len);
+                            for (values) |value| calldata.appendAssumeCapacity(value.to_int());
                         } else {
                             // Normalise a single input into an array.
                             const elems = switch (input) {
@@ -95,14 +170,23 @@ pub const CircuitVm = struct {
                                 .Array => input.Array,
                                 .MemoryArray => unreachable,
                             };
-                            for (elems) |expr| {
-                                const e = evaluate(self.allocator, &expr, &self.witnesses);
-                                if (!e.isConst()) return error.OpcodeNotSolvable;
-                                // std.debug.print("input calldata {} eq {}\n", .{ calldata.items.len, e.q_c.to_int() });
-                                try calldata.append(e.q_c.to_int());
+                            for (elems) |*expr| {
+                                const e = evaluateConst(expr, &self.witnesses) orelse return error.OpcodeNotSolvable;
+                                try calldata.append(e.to_int());
                             }
                         }
                     }
+                    const code = try self.getBrilligBytecode(op.id);
+                    // Functions without foreign calls are pure, so identical calldata gives identical results.
+                    // Calls are never skipped while debugging.
+                    const cache = if (code.has_foreign_calls or self.debug_ctx != null) null else self.brillig_cache;
+                    if (cache) |c| {
+                        if (c.get(op.id, calldata.items)) |return_data| {
+                            try self.putBrilligOutputs(op.outputs, return_data);
+                            continue;
+                        }
+                    }
+
                     var arena = std.heap.ArenaAllocator.init(self.allocator);
                     defer arena.deinit();
                     var brillig_vm = try bvm.BrilligVm.init(
@@ -110,26 +194,22 @@ pub const CircuitVm = struct {
                         calldata.items,
                         self.fc_handler,
                         self.debug_ctx,
+                        .{ .memory_pool = self.memory_pool },
                     );
                     defer brillig_vm.deinit();
 
-                    brillig_vm.executeVm(self.program.unconstrained_functions[op.id], .{}) catch |err| {
+                    const training = self.fuse_brillig and code.fused == null;
+                    brillig_vm.executeVm(code, .{
+                        .collect_stats = self.brillig_stats != null or training,
+                    }) catch |err| {
                         self.brillig_error_context = try brillig_vm.getErrorContext(self.allocator);
                         return err;
                     };
+                    if (self.brillig_stats) |stats| stats.add(&brillig_vm);
+                    if (training) try code.fuse(&brillig_vm.opcode_counters);
+                    if (cache) |c| try c.put(op.id, calldata.items, brillig_vm.return_data);
 
-                    var return_data_idx: u32 = 0;
-                    for (op.outputs) |o| {
-                        const witnesses = switch (o) {
-                            .Simple => &[_]io.Witness{o.Simple},
-                            .Array => o.Array,
-                        };
-                        for (witnesses) |w| {
-                            // std.debug.print("copying brillig result {} to witness {}\n", .{ brillig_vm.return_data[return_data_idx], w });
-                            try self.witnesses.put(w, Fr.from_int(brillig_vm.return_data[return_data_idx]));
-                            return_data_idx += 1;
-                        }
-                    }
+                    try self.putBrilligOutputs(op.outputs, brillig_vm.return_data);
                 },
                 .BlackBoxOp => |blackbox_op| {
                     switch (blackbox_op) {
@@ -148,11 +228,14 @@ pub const CircuitVm = struct {
                             const result = lhs ^ rhs;
                             try self.witnesses.put(op.output, Fr.from_int(result));
                         },
-                        .Sha256Compression => |op| {
-                            const input = self.resolveFunctionInputs(u32, 16, &op.inputs);
-                            var hash_values = self.resolveFunctionInputs(u32, 8, &op.hash_values);
-                            sha256.round(&input, &hash_values);
-                            for (op.outputs, 0..) |w, wi| try self.witnesses.put(w, Fr.from_int(hash_values[wi]));
+                        .Sha256Compression,
+                        .Keccakf1600,
+                        .EcdsaSecp256k1,
+                        .EcdsaSecp256r1,
+                        .MultiScalarMul,
+                        => {
+                            const result = try self.computeBlackBox(self.allocator, &blackbox_op);
+                            try self.putBlackBoxOutputs(&blackbox_op, &result);
                         },
                         .Blake2s => |op| {
                             var input = try std.ArrayList(u8).initCapacity(self.allocator, op.inputs.len);
@@ -179,12 +262,6 @@ pub const CircuitVm = struct {
                             const r = Poseidon2.permutation(frs);
                             for (op.outputs, r) |w, v| try self.witnesses.put(w, v);
                         },
-                        .Keccakf1600 => |op| {
-                            const state = self.resolveFunctionInputs(u64, 25, &op.inputs);
-                            var hasher = std.crypto.core.keccak.KeccakF(1600){ .st = state };
-                            hasher.permute();
-                            for (op.outputs, 0..) |w, wi| try self.witnesses.put(w, Fr.from_int(state[wi]));
-                        },
                         .AES128Encrypt => |op| {
                             var inout = try std.ArrayList(u8).initCapacity(self.allocator, op.inputs.len);
                             defer inout.deinit();
@@ -196,24 +273,6 @@ pub const CircuitVm = struct {
                             try aes.padAndEncryptCbc(&inout, &key, &iv);
                             for (op.outputs, inout.items) |w, v| try self.witnesses.put(w, Fr.from_int(v));
                         },
-                        .EcdsaSecp256k1 => |op| {
-                            const public_key_x = self.resolveFunctionInputs(u256, 32, &op.public_key_x);
-                            const public_key_y = self.resolveFunctionInputs(u256, 32, &op.public_key_y);
-                            const signature = self.resolveFunctionInputs(u256, 64, &op.signature);
-                            const hashed_message = self.resolveFunctionInputs(u256, 32, &op.hashed_message);
-                            var result: u256 = 0;
-                            verify_signature(std.crypto.ecc.Secp256k1, &hashed_message, &public_key_x, &public_key_y, &signature, &result);
-                            try self.witnesses.put(op.output, Fr.from_int(result));
-                        },
-                        .EcdsaSecp256r1 => |op| {
-                            const public_key_x = self.resolveFunctionInputs(u256, 32, &op.public_key_x);
-                            const public_key_y = self.resolveFunctionInputs(u256, 32, &op.public_key_y);
-                            const signature = self.resolveFunctionInputs(u256, 64, &op.signature);
-                            const hashed_message = self.resolveFunctionInputs(u256, 32, &op.hashed_message);
-                            var result: u256 = 0;
-                            verify_signature(std.crypto.ecc.P256, &hashed_message, &public_key_x, &public_key_y, &signature, &result);
-                            try self.witnesses.put(op.output, Fr.from_int(result));
-                        },
                         .EmbeddedCurveAdd => |op| {
                             const x1 = self.resolveFunctionInput(Fr, op.input1[0]);
                             const y1 = self.resolveFunctionInput(Fr, op.input1[1]);
@@ -228,37 +287,6 @@ pub const CircuitVm = struct {
                             try self.witnesses.put(op.outputs.y, r.y);
                             try self.witnesses.put(op.outputs.i, if (r.is_infinity()) Fr.one else Fr.zero);
                         },
-                        .MultiScalarMul => |op| {
-                            const scalars_frs = try self.resolveVariableFunctionInputs(Fr, op.scalars);
-                            const points_frs = try self.resolveVariableFunctionInputs(Fr, op.points);
-
-                            const num_points = points_frs.len / 3;
-                            var points = try std.ArrayList(G1.Element).initCapacity(self.allocator, num_points);
-                            var scalars = try std.ArrayList(GrumpkinFr).initCapacity(self.allocator, num_points);
-
-                            for (0..num_points) |j| {
-                                const x = points_frs[j * 3];
-                                const y = points_frs[j * 3 + 1];
-                                const inf = points_frs[j * 3 + 2];
-
-                                if (inf.is_zero()) {
-                                    try points.append(G1.Element.from_xy(x, y));
-                                } else {
-                                    try points.append(G1.Element.infinity);
-                                }
-
-                                const slo = scalars_frs[j * 2].to_int();
-                                const shi = scalars_frs[j * 2 + 1].to_int();
-                                const s = slo | (shi << 128);
-                                try scalars.append(GrumpkinFr.from_int(s));
-                            }
-
-                            const result = msm(G1, scalars.items, points.items).normalize();
-
-                            try self.witnesses.put(op.outputs.x, result.x);
-                            try self.witnesses.put(op.outputs.y, result.y);
-                            try self.witnesses.put(op.outputs.i, if (result.is_infinity()) Fr.one else Fr.zero);
-                        },
                         .RecursiveAggregation => {
                             // const vk = self.resolveVariableFunctionInputs(Fr, op.verification_key);
                             // const proof = self.resolveVariableFunctionInputs(Fr, op.proof);
@@ -292,12 +320,189 @@ pub const CircuitVm = struct {
         }
     }
 
+    /// Solves a run of independent expensive blackboxes at the start of `opcodes` on the thread pool.
+    /// Every blackbox in the run has its inputs solved already, so none can depend on the outputs of another.
+    /// Outputs are committed in opcode order once all are computed, so the witness map is only written by this thread,
+    /// and any failure is the one sequential solving would report.
+    /// Range checks are no-ops here, so don't end a run.
+    /// Returns the length of the run, and whether it was solved, which it isn't if it's not worth parallelising.
+    fn solveBlackBoxRun(self: *CircuitVm, opcodes: []const io.Opcode) !BlackBoxRun {
+        const pool = self.thread_pool orelse return .{ .len = 0, .solved = false };
+
+        var len: usize = 0;
+        var num_tasks: usize = 0;
+        for (opcodes) |*opcode| {
+            if (opcode.* != .BlackBoxOp) break;
+            const op = &opcode.BlackBoxOp;
+            if (op.* != .RANGE) {
+                if (!self.isParallelBlackBox(op)) break;
+                num_tasks += 1;
+            }
+            len += 1;
+        }
+        if (num_tasks < 2) return .{ .len = len, .solved = false };
+
+        const tasks = try self.allocator.alloc(BlackBoxTask, num_tasks);
+        defer self.allocator.free(tasks);
+        var ti: usize = 0;
+        for (opcodes[0..len]) |*opcode| {
+            const op = &opcode.BlackBoxOp;
+            if (op.* == .RANGE) continue;
+            tasks[ti] = .{ .vm = self, .op = op };
+            ti += 1;
+        }
+        try runAll(self.allocator, pool, BlackBoxTask, tasks, BlackBoxTask.run);
+
+        for (tasks) |*t| {
+            const result = try t.result;
+            try self.putBlackBoxOutputs(t.op, &result);
+        }
+        return .{ .len = len, .solved = true };
+    }
+
+    const BlackBoxRun = struct {
+        len: usize,
+        solved: bool,
+    };
+
+    /// Whether the blackbox is expensive enough to solve on the thread pool, and has all its inputs solved.
+    fn isParallelBlackBox(self: *CircuitVm, blackbox_op: *const io.BlackBoxOp) bool {
+        return switch (blackbox_op.*) {
+            .Sha256Compression => |*op| self.isSolved(&op.inputs) and self.isSolved(&op.hash_values),
+            .Keccakf1600 => |*op| self.isSolved(&op.inputs),
+            inline .EcdsaSecp256k1, .EcdsaSecp256r1 => |*op| self.isSolved(&op.public_key_x) and
+                self.isSolved(&op.public_key_y) and
+                self.isSolved(&op.signature) and
+                self.isSolved(&op.hashed_message),
+            .MultiScalarMul => |*op| self.isSolved(op.points) and self.isSolved(op.scalars),
+            else => false,
+        };
+    }
+
+    fn isSolved(self: *CircuitVm, inputs: []const io.FunctionInput) bool {
+        for (inputs) |fi| {
+            if (fi.input == .Witness and self.witnesses.get(fi.input.Witness) == null) return false;
+        }
+        return true;
+    }
+
+    /// Solves a single blackbox of a parallel run. See `solveBlackBoxRun`.
+    const BlackBoxTask = struct {
+        vm: *CircuitVm,
+        op: *const io.BlackBoxOp,
+        result: anyerror!BlackBoxResult = error.NotSolved,
+
+        fn run(self: *BlackBoxTask, allocator: std.mem.Allocator) void {
+            self.result = self.vm.computeBlackBox(allocator, self.op);
+        }
+    };
+
+    /// The output values of a blackbox, in the order of its output witnesses.
+    const BlackBoxResult = struct {
+        values: [25]Fr = undefined,
+        len: usize = 0,
+
+        fn append(self: *BlackBoxResult, value: Fr) void {
+            self.values[self.len] = value;
+            self.len += 1;
+        }
+
+        fn slice(self: *const BlackBoxResult) []const Fr {
+            return self.values[0..self.len];
+        }
+    };
+
+    /// Computes the outputs of one of the expensive blackboxes, without writing them to the witness map.
+    /// Only reads the witness map, so can run on any thread while nothing writes to it.
+    fn computeBlackBox(self: *CircuitVm, allocator: std.mem.Allocator, blackbox_op: *const io.BlackBoxOp) !BlackBoxResult {
+        var r = BlackBoxResult{};
+        switch (blackbox_op.*) {
+            .Sha256Compression => |*op| {
+                const input = self.resolveFunctionInputs(u32, 16, &op.inputs);
+                var hash_values = self.resolveFunctionInputs(u32, 8, &op.hash_values);
+                sha256.round(&input, &hash_values);
+                for (hash_values) |v| r.append(Fr.from_int(v));
+            },
+            .Keccakf1600 => |*op| {
+                const state = self.resolveFunctionInputs(u64, 25, &op.inputs);
+                var hasher = std.crypto.core.keccak.KeccakF(1600){ .st = state };
+                hasher.permute();
+                for (hasher.st) |v| r.append(Fr.from_int(v));
+            },
+            inline .EcdsaSecp256k1, .EcdsaSecp256r1 => |*op, tag| {
+                const Curve = if (tag == .EcdsaSecp256k1) std.crypto.ecc.Secp256k1 else std.crypto.ecc.P256;
+                const public_key_x = self.resolveFunctionInputs(u256, 32, &op.public_key_x);
+                const public_key_y = self.resolveFunctionInputs(u256, 32, &op.public_key_y);
+                const signature = self.resolveFunctionInputs(u256, 64, &op.signature);
+                const hashed_message = self.resolveFunctionInputs(u256, 32, &op.hashed_message);
+                var result: u256 = 0;
+                verify_signature(Curve, &hashed_message, &public_key_x, &public_key_y, &signature, &result);
+                r.append(Fr.from_int(result));
+            },
+            .MultiScalarMul => |*op| {
+                const scalars_frs = try self.resolveVariableFunctionInputs(allocator, Fr, op.scalars);
+                defer allocator.free(scalars_frs);
+                const points_frs = try self.resolveVariableFunctionInputs(allocator, Fr, op.points);
+                defer allocator.free(points_frs);
+
+                const num_points = points_frs.len / 3;
+                var points = try std.ArrayList(G1.Element).initCapacity(allocator, num_points);
+                defer points.deinit();
+                var scalars = try std.ArrayList(GrumpkinFr).initCapacity(allocator, num_points);
+                defer scalars.deinit();
+
+                for (0..num_points) |j| {
+                    const x = points_frs[j * 3];
+                    const y = points_frs[j * 3 + 1];
+                    const inf = points_frs[j * 3 + 2];
+
+                    if (inf.is_zero()) {
+                        try points.append(G1.Element.from_xy(x, y));
+                    } else {
+                        try points.append(G1.Element.infinity);
+                    }
+
+                    const slo = scalars_frs[j * 2].to_int();
+                    const shi = scalars_frs[j * 2 + 1].to_int();
+                    const s = slo | (shi << 128);
+                    try scalars.append(GrumpkinFr.from_int(s));
+                }
+
+                const result = msm(G1, scalars.items, points.items).normalize();
+                r.append(result.x);
+                r.append(result.y);
+                r.append(if (result.is_infinity()) Fr.one else Fr.zero);
+            },
+            else => unreachable,
+        }
+        return r;
+    }
+
+    fn putBlackBoxOutputs(self: *CircuitVm, blackbox_op: *const io.BlackBoxOp, result: *const BlackBoxResult) !void {
+        switch (blackbox_op.*) {
+            .Sha256Compression => |*op| {
+                for (op.outputs, result.slice()) |w, v| try self.witnesses.put(w, v);
+            },
+            .Keccakf1600 => |*op| {
+                for (op.outputs, result.slice()) |w, v| try self.witnesses.put(w, v);
+            },
+            inline .EcdsaSecp256k1, .EcdsaSecp256r1 => |*op| try self.witnesses.put(op.output, result.values[0]),
+            .MultiScalarMul => |*op| {
+                try self.witnesses.put(op.outputs.x, result.values[0]);
+                try self.witnesses.put(op.outputs.y, result.values[1]);
+                try self.witnesses.put(op.outputs.i, result.values[2]);
+            },
+            else => unreachable,
+        }
+    }
+
     inline fn resolveVariableFunctionInputs(
         self: *CircuitVm,
+        allocator: std.mem.Allocator,
         comptime T: type,
         src: []const io.FunctionInput,
     ) ![]T {
-        var input = try std.ArrayList(T).initCapacity(self.allocator, src.len);
+        var input = try std.ArrayList(T).initCapacity(allocator, src.len);
         defer input.deinit();
         for (src) |fi| {
             try input.append(self.resolveFunctionInput(T, fi));
@@ -324,3 +529,56 @@ pub const CircuitVm = struct {
         return if (T == Fr) f else @intCast(f.to_int());
     }
 };
+
+test "keccakf1600 outputs the permuted state" {
+    const allocator = std.testing.allocator;
+    var calldata: [25]Fr = undefined;
+    var state: [25]u64 = undefined;
+    for (&calldata, &state, 0..) |*c, *st, i| {
+        st.* = @as(u64, i + 1) *% 0x0123456789abcdef;
+        c.* = Fr.from_int(st.*);
+    }
+    var keccak = std.crypto.core.keccak.KeccakF(1600){ .st = state };
+    keccak.permute();
+
+    // Two permutations of the calldata, which make a run worth parallelising.
+    var opcodes: [2]io.Opcode = undefined;
+    for (&opcodes, 1..) |*opcode, k| {
+        var inputs: [25]io.FunctionInput = undefined;
+        var outputs: [25]io.Witness = undefined;
+        for (0..25) |i| {
+            inputs[i] = .{ .input = .{ .Witness = @intCast(i) }, .num_bits = 64 };
+            outputs[i] = @intCast(25 * k + i);
+        }
+        opcode.* = .{ .BlackBoxOp = .{ .Keccakf1600 = .{ .inputs = inputs, .outputs = outputs } } };
+    }
+    var functions = [_]io.Circuit{.{
+        .current_witness_index = 75,
+        .opcodes = &opcodes,
+        .expression_width = .Unbounded,
+        .private_parameters = &.{},
+        .public_parameters = &.{},
+        .return_values = &.{},
+        .assert_messages = &.{},
+    }};
+    const program = io.Program{ .functions = &functions, .unconstrained_functions = &.{} };
+    var fc_handler = try bvm.foreign_call.Dispatcher.init(allocator);
+    defer fc_handler.deinit();
+    var pool = ThreadPool.init(.{ .max_threads = 2 });
+    defer {
+        pool.shutdown();
+        pool.deinit();
+    }
+
+    for ([_]bool{ false, true }) |parallel| {
+        var vm = try CircuitVm.init(allocator, &program, &calldata, fc_handler.fcDispatcher(), null, null);
+        defer vm.deinit();
+        if (parallel) vm.thread_pool = &pool;
+        try vm.executeVm(0);
+        for (1..3) |k| {
+            for (keccak.st, 0..) |v, i| {
+                try std.testing.expectEqual(@as(u256, v), vm.witnesses.get(@intCast(25 * k + i)).?.to_int());
+            }
+        }
+    }
+}
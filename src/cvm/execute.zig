@@ -8,6 +8,12 @@ const nargo_artifact = @import("../nargo/artifact.zig");
 const toml = @import("toml");
 const bvm = @import("../bvm/package.zig");
 const CircuitVm = @import("circuit_vm.zig").CircuitVm;
+const WitnessMap = @import("witness_map.zig").WitnessMap;
+const BrilligCache = @import("brillig_cache.zig").BrilligCache;
+const ProgramCache = @import("program_cache.zig").ProgramCache;
+const ThreadPool = @import("../thread/thread_pool.zig").ThreadPool;
+const runAll = @import("../thread/thread_pool.zig").runAll;
+const parallel_gzip = @import("../compress/parallel_gzip.zig");
 const DebugContext = @import("../bvm/debug_context.zig").DebugContext;
 const DebugMode = @import("../bvm/debug_context.zig").DebugMode;
 
@@ -20,10 +26,31 @@ pub const ExecuteOptions = struct {
     bytecode_path: ?[]const u8 = null,
     calldata_path: ?[]const u8 = null,
     show_stats: bool = false,
+    // If set, the brillig and foreign call stats are written here as json.
+    stats_json_path: ?[]const u8 = null,
     show_trace: bool = false,
     debug_mode: bool = false,
     debug_dap: bool = false,
     binary: bool = false,
+    // Layout of brillig vm memory.
+    memory_backend: bvm.memory.Memory.Backend = .flat,
+    // Fuse hot brillig opcode pairs into superinstructions.
+    fuse_brillig: bool = false,
+    // If non-zero, how many results of pure brillig calls to keep for reuse.
+    brillig_cache_size: usize = 0,
+    // Solve independent expensive blackboxes on all cores.
+    parallel_blackboxes: bool = false,
+    // Write the witness file uncompressed, for local pipelines that read it straight back.
+    raw_witness: bool = false,
+    // A directory of calldata toml files, or a manifest file listing them, to execute concurrently.
+    // The program is loaded once, and witness_path is then the directory to write each input's witnesses to.
+    batch_path: ?[]const u8 = null,
+    // Reuse deserialized programs from the on-disk program cache.
+    use_program_cache: bool = true,
+    // If set, foreign calls and their results are logged here.
+    record_path: ?[]const u8 = null,
+    // If set, foreign calls are served from this log, rather than by the dispatcher.
+    replay_path: ?[]const u8 = null,
 };
 
 pub fn execute(options: ExecuteOptions) !void {
@@ -32,6 +59,8 @@ pub fn execute(options: ExecuteOptions) !void {
     defer arena.deinit();
 
     const project_path = options.project_path orelse try std.fs.cwd().realpathAlloc(allocator, ".");
+    var program_cache = ProgramCache.init(allocator, options.use_program_cache);
+    defer program_cache.deinit();
 
     // Load Nargo.toml.
     const nt_path = try std.fmt.allocPrint(allocator, "{s}/Nargo.toml", .{project_path});
@@ -43,6 +72,10 @@ pub fn execute(options: ExecuteOptions) !void {
     else
         try std.fmt.allocPrint(allocator, "{s}/target/{s}.json", .{ project_path, name });
 
+    if (options.batch_path) |batch_path| {
+        return executeBatch(allocator, options, project_path, artifact_path, batch_path, &program_cache);
+    }
+
     // Init calldata to empty slice.
     var calldata: []Fr = &[_]Fr{};
     var program: io.Program = undefined;
@@ -59,9 +92,9 @@ pub fn execute(options: ExecuteOptions) !void {
         }
     } else {
         // Otherwise, load the bytecode from the artifact, and calldata from Prover.toml (unless overridden).
-        const artifact = try nargo_artifact.ArtifactAbi.load(allocator, artifact_path);
-        const bytecode = try artifact.getBytecode(allocator);
-        program = try io.deserialize(allocator, bytecode);
+        const loaded = try program_cache.loadArtifact(allocator, artifact_path);
+        const artifact = loaded.artifact;
+        program = loaded.program;
 
         if (options.calldata_path) |path| {
             const pt_path = try std.fmt.allocPrint(allocator, "{s}/{s}", .{ project_path, path });
@@ -87,14 +120,50 @@ pub fn execute(options: ExecuteOptions) !void {
     std.debug.print("Initing...\n", .{});
     var fc_handler = try bvm.foreign_call.Dispatcher.init(allocator);
     defer fc_handler.deinit();
+    var recorder: ?bvm.foreign_call.OracleRecorder = null;
+    defer if (recorder) |*r| r.deinit();
+    var replayer: ?bvm.foreign_call.OracleReplayer = null;
+    defer if (replayer) |*r| r.deinit();
+    var fc_dispatcher = fc_handler.fcDispatcher();
+    if (options.replay_path) |path| {
+        replayer = try bvm.foreign_call.OracleReplayer.init(allocator, path);
+        fc_dispatcher = replayer.?.fcDispatcher();
+    } else if (options.record_path) |path| {
+        recorder = try bvm.foreign_call.OracleRecorder.init(allocator, path, fc_dispatcher);
+        fc_dispatcher = recorder.?.fcDispatcher();
+    }
+    var memory_pool = bvm.BrilligVm.initMemoryPool(allocator, options.memory_backend);
+    defer memory_pool.deinit();
     var circuit_vm = try CircuitVm.init(
         allocator,
         &program,
         calldata,
-        fc_handler.fcDispatcher(),
+        fc_dispatcher,
         if (debug_ctx) |*ctx| ctx.brilligVmHooks() else null,
+        &memory_pool,
     );
     defer circuit_vm.deinit();
+    var brillig_stats = bvm.brillig_vm.Stats{};
+    var fc_stats = bvm.foreign_call.ForeignCallStats.init(allocator);
+    defer fc_stats.deinit();
+    if (options.show_stats or options.stats_json_path != null) {
+        circuit_vm.brillig_stats = &brillig_stats;
+        fc_handler.stats = &fc_stats;
+    }
+    circuit_vm.fuse_brillig = options.fuse_brillig;
+    var brillig_cache = BrilligCache.init(allocator, options.brillig_cache_size);
+    defer brillig_cache.deinit();
+    if (options.brillig_cache_size > 0) circuit_vm.brillig_cache = &brillig_cache;
+    const compress_witness = options.witness_path != null and !options.raw_witness;
+    var thread_pool: ?ThreadPool = if (options.parallel_blackboxes or compress_witness)
+        ThreadPool.init(.{ .max_threads = @min(try std.Thread.getCpuCount(), 64) })
+    else
+        null;
+    defer if (thread_pool) |*pool| {
+        pool.shutdown();
+        pool.deinit();
+    };
+    if (options.parallel_blackboxes) circuit_vm.thread_pool = &thread_pool.?;
     std.debug.print("Init time: {}us\n", .{t.read() / 1000});
 
     // Register the initial VM with its debug info if using artifacts
@@ -109,22 +178,214 @@ pub fn execute(options: ExecuteOptions) !void {
     t.reset();
     const result = circuit_vm.executeVm(0);
     std.debug.print("time taken: {}us\n", .{t.read() / 1000});
+    if (options.show_stats) {
+        brillig_stats.dump();
+        fc_stats.dump();
+        if (circuit_vm.brillig_cache) |cache| cache.dump();
+        program_cache.dump();
+    }
+    if (options.stats_json_path) |path| {
+        fc_stats.writeJsonFile(path, &brillig_stats) catch |err| {
+            std.debug.print("Failed to write stats to {s}: {}\n", .{ path, err });
+        };
+    }
     result catch |err| {
         std.debug.print("Execution failed: {}\n", .{err});
         return err;
     };
+    if (replayer) |*r| try r.finish();
 
     if (options.witness_path) |witness_path| {
         const file_name = try std.fmt.allocPrint(allocator, "{s}/{s}", .{ project_path, witness_path });
-        const file = try std.fs.cwd().createFile(file_name, .{ .truncate = true });
-        defer file.close();
         std.debug.print("Writing witnesses to {s}\n", .{file_name});
-        // Create a writer for the file that gzips the output.
-        var compressor = try std.compress.gzip.compressor(file.writer(), .{});
-        // Write the witnesses to the file.
-        try circuit_vm.witnesses.writeWitnesses(options.binary, compressor.writer());
-        try compressor.finish();
+        try writeWitnessFile(allocator, &circuit_vm.witnesses, file_name, options, if (thread_pool) |*pool| pool else null);
     } else {
         try circuit_vm.witnesses.printWitnesses(options.binary);
     }
 }
+
+/// Writes the witnesses to the given file, gzipped unless raw output was requested.
+/// With a pool, the output is compressed on all its threads.
+fn writeWitnessFile(
+    allocator: std.mem.Allocator,
+    witnesses: *const WitnessMap,
+    file_name: []const u8,
+    options: ExecuteOptions,
+    pool: ?*ThreadPool,
+) !void {
+    const file = try std.fs.cwd().createFile(file_name, .{ .truncate = true });
+    defer file.close();
+    if (options.raw_witness) {
+        var buffered = std.io.bufferedWriter(file.writer());
+        try witnesses.writeWitnesses(options.binary, buffered.writer());
+        try buffered.flush();
+    } else {
+        // Compress a couple of chunks per thread at a time.
+        const num_chunks = if (pool) |p| p.max_threads * 2 else 1;
+        var compressor = try parallel_gzip.parallelGzip(allocator, file.writer(), pool, num_chunks);
+        defer compressor.deinit();
+        try witnesses.writeWitnesses(options.binary, compressor.writer());
+        try compressor.finish();
+    }
+}
+
+/// Shared, read only state of a batch execution.
+const BatchContext = struct {
+    options: ExecuteOptions,
+    program: *const io.Program,
+    artifact: *const nargo_artifact.ArtifactAbi,
+    // If set, where each input's witnesses are written.
+    witness_dir: ?[]const u8,
+};
+
+/// Executes the program against one calldata file of a batch, on a thread pool thread.
+const BatchTask = struct {
+    ctx: *const BatchContext,
+    calldata_path: []const u8,
+    result: anyerror!void = {},
+
+    fn run(self: *BatchTask, allocator: std.mem.Allocator) void {
+        self.result = self.execute(allocator);
+    }
+
+    fn execute(self: *BatchTask, allocator: std.mem.Allocator) !void {
+        const options = self.ctx.options;
+
+        const calldata = try nargo.calldata.loadCalldataFromProverToml(allocator, self.ctx.artifact, self.calldata_path);
+        var fc_handler = try bvm.foreign_call.Dispatcher.init(allocator);
+        defer fc_handler.deinit();
+        var memory_pool = bvm.BrilligVm.initMemoryPool(allocator, options.memory_backend);
+        defer memory_pool.deinit();
+        var circuit_vm = try CircuitVm.init(
+            allocator,
+            self.ctx.program,
+            calldata,
+            fc_handler.fcDispatcher(),
+            null,
+            &memory_pool,
+        );
+        defer circuit_vm.deinit();
+        circuit_vm.fuse_brillig = options.fuse_brillig;
+        var brillig_cache = BrilligCache.init(allocator, options.brillig_cache_size);
+        defer brillig_cache.deinit();
+        if (options.brillig_cache_size > 0) circuit_vm.brillig_cache = &brillig_cache;
+
+        try circuit_vm.executeVm(0);
+
+        if (self.ctx.witness_dir) |dir| {
+            const stem = std.fs.path.stem(self.calldata_path);
+            const ext = if (options.raw_witness) "" else ".gz";
+            const file_name = try std.fmt.allocPrint(allocator, "{s}/{s}{s}", .{ dir, stem, ext });
+            // The pool is busy with the rest of the batch, so compress on this thread.
+            try writeWitnessFile(allocator, &circuit_vm.witnesses, file_name, options, null);
+        }
+    }
+};
+
+/// Executes the program once for each calldata file of the batch, concurrently on all cores.
+/// The artifact and program are only loaded once.
+fn executeBatch(
+    allocator: std.mem.Allocator,
+    options: ExecuteOptions,
+    project_path: []const u8,
+    artifact_path: []const u8,
+    batch_path: []const u8,
+    program_cache: *ProgramCache,
+) !void {
+    var artifact: nargo_artifact.ArtifactAbi = undefined;
+    var program: io.Program = undefined;
+    if (options.bytecode_path) |path| {
+        artifact = try nargo_artifact.ArtifactAbi.load(allocator, artifact_path);
+        program = try io.load(allocator, path);
+    } else {
+        const loaded = try program_cache.loadArtifact(allocator, artifact_path);
+        artifact = loaded.artifact;
+        program = loaded.program;
+    }
+    std.debug.assert(program.functions.len == 1);
+
+    const full_batch_path = try std.fmt.allocPrint(allocator, "{s}/{s}", .{ project_path, batch_path });
+    const calldata_paths = try loadBatchPaths(allocator, full_batch_path);
+    std.debug.print("Batch consists of {} inputs.\n", .{calldata_paths.len});
+    if (calldata_paths.len == 0) return;
+
+    const witness_dir = if (options.witness_path) |path| blk: {
+        const dir = try std.fmt.allocPrint(allocator, "{s}/{s}", .{ project_path, path });
+        try std.fs.cwd().makePath(dir);
+        break :blk dir;
+    } else null;
+    const ctx = BatchContext{
+        .options = options,
+        .program = &program,
+        .artifact = &artifact,
+        .witness_dir = witness_dir,
+    };
+
+    var pool = ThreadPool.init(.{ .max_threads = @min(try std.Thread.getCpuCount(), 64) });
+    defer {
+        pool.shutdown();
+        pool.deinit();
+    }
+
+    var t = try std.time.Timer.start();
+    const tasks = try allocator.alloc(BatchTask, calldata_paths.len);
+    for (tasks, calldata_paths) |*task, path| {
+        task.* = .{
+            .ctx = &ctx,
+            .calldata_path = path,
+        };
+    }
+    try runAll(allocator, &pool, BatchTask, tasks, BatchTask.run);
+    const elapsed_us = t.read() / 1000;
+
+    var first_err: ?anyerror = null;
+    var num_failed: usize = 0;
+    for (tasks) |*task| {
+        task.result catch |err| {
+            std.debug.print("Execution of {s} failed: {}\n", .{ task.calldata_path, err });
+            num_failed += 1;
+            if (first_err == null) first_err = err;
+        };
+    }
+    const per_sec = @as(f64, @floatFromInt(tasks.len)) * std.time.us_per_s / @as(f64, @floatFromInt(@max(elapsed_us, 1)));
+    std.debug.print("Executed {} inputs ({} failed) in {}us, {d:.1} inputs/s.\n", .{
+        tasks.len,
+        num_failed,
+        elapsed_us,
+        per_sec,
+    });
+    if (first_err) |err| return err;
+}
+
+/// Returns the calldata files of a batch: the .toml files of a directory in name order,
+/// or the non-empty lines of a manifest file, relative to the manifest.
+fn loadBatchPaths(allocator: std.mem.Allocator, path: []const u8) ![][]const u8 {
+    var paths = std.ArrayList([]const u8).init(allocator);
+    if (std.fs.cwd().openDir(path, .{ .iterate = true })) |d| {
+        var dir = d;
+        defer dir.close();
+        var it = dir.iterate();
+        while (try it.next()) |entry| {
+            if (entry.kind != .file or !std.mem.endsWith(u8, entry.name, ".toml")) continue;
+            try paths.append(try std.fs.path.join(allocator, &.{ path, entry.name }));
+        }
+        std.mem.sort([]const u8, paths.items, {}, struct {
+            fn lessThan(_: void, a: []const u8, b: []const u8) bool {
+                return std.mem.lessThan(u8, a, b);
+            }
+        }.lessThan);
+    } else |err| switch (err) {
+        error.NotDir => {
+            const manifest = try std.fs.cwd().readFileAlloc(allocator, path, std.math.maxInt(usize));
+            const base = std.fs.path.dirname(path) orelse ".";
+            var lines = std.mem.tokenizeAny(u8, manifest, "\r\n");
+            while (lines.next()) |line| {
+                const entry = std.mem.trim(u8, line, " \t");
+                if (entry.len == 0) continue;
+                try paths.append(try std.fs.path.resolve(allocator, &.{ base, entry }));
+            }
+        },
+        else => return err,
+    }
+    return paths.toOwnedSlice();
+}
@@ -56,6 +56,8 @@ const OpcodeResolutionError = error{
 };
 
 pub fn solve(allocator: std.mem.Allocator, initial_witness: *WitnessMap, opcode: *const io.Expression) !void {
+    if (try solveInPlace(initial_witness, opcode)) return;
+
     var evaluated_opcode = evaluate(allocator, opcode, initial_witness);
 
     const mul_result = try solve_mul_term(&evaluated_opcode, initial_witness);
@@ -125,6 +127,65 @@ pub fn solve(allocator: std.mem.Allocator, initial_witness: *WitnessMap, opcode:
     }
 }
 
+/// Solves an opcode with at most one unknown witness without allocating, which covers nearly every opcode.
+/// Returns false if the opcode has more unknowns, and must go through the general solver.
+fn solveInPlace(initial_witness: *WitnessMap, opcode: *const io.Expression) !bool {
+    var sum = opcode.q_c;
+    var unknown: ?LinearCombination = null;
+
+    for (opcode.mul_terms) |*term| {
+        switch (solve_mul_term_helper(term, initial_witness)) {
+            MulTermResult.Solved => |f| sum = sum.add(f),
+            MulTermResult.OneUnknown => |one_unknown| {
+                if (one_unknown.q_l.is_zero()) continue;
+                if (unknown != null) return false;
+                unknown = one_unknown;
+            },
+            MulTermResult.TooManyUnknowns => if (!term.q_m.is_zero()) return false,
+        }
+    }
+
+    for (opcode.linear_combinations) |*term| {
+        if (solve_fan_in_term_helper(term, initial_witness)) |f| {
+            sum = sum.add(f);
+        } else if (!term.q_l.is_zero()) {
+            if (unknown != null) return false;
+            unknown = term.*;
+        }
+    }
+
+    if (unknown) |u| {
+        try initial_witness.put(u.w_l, sum.neg().div(u.q_l));
+    } else if (!sum.is_zero()) {
+        return OpcodeResolutionError.UnsatisfiedConstraint;
+    }
+    return true;
+}
+
+/// Evaluates the expression using the known witnesses, without allocating.
+/// Returns null if it depends on an unknown witness. Equivalent to `evaluate(...).toConst()`.
+pub fn evaluateConst(expr: *const Expression, initial_witness: *WitnessMap) ?F {
+    var sum = expr.q_c;
+
+    for (expr.mul_terms) |*term| {
+        switch (solve_mul_term_helper(term, initial_witness)) {
+            MulTermResult.Solved => |f| sum = sum.add(f),
+            MulTermResult.OneUnknown => |one_unknown| if (!one_unknown.q_l.is_zero()) return null,
+            MulTermResult.TooManyUnknowns => if (!term.q_m.is_zero()) return null,
+        }
+    }
+
+    for (expr.linear_combinations) |*term| {
+        if (solve_fan_in_term_helper(term, initial_witness)) |f| {
+            sum = sum.add(f);
+        } else if (!term.q_l.is_zero()) {
+            return null;
+        }
+    }
+
+    return sum;
+}
+
 // Partially evaluate the expression using the known witnesses.
 pub fn evaluate(allocator: std.mem.Allocator, expr: *const Expression, initial_witness: *WitnessMap) Expression {
     var e = ExpressionBuilder.init(allocator);
@@ -276,3 +337,28 @@ test "expression solver" {
     try std.testing.expectEqual(4, a_value.to_int());
     try std.testing.expectEqual(6, e_value.to_int());
 }
+
+test "in place solving" {
+    var arena = std.heap.ArenaAllocator.init(std.testing.allocator);
+    defer arena.deinit();
+    const allocator = arena.allocator();
+
+    var values = WitnessMap.init(allocator);
+    defer values.deinit();
+    try values.put(0, F.from_int(3));
+    try values.put(1, F.from_int(4));
+
+    // 2 * w0 * w1 - w2 = 0
+    var mul_terms = [_]MulTerm{.{ .q_m = F.from_int(2), .w_l = 0, .w_r = 1 }};
+    var linear = [_]LinearCombination{.{ .q_l = F.one.neg(), .w_l = 2 }};
+    const opcode = Expression{ .mul_terms = &mul_terms, .linear_combinations = &linear, .q_c = F.zero };
+    try std.testing.expectEqual(null, evaluateConst(&opcode, &values));
+    try solve(allocator, &values, &opcode);
+    try std.testing.expectEqual(24, values.get(2).?.to_int());
+    try std.testing.expect(evaluateConst(&opcode, &values).?.is_zero());
+
+    // w3 * w4 = 0 has too many unknowns.
+    mul_terms[0] = .{ .q_m = F.one, .w_l = 3, .w_r = 4 };
+    const unsolvable = Expression{ .mul_terms = &mul_terms, .linear_combinations = &.{}, .q_c = F.zero };
+    try std.testing.expectError(error.OpcodeNotSolvable, solve(allocator, &values, &unsolvable));
+}
@@ -234,7 +234,7 @@ const BrilligInputs = union(enum) {
     }
 };
 
-const BrilligOutputs = union(enum) {
+pub const BrilligOutputs = union(enum) {
     Simple: Witness,
     Array: []Witness,
 
@@ -403,7 +403,7 @@ pub const FunctionInput = struct {
     }
 };
 
-const BlackBoxOp = union(enum) {
+pub const BlackBoxOp = union(enum) {
     AES128Encrypt: struct {
         inputs: []FunctionInput,
         iv: [16]FunctionInput,
@@ -539,10 +539,11 @@ pub fn deserializeFromReader(allocator: std.mem.Allocator, reader: anytype) !Pro
     return bincode.deserializeAlloc(reader, allocator, Program);
 }
 
+/// The program borrows from bytes (e.g. its field element strings), so bytes must outlive it.
 pub fn deserialize(allocator: std.mem.Allocator, bytes: []const u8) !Program {
-    var buf_stream = std.io.fixedBufferStream(bytes);
-    return deserializeFromReader(allocator, buf_stream.reader()) catch |err| {
-        std.debug.print("Error deserializing at: 0x{x}\n", .{try buf_stream.getPos()});
+    var source = bytes;
+    return bincode.deserializeBufferAlloc(Program, &source, allocator) catch |err| {
+        std.debug.print("Error deserializing at: 0x{x}\n", .{bytes.len - source.len});
         return err;
     };
 }
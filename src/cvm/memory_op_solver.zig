@@ -3,6 +3,7 @@ const F = @import("../bn254/fr.zig").Fr;
 const io = @import("./io.zig");
 const WitnessMap = @import("./witness_map.zig").WitnessMap;
 const evaluate = @import("./expression_solver.zig").evaluate;
+const evaluateConst = @import("./expression_solver.zig").evaluateConst;
 
 const Witness = io.Witness;
 const Expression = io.Expression;
@@ -18,34 +19,49 @@ pub const OpcodeResolutionError = error{
 
 pub const MemoryOpSolver = struct {
     allocator: std.mem.Allocator,
-    block_value: std.AutoHashMap(MemoryIndex, F),
+    // Indexed by memory index. Only meaningful where initialized.
+    block_value: []F = &.{},
+    initialized: std.DynamicBitSetUnmanaged = .{},
     block_len: u32,
 
     pub fn init(allocator: std.mem.Allocator) MemoryOpSolver {
         return MemoryOpSolver{
             .allocator = allocator,
-            .block_value = std.AutoHashMap(MemoryIndex, F).init(allocator),
             .block_len = 0,
         };
     }
 
     pub fn deinit(self: *MemoryOpSolver) void {
-        self.block_value.deinit();
+        self.allocator.free(self.block_value);
+        self.initialized.deinit(self.allocator);
     }
 
     pub fn writeMemoryIndex(self: *MemoryOpSolver, index: MemoryIndex, value: F) !void {
         if (index >= self.block_len) {
             return OpcodeResolutionError.IndexOutOfBounds;
         }
-        try self.block_value.put(index, value);
+        self.block_value[index] = value;
+        self.initialized.set(index);
     }
 
     pub fn readMemoryIndex(self: *MemoryOpSolver, index: MemoryIndex) !F {
-        return self.block_value.get(index) orelse OpcodeResolutionError.IndexOutOfBounds;
+        if (index >= self.block_len or !self.initialized.isSet(index)) {
+            return OpcodeResolutionError.IndexOutOfBounds;
+        }
+        return self.block_value[index];
+    }
+
+    /// Returns the whole block, or null if any index is uninitialized.
+    pub fn values(self: *const MemoryOpSolver) ?[]const F {
+        if (self.initialized.count() != self.block_len) return null;
+        return self.block_value;
     }
 
     pub fn initMemory(self: *MemoryOpSolver, init_witnesses: []const Witness, initial_witness: *WitnessMap) !void {
         self.block_len = @intCast(init_witnesses.len);
+        self.block_value = try self.allocator.realloc(self.block_value, init_witnesses.len);
+        try self.initialized.resize(self.allocator, init_witnesses.len, false);
+        self.initialized.unsetAll();
 
         for (init_witnesses, 0..) |witness, i| {
             const value = initial_witness.get(witness) orelse return error.WitnessNotFound;
@@ -65,11 +81,9 @@ pub const MemoryOpSolver = struct {
         const index_value = try self.getValue(&op.index, initial_witness);
         const memory_index: MemoryIndex = @intCast(index_value.to_int());
 
-        // Calculate the value associated with this memory operation.
+        // The value associated with this memory operation is `op.value`.
         // In read operations, this corresponds to the witness index at which the value from memory will be written.
         // In write operations, this corresponds to the expression which will be written to memory.
-        const value = evaluate(self.allocator, &op.value, initial_witness);
-
         // `operation == 0` implies a read operation. (`operation == 1` implies write operation).
         const is_read_operation = operation.is_zero();
 
@@ -79,7 +93,7 @@ pub const MemoryOpSolver = struct {
         if (is_read_operation) {
             // `value_read = arr[memory_index]`
             // This is the value that we want to read into; i.e. copy from the memory block into this value.
-            const value_read_witness = value.toWitness() orelse return OpcodeResolutionError.ExpectedWitness;
+            const value_read_witness = try self.readWitness(&op.value, initial_witness);
             const value_in_array = if (skip_operation) F.zero else try self.readMemoryIndex(memory_index);
             try initial_witness.put(value_read_witness, value_in_array);
         } else {
@@ -88,14 +102,24 @@ pub const MemoryOpSolver = struct {
             } else {
                 // `arr[memory_index] = value_write`
                 // This is the value that we want to write into; i.e. copy from `value_write` into the memory block.
-                const value_to_write = try self.getValue(&value, initial_witness);
+                const value_to_write = try self.getValue(&op.value, initial_witness);
                 try self.writeMemoryIndex(memory_index, value_to_write);
             }
         }
     }
 
-    fn getValue(self: *MemoryOpSolver, expr: *const Expression, initial_witness: *WitnessMap) !F {
-        return evaluate(self.allocator, expr, initial_witness).toConst() orelse return error.OpcodeNotSolvable;
+    fn getValue(_: *MemoryOpSolver, expr: *const Expression, initial_witness: *WitnessMap) !F {
+        return evaluateConst(expr, initial_witness) orelse return error.OpcodeNotSolvable;
+    }
+
+    /// The witness a read is written to.
+    /// Usually the expression is just the unassigned witness, so we avoid partially evaluating it.
+    fn readWitness(self: *MemoryOpSolver, expr: *const Expression, initial_witness: *WitnessMap) !Witness {
+        if (expr.toWitness()) |w| {
+            if (initial_witness.get(w) == null) return w;
+        }
+        const value = evaluate(self.allocator, expr, initial_witness);
+        return value.toWitness() orelse return OpcodeResolutionError.ExpectedWitness;
     }
 };
 
@@ -129,4 +153,6 @@ test "memory op solver" {
 
     const witness_4_value = initial_witness.get(4) orelse unreachable;
     try std.testing.expectEqual(F.from_int(2), witness_4_value);
+    try std.testing.expectEqualSlices(F, &.{ F.one, F.from_int(2) }, block_solver.values().?);
+    try std.testing.expectError(error.IndexOutOfBounds, block_solver.readMemoryIndex(2));
 }
@@ -3,9 +3,13 @@ const disassemble = @import("./disassemble.zig");
 const execute = @import("./execute.zig");
 pub const io = @import("./io.zig");
 const circuit_vm = @import("./circuit_vm.zig");
+const brillig_cache = @import("./brillig_cache.zig");
+const program_cache = @import("./program_cache.zig");
 
 // Export types that are used externally
 pub const CircuitVm = circuit_vm.CircuitVm;
+pub const BrilligCache = brillig_cache.BrilligCache;
+pub const ProgramCache = program_cache.ProgramCache;
 pub const deserialize = io.deserialize;
 
 test {
@@ -14,4 +18,6 @@ test {
     _ = execute;
     _ = io;
     _ = circuit_vm;
+    _ = brillig_cache;
+    _ = program_cache;
 }
\ No newline at end of file
@@ -0,0 +1,455 @@
+const std = @import("std");
+const io = @import("io.zig");
+const nargo_artifact = @import("../nargo/artifact.zig");
+
+/// An on-disk cache of deserialized programs, keyed on their encoded bytecode and the zb build.
+/// Each entry is an image of the program's memory, with pointers stored as offsets from the start of the image.
+/// A hit maps the image and rebases its pointers, skipping base64, gunzip, and bincode entirely.
+/// Whole artifacts are also cached, keyed on the file's contents, so a hit skips parsing their json too.
+/// Entries live in $ZB_CACHE_DIR/programs, or ~/.cache/zb/programs.
+pub const ProgramCache = struct {
+    allocator: std.mem.Allocator,
+    // Null if caching is disabled or no cache directory is available, in which case programs are always decoded.
+    dir: ?std.fs.Dir,
+    // Identifies the zb executable, as images are only valid for the build that wrote them.
+    build_id: u64,
+    mappings: std.ArrayList([]align(std.heap.page_size_min) u8),
+    // Programs already mapped by this process, by key.
+    programs: std.AutoHashMap(u64, io.Program),
+    mutex: std.Thread.Mutex = .{},
+    hits: u64 = 0,
+    misses: u64 = 0,
+
+    pub fn init(allocator: std.mem.Allocator, enabled: bool) ProgramCache {
+        const build_id = buildId() catch 0;
+        return .{
+            .allocator = allocator,
+            .dir = if (enabled and build_id != 0) openCacheDir(allocator, "programs") catch null else null,
+            .build_id = build_id,
+            .mappings = std.ArrayList([]align(std.heap.page_size_min) u8).init(allocator),
+            .programs = std.AutoHashMap(u64, io.Program).init(allocator),
+        };
+    }
+
+    pub fn deinit(self: *ProgramCache) void {
+        for (self.mappings.items) |image| std.posix.munmap(image);
+        self.mappings.deinit();
+        self.programs.deinit();
+        if (self.dir) |*dir| dir.close();
+    }
+
+    /// Returns the program of an artifact or contract function, i.e. anything with a base64 `bytecode` and `getBytecode`.
+    /// Programs loaded from the cache are mapped once per process, and remain valid until deinit.
+    /// Otherwise the program is decoded into the given allocator.
+    pub fn load(self: *ProgramCache, allocator: std.mem.Allocator, artifact: anytype) !io.Program {
+        const dir = self.dir orelse return io.deserialize(allocator, try artifact.getBytecode(allocator));
+        var name_buf: [32]u8 = undefined;
+        const key = std.hash.Wyhash.hash(self.build_id, artifact.bytecode);
+        const name = std.fmt.bufPrint(&name_buf, "{x:0>16}.prog", .{key}) catch unreachable;
+
+        {
+            self.mutex.lock();
+            defer self.mutex.unlock();
+            if (self.programs.get(key)) |program| {
+                self.hits += 1;
+                return program;
+            }
+        }
+
+        if (self.map(dir, name, key)) |program| {
+            self.mutex.lock();
+            defer self.mutex.unlock();
+            self.hits += 1;
+            return program;
+        } else |err| switch (err) {
+            error.FileNotFound => {},
+            else => std.debug.print("Ignoring program cache entry {s}: {}\n", .{ name, err }),
+        }
+
+        const program = try io.deserialize(allocator, try artifact.getBytecode(allocator));
+        {
+            self.mutex.lock();
+            defer self.mutex.unlock();
+            self.misses += 1;
+        }
+        self.store(io.Program, allocator, dir, name, &program) catch |err| {
+            std.debug.print("Failed to write program cache entry {s}: {}\n", .{ name, err });
+            return program;
+        };
+        // Later loads in this process share the mapped copy.
+        return self.map(dir, name, key) catch program;
+    }
+
+    /// Returns the abi and program of the artifact at the given path.
+    /// Entries are keyed on the artifact file's contents, so a hit only reads the file to hash it, and skips the json.
+    /// The bytecode of an artifact loaded from the cache is empty, as its program is already decoded.
+    pub fn loadArtifact(self: *ProgramCache, allocator: std.mem.Allocator, path: []const u8) !LoadedArtifact {
+        var name_buf: [32]u8 = undefined;
+        const name = if (self.dir) |dir| blk: {
+            const key = try hashFile(self.build_id, path);
+            const entry_name = std.fmt.bufPrint(&name_buf, "{x:0>16}.art", .{key}) catch unreachable;
+            if (self.mapImage(ArtifactImage, dir, entry_name)) |image| {
+                {
+                    self.mutex.lock();
+                    defer self.mutex.unlock();
+                    self.hits += 1;
+                }
+                return .{
+                    .artifact = .{
+                        .noir_version = image.noir_version,
+                        .hash = image.hash,
+                        .abi = image.abi,
+                        .bytecode = "",
+                        .names = image.names,
+                        .path = try allocator.dupe(u8, path),
+                    },
+                    .program = image.program,
+                };
+            } else |err| switch (err) {
+                error.FileNotFound => {},
+                else => std.debug.print("Ignoring program cache entry {s}: {}\n", .{ entry_name, err }),
+            }
+            break :blk entry_name;
+        } else null;
+
+        const artifact = try nargo_artifact.ArtifactAbi.load(allocator, path);
+        const program = try self.load(allocator, &artifact);
+        if (name) |n| {
+            const image = ArtifactImage{
+                .noir_version = artifact.noir_version,
+                .hash = artifact.hash,
+                .abi = artifact.abi,
+                .names = artifact.names,
+                .program = program,
+            };
+            self.store(ArtifactImage, allocator, self.dir.?, n, &image) catch |err| {
+                std.debug.print("Failed to write program cache entry {s}: {}\n", .{ n, err });
+            };
+        }
+        return .{ .artifact = artifact, .program = program };
+    }
+
+    pub fn dump(self: *const ProgramCache) void {
+        std.debug.print("Program cache hits / misses: {} / {}\n", .{ self.hits, self.misses });
+    }
+
+    fn map(self: *ProgramCache, dir: std.fs.Dir, name: []const u8, key: u64) !io.Program {
+        const program = (try self.mapImage(io.Program, dir, name)).*;
+        self.mutex.lock();
+        defer self.mutex.unlock();
+        try self.programs.put(key, program);
+        return program;
+    }
+
+    /// Maps the named image, which stays mapped until deinit.
+    fn mapImage(self: *ProgramCache, comptime T: type, dir: std.fs.Dir, name: []const u8) !*T {
+        const file = try dir.openFile(name, .{});
+        defer file.close();
+        const size = (try file.stat()).size;
+        if (size < @sizeOf(Header)) return error.CorruptImage;
+        // Private, so rebasing pointers doesn't write back to the file.
+        const image = try std.posix.mmap(
+            null,
+            size,
+            std.posix.PROT.READ | std.posix.PROT.WRITE,
+            .{ .TYPE = .PRIVATE },
+            file.handle,
+            0,
+        );
+        errdefer std.posix.munmap(image);
+        const value = try openImage(T, image, self.build_id);
+
+        self.mutex.lock();
+        defer self.mutex.unlock();
+        try self.mappings.append(image);
+        return value;
+    }
+
+    fn store(self: *ProgramCache, comptime T: type, allocator: std.mem.Allocator, dir: std.fs.Dir, name: []const u8, value: *const T) !void {
+        const image = try buildImage(T, allocator, value, self.build_id);
+        defer allocator.free(image);
+        // Written to a temporary file and renamed, so concurrent readers never see a partial image.
+        var file = try dir.atomicFile(name, .{});
+        defer file.deinit();
+        try file.file.writeAll(image);
+        try file.finish();
+    }
+};
+
+pub const LoadedArtifact = struct {
+    artifact: nargo_artifact.ArtifactAbi,
+    program: io.Program,
+};
+
+/// The parts of an artifact needed to run it, imaged as a single cache entry.
+const ArtifactImage = struct {
+    noir_version: []const u8,
+    hash: []const u8,
+    abi: nargo_artifact.Abi,
+    names: ?[][]const u8,
+    program: io.Program,
+};
+
+/// Hashes the file's contents, without holding them all in memory.
+fn hashFile(seed: u64, path: []const u8) !u64 {
+    const file = try std.fs.cwd().openFile(path, .{});
+    defer file.close();
+    var hasher = std.hash.Wyhash.init(seed);
+    var buf: [64 * 1024]u8 = undefined;
+    while (true) {
+        const n = try file.read(&buf);
+        if (n == 0) break;
+        hasher.update(buf[0..n]);
+    }
+    return hasher.final();
+}
+
+const magic = "zbimage1".*;
+
+const Header = extern struct {
+    magic: [8]u8,
+    build_id: u64,
+    // Hash of everything after the header.
+    checksum: u64,
+    len: u64,
+    root: u64,
+};
+
+/// Serializes the value and everything it points to into a single relocatable image.
+pub fn buildImage(comptime T: type, allocator: std.mem.Allocator, value: *const T, build_id: u64) ![]u8 {
+    var writer = ImageWriter{ .buf = std.ArrayList(u8).init(allocator) };
+    errdefer writer.buf.deinit();
+    _ = try writer.alloc(Header, 1);
+    const root = try writer.alloc(T, 1);
+    try writer.write(T, root, value);
+
+    const image = try writer.buf.toOwnedSlice();
+    const header = Header{
+        .magic = magic,
+        .build_id = build_id,
+        .checksum = std.hash.Wyhash.hash(0, image[@sizeOf(Header)..]),
+        .len = image.len,
+        .root = root,
+    };
+    @memcpy(image[0..@sizeOf(Header)], std.mem.asBytes(&header));
+    return image;
+}
+
+/// Validates an image written by buildImage, and rebases its pointers in place.
+pub fn openImage(comptime T: type, image: []align(std.heap.page_size_min) u8, build_id: u64) !*T {
+    if (image.len < @sizeOf(Header)) return error.CorruptImage;
+    const header = std.mem.bytesToValue(Header, image[0..@sizeOf(Header)]);
+    if (!std.mem.eql(u8, &header.magic, &magic) or header.build_id != build_id) return error.StaleImage;
+    if (header.len != image.len or header.root + @sizeOf(T) > image.len) return error.CorruptImage;
+    if (std.hash.Wyhash.hash(0, image[@sizeOf(Header)..]) != header.checksum) return error.CorruptImage;
+
+    const root: *T = @ptrCast(@alignCast(image[header.root..].ptr));
+    try rebase(T, image, root);
+    return root;
+}
+
+/// Whether values of the type contain any pointers that need relocating.
+fn hasPointers(comptime T: type) bool {
+    switch (@typeInfo(T)) {
+        .pointer => return true,
+        .array => |info| return hasPointers(info.child),
+        .optional => |info| return hasPointers(info.child),
+        .@"struct" => |info| {
+            inline for (info.fields) |f| {
+                if (!f.is_comptime and hasPointers(f.type)) return true;
+            }
+            return false;
+        },
+        .@"union" => |info| {
+            if (info.tag_type == null) @compileError("Untagged unions can't be imaged: " ++ @typeName(T));
+            inline for (info.fields) |f| {
+                if (hasPointers(f.type)) return true;
+            }
+            return false;
+        },
+        else => return false,
+    }
+}
+
+const ImageWriter = struct {
+    buf: std.ArrayList(u8),
+
+    /// Reserves zeroed space for n values of T, returning its offset.
+    fn alloc(self: *ImageWriter, comptime T: type, n: usize) error{OutOfMemory}!usize {
+        const offset = std.mem.alignForward(usize, self.buf.items.len, @alignOf(T));
+        try self.buf.appendNTimes(0, offset + n * @sizeOf(T) - self.buf.items.len);
+        return offset;
+    }
+
+    /// Copies the value to the given offset, writing anything it points to after it.
+    /// The buffer may move as it grows, so only offsets into it are held.
+    fn write(self: *ImageWriter, comptime T: type, offset: usize, value: *const T) error{OutOfMemory}!void {
+        @memcpy(self.buf.items[offset..][0..@sizeOf(T)], std.mem.asBytes(value));
+        if (comptime !hasPointers(T)) return;
+
+        switch (@typeInfo(T)) {
+            .pointer => |info| {
+                if (info.sentinel_ptr != null) @compileError("Sentinel pointers can't be imaged: " ++ @typeName(T));
+                const C = info.child;
+                const items: []const C = switch (info.size) {
+                    .slice => value.*,
+                    .one => @as(*const [1]C, value.*),
+                    else => @compileError("Only slices and single pointers can be imaged: " ++ @typeName(T)),
+                };
+                const child = try self.alloc(C, items.len);
+                if (comptime hasPointers(C)) {
+                    for (items, 0..) |*item, i| try self.write(C, child + i * @sizeOf(C), item);
+                } else {
+                    @memcpy(self.buf.items[child..][0 .. items.len * @sizeOf(C)], std.mem.sliceAsBytes(items));
+                }
+                // The image always starts with its header, so no offset is zero (null).
+                const relative: T = switch (info.size) {
+                    .slice => @as([*]C, @ptrFromInt(child))[0..items.len],
+                    else => @ptrFromInt(child),
+                };
+                @memcpy(self.buf.items[offset..][0..@sizeOf(T)], std.mem.asBytes(&relative));
+            },
+            .array => |info| {
+                for (value, 0..) |*item, i| try self.write(info.child, offset + i * @sizeOf(info.child), item);
+            },
+            .@"struct" => |info| {
+                inline for (info.fields) |f| {
+                    if (comptime !f.is_comptime and hasPointers(f.type)) {
+                        try self.write(f.type, offset + @offsetOf(T, f.name), &@field(value.*, f.name));
+                    }
+                }
+            },
+            .optional => |info| {
+                if (value.*) |*payload| {
+                    try self.write(info.child, offset + (@intFromPtr(payload) - @intFromPtr(value)), payload);
+                }
+            },
+            .@"union" => switch (value.*) {
+                inline else => |*payload| {
+                    const P = @TypeOf(payload.*);
+                    if (comptime hasPointers(P)) {
+                        try self.write(P, offset + (@intFromPtr(payload) - @intFromPtr(value)), payload);
+                    }
+                },
+            },
+            else => unreachable,
+        }
+    }
+};
+
+/// Turns the offsets in the value into pointers into the image, recursively.
+fn rebase(comptime T: type, image: []u8, value: *T) error{CorruptImage}!void {
+    if (comptime !hasPointers(T)) return;
+
+    switch (@typeInfo(T)) {
+        .pointer => |info| {
+            const C = info.child;
+            const offset = @intFromPtr(if (info.size == .slice) value.ptr else value.*);
+            const len = if (info.size == .slice) value.len else 1;
+            if (offset > image.len or len * @sizeOf(C) > image.len - offset or offset % @alignOf(C) != 0) {
+                return error.CorruptImage;
+            }
+            const items = @as([*]C, @ptrCast(@alignCast(image.ptr + offset)))[0..len];
+            value.* = if (info.size == .slice) items else &items[0];
+            if (comptime hasPointers(C)) {
+                for (items) |*item| try rebase(C, image, item);
+            }
+        },
+        .array => |info| {
+            for (value) |*item| try rebase(info.child, image, item);
+        },
+        .@"struct" => |info| {
+            inline for (info.fields) |f| {
+                if (comptime !f.is_comptime and hasPointers(f.type)) {
+                    try rebase(f.type, image, &@field(value.*, f.name));
+                }
+            }
+        },
+        .optional => |info| {
+            if (value.*) |*payload| try rebase(info.child, image, payload);
+        },
+        .@"union" => switch (value.*) {
+            inline else => |*payload| try rebase(@TypeOf(payload.*), image, payload),
+        },
+        else => unreachable,
+    }
+}
+
+/// Identifies the running executable by its inode, size, and modification time.
+/// Caches use it to invalidate entries written by other builds.
+pub fn buildId() !u64 {
+    var exe = try std.fs.openSelfExe(.{});
+    defer exe.close();
+    const stat = try exe.stat();
+    var hasher = std.hash.Wyhash.init(0);
+    std.hash.autoHash(&hasher, stat.inode);
+    std.hash.autoHash(&hasher, stat.size);
+    std.hash.autoHash(&hasher, stat.mtime);
+    return hasher.final();
+}
+
+/// Opens (creating if needed) the named cache directory, under $ZB_CACHE_DIR or ~/.cache/zb.
+pub fn openCacheDir(allocator: std.mem.Allocator, name: []const u8) !std.fs.Dir {
+    const root = std.process.getEnvVarOwned(allocator, "ZB_CACHE_DIR") catch |err| switch (err) {
+        error.EnvironmentVariableNotFound => blk: {
+            const home = try std.process.getEnvVarOwned(allocator, "HOME");
+            defer allocator.free(home);
+            break :blk try std.fs.path.join(allocator, &.{ home, ".cache", "zb" });
+        },
+        else => return err,
+    };
+    defer allocator.free(root);
+    const path = try std.fs.path.join(allocator, &.{ root, name });
+    defer allocator.free(path);
+    return std.fs.cwd().makeOpenPath(path, .{});
+}
+
+test "image round trip" {
+    const Node = union(enum) {
+        leaf: u256,
+        list: []const u32,
+        pair: struct { name: []const u8, value: ?[]const u64 },
+        empty,
+    };
+    const Root = struct {
+        id: u32,
+        nodes: []const Node,
+        nested: []const []const Node,
+    };
+
+    const nodes = [_]Node{
+        .{ .leaf = 1 << 200 },
+        .{ .list = &.{ 1, 2, 3 } },
+        .{ .pair = .{ .name = "pair", .value = &.{ 4, 5 } } },
+        .{ .pair = .{ .name = "", .value = null } },
+        .empty,
+    };
+    const value = Root{ .id = 7, .nodes = &nodes, .nested = &.{ &.{}, nodes[1..3] } };
+
+    const allocator = std.testing.allocator;
+    const bytes = try buildImage(Root, allocator, &value, 42);
+    defer allocator.free(bytes);
+    const image = try allocator.alignedAlloc(u8, std.heap.page_size_min, bytes.len);
+    defer allocator.free(image);
+
+    @memcpy(image, bytes);
+    try std.testing.expectError(error.StaleImage, openImage(Root, image, 43));
+    image[image.len - 1] ^= 1;
+    try std.testing.expectError(error.CorruptImage, openImage(Root, image, 42));
+
+    @memcpy(image, bytes);
+    const root = try openImage(Root, image, 42);
+    try std.testing.expectEqual(7, root.id);
+    try std.testing.expectEqual(nodes.len, root.nodes.len);
+    try std.testing.expectEqual(1 << 200, root.nodes[0].leaf);
+    try std.testing.expectEqualSlices(u32, &.{ 1, 2, 3 }, root.nodes[1].list);
+    try std.testing.expectEqualStrings("pair", root.nodes[2].pair.name);
+    try std.testing.expectEqualSlices(u64, &.{ 4, 5 }, root.nodes[2].pair.value.?);
+    try std.testing.expectEqual(null, root.nodes[3].pair.value);
+    try std.testing.expectEqual(.empty, std.meta.activeTag(root.nodes[4]));
+    try std.testing.expectEqual(0, root.nested[0].len);
+    try std.testing.expectEqualStrings("pair", root.nested[1][1].pair.name);
+    // Everything points into the image.
+    const start = @intFromPtr(image.ptr);
+    try std.testing.expect(@intFromPtr(root.nested[1][1].pair.name.ptr) - start < image.len);
+}
@@ -5,15 +5,24 @@ const bincode = @import("../bincode/bincode.zig");
 
 const Witness = io.Witness;
 
+/// Witness indices are small and contiguous, so values are held in a vector indexed by witness.
+/// A bitmap records which witnesses have been assigned.
 pub const WitnessMap = struct {
     allocator: std.mem.Allocator,
-    inner: std.AutoHashMap(Witness, Fr),
+    // Only meaningful where the witness is present.
+    values: []Fr = &.{},
+    present: std.DynamicBitSetUnmanaged = .{},
+    num_present: usize = 0,
 
     pub fn init(allocator: std.mem.Allocator) WitnessMap {
-        return WitnessMap{
-            .allocator = allocator,
-            .inner = std.AutoHashMap(Witness, Fr).init(allocator),
-        };
+        return WitnessMap{ .allocator = allocator };
+    }
+
+    /// Sized to hold witnesses up to `num_witnesses` without growing, e.g. a circuit's `current_witness_index + 1`.
+    pub fn initCapacity(allocator: std.mem.Allocator, num_witnesses: usize) !WitnessMap {
+        var result = WitnessMap.init(allocator);
+        try result.ensureTotalCapacity(num_witnesses);
+        return result;
     }
 
     pub fn initFromPath(allocator: std.mem.Allocator, path: []const u8) !WitnessMap {
@@ -26,26 +35,38 @@ pub const WitnessMap = struct {
     }
 
     pub fn deinit(self: *WitnessMap) void {
-        self.inner.deinit();
+        self.allocator.free(self.values);
+        self.present.deinit(self.allocator);
     }
 
-    pub fn get(self: *WitnessMap, witness: Witness) ?Fr {
-        return self.inner.get(witness);
+    pub fn get(self: *const WitnessMap, witness: Witness) ?Fr {
+        if (witness >= self.values.len or !self.present.isSet(witness)) return null;
+        return self.values[witness];
     }
 
     pub fn put(self: *WitnessMap, witness: Witness, value: Fr) !void {
-        const r = try self.inner.getOrPut(witness);
-        if (r.found_existing) {
-            if (!r.value_ptr.eql(value)) {
+        if (witness >= self.values.len) {
+            try self.ensureTotalCapacity(@max(@as(usize, witness) + 1, self.values.len * 2));
+        }
+        if (self.present.isSet(witness)) {
+            if (!self.values[witness].eql(value)) {
                 return error.UnsatisfiedConstraint;
             }
         } else {
-            r.value_ptr.* = value;
+            self.present.set(witness);
+            self.values[witness] = value;
+            self.num_present += 1;
         }
     }
 
-    pub fn count(self: *WitnessMap) usize {
-        return self.inner.count();
+    pub fn count(self: *const WitnessMap) usize {
+        return self.num_present;
+    }
+
+    fn ensureTotalCapacity(self: *WitnessMap, num_witnesses: usize) !void {
+        if (num_witnesses <= self.values.len) return;
+        self.values = try self.allocator.realloc(self.values, num_witnesses);
+        try self.present.resize(self.allocator, num_witnesses, false);
     }
 
     pub fn printWitnesses(self: *const WitnessMap, binary: bool) !void {
@@ -56,41 +77,26 @@ pub const WitnessMap = struct {
     pub fn getWitnessesRange(self: *const WitnessMap, allocator: std.mem.Allocator, start: u64, end: u64) ![]Fr {
         var witnesses = try allocator.alloc(Fr, end - start);
         for (start..end, 0..) |key, i| {
-            const value = self.inner.get(@intCast(key)) orelse Fr.zero;
-            witnesses[i] = value;
+            witnesses[i] = self.get(@intCast(key)) orelse Fr.zero;
         }
         return witnesses;
     }
 
+    /// Writes the assigned witnesses in index order.
+    /// Binary output is streamed as the bincode encoding of a single `io.StackItem`, without materialising its entries.
     pub fn writeWitnesses(self: *const WitnessMap, binary: bool, writer: anytype) !void {
-        var keys = try self.allocator.alloc(u32, self.inner.count());
-        defer self.allocator.free(keys);
-
-        var index: usize = 0;
-        var it = self.inner.iterator();
-        while (it.next()) |entry| {
-            keys[index] = entry.key_ptr.*;
-            index += 1;
-        }
-
-        std.mem.sort(u32, keys, {}, std.sort.asc(u32));
-
+        var it = self.present.iterator(.{});
         if (binary) {
-            var witnesses = try std.ArrayList(io.WitnessEntry).initCapacity(self.allocator, keys.len);
-            defer witnesses.deinit();
-
-            for (keys) |key| {
-                const value = self.inner.get(key) orelse unreachable;
-                try witnesses.append(.{ .index = key, .value = value.to_int() });
+            // Stack length, stack item index, and witness count, as bincode would emit for []io.StackItem.
+            try bincode.serialize(writer, @as(u64, 1));
+            try bincode.serialize(writer, @as(u32, 0));
+            try bincode.serialize(writer, @as(u64, self.num_present));
+            while (it.next()) |key| {
+                try bincode.serialize(writer, io.WitnessEntry{ .index = @intCast(key), .value = self.values[key].to_int() });
             }
-
-            var out = [_]io.StackItem{.{ .index = 0, .witnesses = witnesses.items }};
-            const out2: []io.StackItem = &out;
-            try bincode.serialize(writer, out2);
         } else {
-            for (keys) |key| {
-                const value = self.inner.get(key) orelse unreachable;
-                try writer.print("{}: {x}\n", .{ key, value });
+            while (it.next()) |key| {
+                try writer.print("{}: {x}\n", .{ key, self.values[key] });
             }
         }
     }
@@ -109,3 +115,40 @@ pub const WitnessMap = struct {
         }
     }
 };
+
+test "dense witness map" {
+    var witnesses = try WitnessMap.initCapacity(std.testing.allocator, 4);
+    defer witnesses.deinit();
+
+    try witnesses.put(3, Fr.from_int(30));
+    try witnesses.put(1, Fr.from_int(10));
+    // Beyond the initial capacity.
+    try witnesses.put(100, Fr.from_int(1000));
+    try witnesses.put(1, Fr.from_int(10));
+    try std.testing.expectError(error.UnsatisfiedConstraint, witnesses.put(1, Fr.from_int(11)));
+    try std.testing.expectEqual(3, witnesses.count());
+    try std.testing.expectEqual(null, witnesses.get(2));
+    try std.testing.expectEqual(null, witnesses.get(1000));
+    try std.testing.expect(witnesses.get(100).?.eql(Fr.from_int(1000)));
+
+    var out = std.ArrayList(u8).init(std.testing.allocator);
+    defer out.deinit();
+    try witnesses.writeWitnesses(false, out.writer());
+    var lines = std.mem.tokenizeScalar(u8, out.items, '\n');
+    for ([_][]const u8{ "1:", "3:", "100:" }) |prefix| {
+        try std.testing.expect(std.mem.startsWith(u8, lines.next().?, prefix));
+    }
+    try std.testing.expectEqual(null, lines.next());
+
+    // Streamed binary output decodes as a regular bincode witness stack.
+    out.clearRetainingCapacity();
+    try witnesses.writeWitnesses(true, out.writer());
+    var arena = std.heap.ArenaAllocator.init(std.testing.allocator);
+    defer arena.deinit();
+    var stream = std.io.fixedBufferStream(out.items);
+    var read = WitnessMap.init(std.testing.allocator);
+    defer read.deinit();
+    try read.readWitnesses(arena.allocator(), true, stream.reader());
+    try std.testing.expectEqual(3, read.count());
+    try std.testing.expect(read.get(100).?.eql(Fr.from_int(1000)));
+}
@@ -1,6 +1,5 @@
 const std = @import("std");
 const group_arith = @import("group_arith.zig");
-const ForeignCallParam = @import("../bvm/foreign_call/param.zig").ForeignCallParam;
 
 pub fn ProjectivePoint(comptime GroupParams: type) type {
     return struct {
@@ -158,16 +157,12 @@ pub fn ProjectivePoint(comptime GroupParams: type) type {
             return PP.from_xyz(self.x.mul(zz_inv), self.y.mul(zzz_inv), Fq.one);
         }
 
-        pub fn toForeignCallParams(self: PP) [3]ForeignCallParam {
-            // Normalize the point first to get affine coordinates
+        /// Writes the point as a foreign call result, as its affine x, y and infinity flag.
+        pub fn writeOutput(self: PP, out: anytype) void {
             const normalized = self.normalize();
-            
-            // Return array with x, y, and infinity flag
-            return [3]ForeignCallParam{
-                ForeignCallParam{ .Single = normalized.x.to_int() },
-                ForeignCallParam{ .Single = normalized.y.to_int() },
-                ForeignCallParam{ .Single = if (self.is_infinity()) 1 else 0 },
-            };
+            out.write(normalized.x.to_int());
+            out.write(normalized.y.to_int());
+            out.write(self.is_infinity());
         }
     };
 }
@@ -9,6 +9,7 @@ pub const blackbox = @import("blackbox/blackbox.zig");
 pub const cvm_execute = @import("cvm/execute.zig");
 pub const merkle_tree = @import("merkle_tree/package.zig");
 pub const thread_pool = @import("thread/thread_pool.zig");
+pub const parallel_gzip = @import("compress/parallel_gzip.zig");
 pub const poseidon2 = @import("poseidon2/poseidon2.zig");
 pub const protocol = @import("protocol/package.zig");
 pub const nargo = @import("nargo/package.zig");
@@ -26,7 +27,13 @@ test {
     _ = @import("cvm/execute.zig");
     _ = @import("merkle_tree/package.zig");
     _ = @import("thread/thread_pool.zig");
+    _ = @import("compress/parallel_gzip.zig");
     _ = @import("poseidon2/poseidon2.zig");
     _ = @import("protocol/package.zig");
     _ = @import("nargo/package.zig");
+    _ = @import("txe/cow_map.zig");
+    _ = @import("txe/note_cache.zig");
+    _ = @import("txe/txe_state.zig");
+    _ = @import("txe/key_cache.zig");
+    _ = @import("lru/lru.zig");
 }
\ No newline at end of file
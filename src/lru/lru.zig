@@ -0,0 +1,102 @@
+const std = @import("std");
+
+/// A map of at most `capacity` entries, evicting the least recently used.
+/// Keys are hashed and compared by Context, as for std.HashMap.
+/// Keys and values are stored as given, so any they own is freed by the caller, with the entries returned by
+/// `put` when it evicts and by `popOldest`.
+pub fn Lru(comptime K: type, comptime V: type, comptime Context: type) type {
+    return struct {
+        const Self = @This();
+        pub const Entry = struct {
+            key: K,
+            value: V,
+        };
+        const List = std.DoublyLinkedList(Entry);
+        const Map = std.HashMap(K, *List.Node, Context, std.hash_map.default_max_load_percentage);
+
+        allocator: std.mem.Allocator,
+        capacity: usize,
+        map: Map,
+        // Least recently used first.
+        list: List = .{},
+        hits: u64 = 0,
+        misses: u64 = 0,
+
+        pub fn init(allocator: std.mem.Allocator, capacity: usize) Self {
+            return .{
+                .allocator = allocator,
+                .capacity = capacity,
+                .map = Map.init(allocator),
+            };
+        }
+
+        /// Frees the map, but not anything its keys and values own, which must be popped first.
+        pub fn deinit(self: *Self) void {
+            while (self.list.popFirst()) |node| self.allocator.destroy(node);
+            self.map.deinit();
+        }
+
+        pub fn contains(self: *const Self, key: K) bool {
+            return self.map.contains(key);
+        }
+
+        /// Returns the value of the key if present, making it the most recently used.
+        pub fn get(self: *Self, key: K) ?V {
+            const node = self.map.get(key) orelse {
+                self.misses += 1;
+                return null;
+            };
+            self.hits += 1;
+            self.list.remove(node);
+            self.list.append(node);
+            return node.data.value;
+        }
+
+        /// Adds the entry, unless the key is already present or the capacity is 0.
+        /// Returns the least recently used entry if it was evicted to make room.
+        pub fn put(self: *Self, key: K, value: V) !?Entry {
+            if (self.capacity == 0 or self.map.contains(key)) return null;
+            const node = try self.allocator.create(List.Node);
+            errdefer self.allocator.destroy(node);
+            node.data = .{ .key = key, .value = value };
+            try self.map.put(key, node);
+            self.list.append(node);
+            return if (self.map.count() > self.capacity) self.popOldest() else null;
+        }
+
+        /// Removes and returns the least recently used entry.
+        pub fn popOldest(self: *Self) ?Entry {
+            const node = self.list.popFirst() orelse return null;
+            _ = self.map.remove(node.data.key);
+            const entry = node.data;
+            self.allocator.destroy(node);
+            return entry;
+        }
+    };
+}
+
+/// An Lru of keys that can be hashed and compared by value, as for std.AutoHashMap.
+pub fn AutoLru(comptime K: type, comptime V: type) type {
+    return Lru(K, V, std.hash_map.AutoContext(K));
+}
+
+test "lru" {
+    var lru = AutoLru(u32, u32).init(std.testing.allocator, 2);
+    defer lru.deinit();
+
+    try std.testing.expectEqual(null, try lru.put(1, 10));
+    try std.testing.expectEqual(null, try lru.put(2, 20));
+    try std.testing.expectEqual(10, lru.get(1));
+
+    // 2 is now the least recently used, so is evicted.
+    try std.testing.expectEqual(AutoLru(u32, u32).Entry{ .key = 2, .value = 20 }, (try lru.put(3, 30)).?);
+    try std.testing.expectEqual(null, lru.get(2));
+    try std.testing.expectEqual(30, lru.get(3));
+    try std.testing.expectEqual(2, lru.hits);
+    try std.testing.expectEqual(1, lru.misses);
+
+    // Entries come out oldest first.
+    try std.testing.expectEqual(1, lru.popOldest().?.key);
+    try std.testing.expectEqual(3, lru.popOldest().?.key);
+    try std.testing.expectEqual(null, lru.popOldest());
+}
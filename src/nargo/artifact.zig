@@ -29,19 +29,23 @@ pub const Parameter = struct {
     visibility: ?[]const u8 = null,
 };
 
-const Abi = struct {
+pub const Abi = struct {
     parameters: []const Parameter,
 };
 
 // JSON parseable version
+// The debug sections are the bulk of an artifact, so are skipped by the parser until needed.
 const JsonArtifactAbi = struct {
     noir_version: []const u8,
     hash: []const u8,
     abi: Abi,
     bytecode: []const u8,
+    names: ?[][]const u8 = null,
+};
+
+const JsonArtifactDebug = struct {
     debug_symbols: ?[]const u8 = null,
     file_map: ?std.json.Value = null,
-    names: ?[][]const u8 = null,
 };
 
 pub const ArtifactAbi = struct {
@@ -52,38 +56,24 @@ pub const ArtifactAbi = struct {
     debug_symbols: ?[]const u8 = null,
     file_map: ?std.json.Value = null,
     names: ?[][]const u8 = null,
+    // Path of the artifact, so the debug sections can be loaded on demand.
+    path: []const u8 = "",
     // Lazy loaded.
     debug_info: ?debug_info.DebugInfo = null,
+    // Whether the debug sections have been parsed, so an artifact without them is only parsed once.
+    debug_loaded: bool = false,
 
     /// Load the abi from the json file.
+    /// The debug symbols and file map are only parsed on the first call to getDebugInfo.
     pub fn load(allocator: std.mem.Allocator, contract_path: []const u8) !ArtifactAbi {
-        var file = try std.fs.cwd().openFile(contract_path, .{});
-        defer file.close();
-        var json_reader = std.json.reader(allocator, file.reader());
-        var diagnostics = std.json.Diagnostics{};
-        json_reader.enableDiagnostics(&diagnostics);
-        const parsed = std.json.parseFromTokenSource(
-            JsonArtifactAbi,
-            allocator,
-            &json_reader,
-            .{ .ignore_unknown_fields = true },
-        ) catch |err| {
-            std.debug.print("Error parsing JSON at line {}:{}: {}\n", .{
-                diagnostics.getLine(),
-                diagnostics.getColumn(),
-                err,
-            });
-            return err;
-        };
-        const json_abi = parsed.value;
+        const json_abi = try parseJson(JsonArtifactAbi, allocator, contract_path);
         return ArtifactAbi{
             .noir_version = json_abi.noir_version,
             .hash = json_abi.hash,
             .abi = json_abi.abi,
             .bytecode = json_abi.bytecode,
-            .debug_symbols = json_abi.debug_symbols,
-            .file_map = json_abi.file_map,
             .names = json_abi.names,
+            .path = try allocator.dupe(u8, contract_path),
             .debug_info = null,
         };
     }
@@ -102,17 +92,55 @@ pub const ArtifactAbi = struct {
     }
 
     pub fn getDebugInfo(self: *const ArtifactAbi, allocator: std.mem.Allocator) !*const debug_info.DebugInfo {
-        if (self.debug_info == null) {
+        if (!self.debug_loaded) {
+            // The lazy loaded fields are the only ones written through a const artifact.
+            const lazy = @constCast(self);
+            if (self.debug_symbols == null) {
+                const json_debug = try parseJson(JsonArtifactDebug, allocator, self.path);
+                lazy.debug_symbols = json_debug.debug_symbols;
+                lazy.file_map = json_debug.file_map;
+            }
             if (self.debug_symbols) |symbols| {
-                @constCast(self).debug_info = try debug_info.DebugInfo.init(allocator, symbols, self.file_map);
-            } else {
-                return error.DebugSymbolsNotFound;
+                lazy.debug_info = try debug_info.DebugInfo.init(allocator, symbols, self.file_map);
             }
+            lazy.debug_loaded = true;
         }
-        return &self.debug_info.?;
+        return if (self.debug_info) |*info| info else error.DebugSymbolsNotFound;
     }
 };
 
+/// Streams the json file into T, skipping any fields T doesn't have without materialising them.
+pub fn parseJson(comptime T: type, allocator: std.mem.Allocator, path: []const u8) !T {
+    var hasher = std.hash.Wyhash.init(0);
+    return parseJsonHashed(T, allocator, path, &hasher);
+}
+
+/// As parseJson, also feeding the file's contents to the hasher as they are read.
+pub fn parseJsonHashed(comptime T: type, allocator: std.mem.Allocator, path: []const u8, hasher: *std.hash.Wyhash) !T {
+    var file = try std.fs.cwd().openFile(path, .{});
+    defer file.close();
+    var hashed = std.compress.hashedReader(file.reader(), hasher);
+    var buffered = std.io.bufferedReader(hashed.reader());
+    var json_reader = std.json.reader(allocator, buffered.reader());
+    defer json_reader.deinit();
+    var diagnostics = std.json.Diagnostics{};
+    json_reader.enableDiagnostics(&diagnostics);
+    const parsed = std.json.parseFromTokenSourceLeaky(
+        T,
+        allocator,
+        &json_reader,
+        .{ .ignore_unknown_fields = true },
+    ) catch |err| {
+        std.debug.print("Error parsing JSON at line {}:{}: {}\n", .{
+            diagnostics.getLine(),
+            diagnostics.getColumn(),
+            err,
+        });
+        return err;
+    };
+    return parsed;
+}
+
 test "parse abi" {
     var arena = std.heap.ArenaAllocator.init(std.testing.allocator);
     defer arena.deinit();
@@ -0,0 +1,149 @@
+const std = @import("std");
+const F = @import("../bn254/fr.zig").Fr;
+const program_cache = @import("../cvm/program_cache.zig");
+
+/// The values ContractAbi.load derives from a contract artifact by hashing.
+pub const ClassEntry = struct {
+    // Of every function, in artifact order.
+    selectors: []const u32,
+    private_function_tree_root: F,
+    unconstrained_function_tree_root: F,
+    public_bytecode_commitment: F,
+    artifact_hash: F,
+    class_id: F,
+};
+
+/// An on-disk cache of the derived values of contract artifacts, keyed on a fast hash of the artifact file's contents.
+/// Editing or rebuilding an artifact changes its key, so stale entries are never read.
+/// Entries live in $ZB_CACHE_DIR/classes, or ~/.cache/zb/classes.
+pub const ClassCache = struct {
+    const magic = "zbclass1".*;
+
+    const Header = extern struct {
+        magic: [8]u8,
+        build_id: u64,
+        num_functions: u64,
+        private_function_tree_root: [32]u8,
+        unconstrained_function_tree_root: [32]u8,
+        public_bytecode_commitment: [32]u8,
+        artifact_hash: [32]u8,
+        class_id: [32]u8,
+    };
+
+    allocator: std.mem.Allocator,
+    // Null if caching is disabled or no cache directory is available.
+    dir: ?std.fs.Dir,
+    // Entries written by other builds are ignored, in case the derivations changed.
+    build_id: u64,
+    hits: u64 = 0,
+    misses: u64 = 0,
+
+    pub fn init(allocator: std.mem.Allocator, enabled: bool) ClassCache {
+        const build_id = program_cache.buildId() catch 0;
+        return .{
+            .allocator = allocator,
+            .dir = if (enabled and build_id != 0) program_cache.openCacheDir(allocator, "classes") catch null else null,
+            .build_id = build_id,
+        };
+    }
+
+    pub fn deinit(self: *ClassCache) void {
+        if (self.dir) |*dir| dir.close();
+    }
+
+    /// Returns the cached entry of the artifact with the given key, if any.
+    /// The selectors are allocated with the given allocator.
+    pub fn get(self: *ClassCache, allocator: std.mem.Allocator, key: u64, num_functions: usize) ?ClassEntry {
+        const dir = self.dir orelse return null;
+        const entry = self.read(allocator, dir, key, num_functions) catch |err| {
+            if (err != error.FileNotFound) std.debug.print("Ignoring contract class cache entry {x:0>16}: {}\n", .{ key, err });
+            self.misses += 1;
+            return null;
+        };
+        self.hits += 1;
+        return entry;
+    }
+
+    pub fn put(self: *ClassCache, key: u64, entry: *const ClassEntry) !void {
+        const dir = self.dir orelse return;
+        const header = Header{
+            .magic = magic,
+            .build_id = self.build_id,
+            .num_functions = entry.selectors.len,
+            .private_function_tree_root = entry.private_function_tree_root.to_buf(),
+            .unconstrained_function_tree_root = entry.unconstrained_function_tree_root.to_buf(),
+            .public_bytecode_commitment = entry.public_bytecode_commitment.to_buf(),
+            .artifact_hash = entry.artifact_hash.to_buf(),
+            .class_id = entry.class_id.to_buf(),
+        };
+        var name_buf: [32]u8 = undefined;
+        // Written to a temporary file and renamed, so concurrent readers never see a partial entry.
+        var file = try dir.atomicFile(entryName(&name_buf, key), .{});
+        defer file.deinit();
+        try file.file.writeAll(std.mem.asBytes(&header));
+        try file.file.writeAll(std.mem.sliceAsBytes(entry.selectors));
+        try file.finish();
+    }
+
+    pub fn dump(self: *const ClassCache) void {
+        std.debug.print("Contract class cache hits / misses: {} / {}\n", .{ self.hits, self.misses });
+    }
+
+    fn read(self: *ClassCache, allocator: std.mem.Allocator, dir: std.fs.Dir, key: u64, num_functions: usize) !ClassEntry {
+        var name_buf: [32]u8 = undefined;
+        const file = try dir.openFile(entryName(&name_buf, key), .{});
+        defer file.close();
+        if ((try file.stat()).size != @sizeOf(Header) + num_functions * @sizeOf(u32)) return error.CorruptEntry;
+
+        var header: Header = undefined;
+        if (try file.readAll(std.mem.asBytes(&header)) != @sizeOf(Header)) return error.CorruptEntry;
+        if (!std.mem.eql(u8, &header.magic, &magic) or header.build_id != self.build_id) return error.StaleEntry;
+        if (header.num_functions != num_functions) return error.CorruptEntry;
+
+        const selectors = try allocator.alloc(u32, num_functions);
+        errdefer allocator.free(selectors);
+        if (try file.readAll(std.mem.sliceAsBytes(selectors)) != num_functions * @sizeOf(u32)) return error.CorruptEntry;
+
+        return .{
+            .selectors = selectors,
+            .private_function_tree_root = F.from_buf(header.private_function_tree_root),
+            .unconstrained_function_tree_root = F.from_buf(header.unconstrained_function_tree_root),
+            .public_bytecode_commitment = F.from_buf(header.public_bytecode_commitment),
+            .artifact_hash = F.from_buf(header.artifact_hash),
+            .class_id = F.from_buf(header.class_id),
+        };
+    }
+
+    fn entryName(buf: *[32]u8, key: u64) []const u8 {
+        return std.fmt.bufPrint(buf, "{x:0>16}.class", .{key}) catch unreachable;
+    }
+};
+
+test "class cache round trip" {
+    var tmp = std.testing.tmpDir(.{});
+    defer tmp.cleanup();
+
+    var cache = ClassCache{ .allocator = std.testing.allocator, .dir = tmp.dir, .build_id = 42 };
+    const entry = ClassEntry{
+        .selectors = &.{ 0x3790121c, 7, 0xffffffff },
+        .private_function_tree_root = F.from_int(1),
+        .unconstrained_function_tree_root = F.from_int(2),
+        .public_bytecode_commitment = F.from_int(3),
+        .artifact_hash = F.from_int(4),
+        .class_id = F.from_int(5),
+    };
+    try std.testing.expectEqual(null, cache.get(std.testing.allocator, 1, 3));
+    try cache.put(1, &entry);
+
+    const cached = cache.get(std.testing.allocator, 1, 3).?;
+    defer std.testing.allocator.free(cached.selectors);
+    try std.testing.expectEqualDeep(entry, cached);
+    // A different function count means a different artifact.
+    try std.testing.expectEqual(null, cache.get(std.testing.allocator, 1, 2));
+
+    // Entries from another build are stale.
+    cache.build_id = 43;
+    try std.testing.expectEqual(null, cache.get(std.testing.allocator, 1, 3));
+    try std.testing.expectEqual(1, cache.hits);
+    try std.testing.expectEqual(3, cache.misses);
+}
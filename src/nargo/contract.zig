@@ -5,6 +5,10 @@ const F = @import("../bn254/fr.zig").Fr;
 const mt = @import("../merkle_tree/package.zig");
 const constants = @import("../protocol/constants.gen.zig");
 const debug_info = @import("debug_info.zig");
+const io = @import("../cvm/io.zig");
+const parseJson = @import("artifact.zig").parseJson;
+const parseJsonHashed = @import("artifact.zig").parseJsonHashed;
+const class_cache = @import("class_cache.zig");
 
 var VERSION: u8 = 1;
 
@@ -56,6 +60,7 @@ const Abi = struct {
 const FunctionSelector = u32;
 
 // JSON parseable version
+// Debug symbols are skipped by the parser until needed.
 const JsonFunction = struct {
     name: []const u8,
     is_unconstrained: bool,
@@ -63,7 +68,6 @@ const JsonFunction = struct {
     abi: Abi,
     bytecode: []const u8 = &[_]u8{},
     verification_key: ?[]const u8 = null,
-    debug_symbols: ?[]const u8 = null,
 };
 
 pub const Function = struct {
@@ -73,9 +77,12 @@ pub const Function = struct {
     abi: Abi,
     bytecode: []const u8 = &[_]u8{},
     verification_key: ?[]const u8 = null,
+    // Loaded on demand by ContractAbi.getFunctionDebugInfo.
     debug_symbols: ?[]const u8 = null,
     // Computed at load time.
     selector: FunctionSelector = 0,
+    // Position in ContractAbi.functions, preserved in the filtered copies.
+    index: u32 = 0,
     debug_info: ?debug_info.DebugInfo = null,
 
     fn encodeType(writer: anytype, t: Type) !void {
@@ -180,10 +187,21 @@ pub const Function = struct {
 };
 
 // JSON parseable version
+// The debug sections (including all the contract's sources) are skipped by the parser until needed.
 const JsonContractAbi = struct {
     noir_version: []const u8,
     name: []const u8,
     functions: []JsonFunction,
+};
+
+const JsonContractDebug = struct {
+    functions: []struct { debug_symbols: ?[]const u8 = null },
+    file_map: ?std.json.Value = null,
+};
+
+// Shared by all copies of a ContractAbi, so the debug sections are only parsed once.
+const DebugSections = struct {
+    loaded: bool = false,
     file_map: ?std.json.Value = null,
 };
 
@@ -191,7 +209,12 @@ pub const ContractAbi = struct {
     noir_version: []const u8,
     name: []const u8,
     functions: []Function,
-    file_map: ?std.json.Value = null,
+    // Loaded on demand by getFunctionDebugInfo.
+    debug_sections: *DebugSections,
+    // Decoded programs, by function index. Filled on demand by the caller (e.g. the TXE), and shared by all copies.
+    programs: []?io.Program = &[_]?io.Program{},
+    // Index into functions, by selector.
+    selector_index: std.AutoHashMapUnmanaged(FunctionSelector, u32) = .{},
     // Following are computed at load time.
     artifact_path: ?[]const u8 = null, // Path to the artifact this ABI was loaded from
     public_function: ?Function = null,
@@ -207,17 +230,21 @@ pub const ContractAbi = struct {
 
     /// Load the contract abi from the json file.
     /// Compute all the function selectors.
+    /// Debug symbols and the file map are only parsed on the first call to getFunctionDebugInfo.
     pub fn load(allocator: std.mem.Allocator, contract_path: []const u8) !ContractAbi {
-        var file = try std.fs.cwd().openFile(contract_path, .{});
-        defer file.close();
-        var json_reader = std.json.reader(allocator, file.reader());
-        const parsed = try std.json.parseFromTokenSource(
-            JsonContractAbi,
-            allocator,
-            &json_reader,
-            .{ .ignore_unknown_fields = true },
-        );
-        const json_abi = parsed.value;
+        return loadCached(allocator, contract_path, null);
+    }
+
+    /// As load, but the selectors and hashes are taken from the cache if the artifact hasn't changed.
+    pub fn loadCached(
+        allocator: std.mem.Allocator,
+        contract_path: []const u8,
+        cache: ?*class_cache.ClassCache,
+    ) !ContractAbi {
+        // Hashed as it's parsed, so the key always matches the contents the values are derived from.
+        var hasher = std.hash.Wyhash.init(0);
+        const json_abi = try parseJsonHashed(JsonContractAbi, allocator, contract_path, &hasher);
+        const key = hasher.final();
 
         // Convert JsonFunction to Function
         var functions = try allocator.alloc(Function, json_abi.functions.len);
@@ -229,7 +256,7 @@ pub const ContractAbi = struct {
                 .abi = jf.abi,
                 .bytecode = jf.bytecode,
                 .verification_key = jf.verification_key,
-                .debug_symbols = jf.debug_symbols,
+                .index = @intCast(i),
             };
         }
 
@@ -237,27 +264,45 @@ pub const ContractAbi = struct {
             .noir_version = json_abi.noir_version,
             .name = json_abi.name,
             .functions = functions,
-            .file_map = json_abi.file_map,
+            .debug_sections = try allocator.create(DebugSections),
+            .programs = try allocator.alloc(?io.Program, functions.len),
         };
+        abi.debug_sections.* = .{};
+        @memset(abi.programs, null);
+        const cached = if (cache) |c| c.get(allocator, key, functions.len) else null;
 
         // Store the artifact path
         abi.artifact_path = try allocator.dupe(u8, contract_path);
 
+        try abi.selector_index.ensureTotalCapacity(allocator, @intCast(abi.functions.len));
         for (abi.functions) |*f| {
-            f.selector = f.computeSelector();
+            f.selector = if (cached) |entry| entry.selectors[f.index] else f.computeSelector();
+            // First match wins, as with a linear scan.
+            const entry = abi.selector_index.getOrPutAssumeCapacity(f.selector);
+            if (!entry.found_existing) entry.value_ptr.* = f.index;
             if (std.mem.eql(u8, f.name, "public_dispatch")) {
                 abi.public_function = f.*;
-                abi.public_bytecode_commitment = try computePublicBytecodeCommitment(f.bytecode);
+                if (cached == null) abi.public_bytecode_commitment = try computePublicBytecodeCommitment(f.bytecode);
             }
         }
 
         abi.private_functions = try filterFunctions(allocator, abi.functions, "private");
         abi.unconstrained_functions = try filterFunctions(allocator, abi.functions, "unconstrained");
         abi.initializer_functions = try filterFunctions(allocator, abi.functions, "initializer");
+        abi.default_initializer = abi.findDefaultInitializer();
+
+        if (cached) |entry| {
+            abi.private_function_tree_root = entry.private_function_tree_root;
+            abi.unconstrained_function_tree_root = entry.unconstrained_function_tree_root;
+            abi.public_bytecode_commitment = entry.public_bytecode_commitment;
+            abi.artifact_hash = entry.artifact_hash;
+            abi.class_id = entry.class_id;
+            return abi;
+        }
+
         abi.private_function_tree_root = try computeFunctionTreeRoot(allocator, abi.private_functions);
         abi.unconstrained_function_tree_root = try computeFunctionTreeRoot(allocator, abi.unconstrained_functions);
         abi.artifact_hash = try abi.computeArtifactHash(allocator);
-        abi.default_initializer = abi.findDefaultInitializer();
         abi.class_id = poseidon2.hash(&[_]F{
             F.from_int(constants.GeneratorIndex.contract_leaf),
             abi.artifact_hash,
@@ -265,6 +310,20 @@ pub const ContractAbi = struct {
             abi.public_bytecode_commitment,
         });
 
+        if (cache) |c| {
+            const selectors = try allocator.alloc(u32, abi.functions.len);
+            defer allocator.free(selectors);
+            for (abi.functions, selectors) |f, *selector| selector.* = f.selector;
+            c.put(key, &.{
+                .selectors = selectors,
+                .private_function_tree_root = abi.private_function_tree_root,
+                .unconstrained_function_tree_root = abi.unconstrained_function_tree_root,
+                .public_bytecode_commitment = abi.public_bytecode_commitment,
+                .artifact_hash = abi.artifact_hash,
+                .class_id = abi.class_id,
+            }) catch |err| std.debug.print("Failed to write contract class cache entry: {}\n", .{err});
+        }
+
         return abi;
     }
 
@@ -272,12 +331,28 @@ pub const ContractAbi = struct {
         self: *const ContractAbi,
         selector: FunctionSelector,
     ) !Function {
-        for (self.functions) |f| {
-            if (f.selector == selector) {
-                return f;
-            }
+        const index = self.selector_index.get(selector) orelse return error.FunctionNotFound;
+        return self.functions[index];
+    }
+
+    /// Returns the debug info of one of the contract's functions.
+    /// The first call parses the debug sections of the artifact, which load skipped.
+    pub fn getFunctionDebugInfo(
+        self: *const ContractAbi,
+        allocator: std.mem.Allocator,
+        function: *const Function,
+    ) !*const debug_info.DebugInfo {
+        const sections = self.debug_sections;
+        if (!sections.loaded) {
+            const path = self.artifact_path orelse return error.DebugSymbolsNotFound;
+            const json_debug = try parseJson(JsonContractDebug, allocator, path);
+            if (json_debug.functions.len != self.functions.len) return error.ArtifactChanged;
+            for (self.functions, json_debug.functions) |*f, jf| f.debug_symbols = jf.debug_symbols;
+            sections.file_map = json_debug.file_map;
+            sections.loaded = true;
         }
-        return error.FunctionNotFound;
+        if (function.index >= self.functions.len) return error.FunctionNotFound;
+        return self.functions[function.index].getDebugInfo(allocator, sections.file_map);
     }
 
     fn findDefaultInitializer(self: *ContractAbi) ?Function {
@@ -406,6 +481,11 @@ test "parse contract abi" {
     try std.testing.expectEqualDeep("Token", abi.name);
     try std.testing.expectEqual(37, abi.functions.len);
     try std.testing.expectEqual(1, abi.initializer_functions.len);
+    for (abi.functions, 0..) |f, i| {
+        const found = try abi.getFunctionBySelector(f.selector);
+        try std.testing.expectEqual(i, found.index);
+    }
+    try std.testing.expectError(error.FunctionNotFound, abi.getFunctionBySelector(0xdeadbeef));
 }
 
 const func_fixture = Function{
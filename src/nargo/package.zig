@@ -3,6 +3,7 @@ const nargo_toml = @import("./nargo_toml.zig");
 const prover_toml = @import("./prover_toml.zig");
 const artifact = @import("./artifact.zig");
 const contract = @import("./contract.zig");
+const class_cache = @import("./class_cache.zig");
 pub const debug_info = @import("./debug_info.zig");
 pub const calldata = @import("./calldata.zig");
 
@@ -10,6 +11,7 @@ pub const calldata = @import("./calldata.zig");
 pub const ArtifactAbi = artifact.ArtifactAbi;
 pub const ContractAbi = contract.ContractAbi;
 pub const Function = contract.Function;
+pub const ClassCache = class_cache.ClassCache;
 pub const DebugInfo = debug_info.DebugInfo;
 
 test {
@@ -18,6 +20,7 @@ test {
     _ = prover_toml;
     _ = artifact;
     _ = contract;
+    _ = class_cache;
     _ = debug_info;
     _ = calldata;
 }
@@ -5,6 +5,53 @@ const Atomic = std.atomic.Value;
 
 pub const ThreadPool = @import("./kprotty/thread_pool.zig");
 
+/// Calls `run` with a pointer to each item, concurrently on the pool, returning once every call has returned.
+/// If `run` also takes an allocator, each call is given its own arena, as the caller's allocator needn't be thread safe.
+/// Without a pool, the items are run in order on the calling thread.
+pub fn runAll(allocator: std.mem.Allocator, pool: ?*ThreadPool, comptime T: type, items: []T, comptime run: anytype) !void {
+    const Job = struct {
+        task: ThreadPool.Task = .{ .callback = onSchedule },
+        item: *T,
+        cnt: *Atomic(u64),
+
+        fn onSchedule(task: *ThreadPool.Task) void {
+            const self: *@This() = @fieldParentPtr("task", task);
+            call(self.item);
+            _ = self.cnt.fetchSub(1, .release);
+        }
+
+        fn call(item: *T) void {
+            if (comptime @typeInfo(@TypeOf(run)).@"fn".params.len == 2) {
+                var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
+                defer arena.deinit();
+                run(item, arena.allocator());
+            } else {
+                run(item);
+            }
+        }
+    };
+
+    const p = pool orelse {
+        for (items) |*item| Job.call(item);
+        return;
+    };
+    if (items.len == 0) return;
+    const jobs = try allocator.alloc(Job, items.len);
+    defer allocator.free(jobs);
+    var cnt = Atomic(u64).init(items.len);
+    var batch = ThreadPool.Batch{};
+    for (jobs, items) |*job, *item| {
+        job.* = .{ .item = item, .cnt = &cnt };
+        batch.push(ThreadPool.Batch.from(&job.task));
+    }
+    p.schedule(batch);
+
+    // Spin waiting for all jobs to complete.
+    while (cnt.load(.acquire) > 0) {
+        std.atomic.spinLoopHint();
+    }
+}
+
 var a: Fr = undefined;
 var b: Fr = undefined;
 var c: Fr = undefined;
@@ -61,3 +108,36 @@ test "init deinit 1 threads" {
     var pool = ThreadPool.init(.{ .max_threads = 1 });
     defer pool.deinit();
 }
+
+test "run all" {
+    const Item = struct {
+        in: u64,
+        out: u64 = 0,
+
+        fn square(self: *@This()) void {
+            self.out = self.in * self.in;
+        }
+
+        fn squareAlloc(self: *@This(), allocator: std.mem.Allocator) void {
+            const tmp = allocator.create(u64) catch unreachable;
+            tmp.* = self.in * self.in;
+            self.out = tmp.*;
+        }
+    };
+    var pool = ThreadPool.init(.{ .max_threads = 4 });
+    defer {
+        pool.shutdown();
+        pool.deinit();
+    }
+
+    var items: [100]Item = undefined;
+    for ([_]?*ThreadPool{ &pool, null }) |p| {
+        for (&items, 0..) |*item, i| item.* = .{ .in = i };
+        try runAll(std.testing.allocator, p, Item, &items, Item.square);
+        for (items, 0..) |item, i| try std.testing.expectEqual(i * i, item.out);
+
+        for (&items, 0..) |*item, i| item.* = .{ .in = i };
+        try runAll(std.testing.allocator, p, Item, &items, Item.squareAlloc);
+        for (items, 0..) |item, i| try std.testing.expectEqual(i * i, item.out);
+    }
+}
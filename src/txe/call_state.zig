@@ -4,6 +4,7 @@ const proto = @import("../protocol/package.zig");
 const nargo = @import("../nargo/package.zig");
 const bvm = @import("../bvm/package.zig");
 const NoteCache = @import("note_cache.zig").NoteCache;
+const CowMap = @import("cow_map.zig").CowMap;
 
 pub fn KeyCtx(comptime K: type) type {
     return struct {
@@ -33,6 +34,13 @@ pub const CapsuleKey = struct {
     }
 };
 
+pub const CapsuleStorage = CowMap(CapsuleKey, []F, KeyCtx(CapsuleKey));
+pub const ExecutionCache = CowMap(F, []F, KeyCtx(F));
+
+fn freeFields(allocator: std.mem.Allocator, fields: []F) void {
+    allocator.free(fields);
+}
+
 pub const PrivateLog = struct {
     fields: [18]F = [_]F{F.zero} ** 18,
     emitted_length: u32 = 0,
@@ -54,10 +62,10 @@ pub const CallState = struct {
     private_logs: std.ArrayList(PrivateLog),
 
     // Capsule storage (temporary storage used by contracts).
-    capsule_storage: std.HashMap(CapsuleKey, []F, KeyCtx(CapsuleKey), 80),
+    capsule_storage: CapsuleStorage,
 
     // Execution data (args_hash->input args, return_hash->return witnesses).
-    execution_cache: std.HashMap(F, []F, KeyCtx(F), 80),
+    execution_cache: ExecutionCache,
     return_data: []F,
 
     // Reference to parent for state lookup
@@ -80,8 +88,8 @@ pub const CallState = struct {
             .public_nullifiers = std.ArrayList(F).init(allocator),
             // .storage_writes = std.StringHashMap([]F).init(allocator),
             .private_logs = std.ArrayList(PrivateLog).init(allocator),
-            .capsule_storage = std.HashMap(CapsuleKey, []F, KeyCtx(CapsuleKey), 80).init(allocator),
-            .execution_cache = std.HashMap(F, []F, KeyCtx(F), 80).init(allocator),
+            .capsule_storage = CapsuleStorage.init(allocator, freeFields),
+            .execution_cache = ExecutionCache.init(allocator, freeFields),
             .return_data = &[_]F{},
         };
     }
@@ -98,23 +106,74 @@ pub const CallState = struct {
         // }
         // self.storage_writes.deinit();
 
-        // Free capsule storage values.
-        var capsule_iter = self.capsule_storage.valueIterator();
-        while (capsule_iter.next()) |value| {
-            self.capsule_storage.allocator.free(value.*);
-        }
+        // Frees capsule storage values.
         self.capsule_storage.deinit();
 
         self.private_logs.deinit();
 
-        // Free execution cache values.
-        var cache_iter = self.execution_cache.valueIterator();
-        while (cache_iter.next()) |value| {
-            self.execution_cache.allocator.free(value.*);
-        }
+        // Frees execution cache values.
         self.execution_cache.deinit();
     }
 
+    /// The state of a call frame, with its capsules and execution cache frozen for sharing.
+    pub const Snapshot = struct {
+        contract_address: proto.AztecAddress,
+        msg_sender: proto.AztecAddress,
+        function_selector: u32,
+        is_static_call: bool,
+        side_effect_counter: u32,
+        public_nullifiers: []F,
+        private_logs: []PrivateLog,
+        capsule_storage: ?*CapsuleStorage.Layer,
+        execution_cache: ?*ExecutionCache.Layer,
+
+        pub fn deinit(self: *Snapshot, allocator: std.mem.Allocator) void {
+            allocator.free(self.public_nullifiers);
+            allocator.free(self.private_logs);
+            CapsuleStorage.release(allocator, self.capsule_storage);
+            ExecutionCache.release(allocator, self.execution_cache);
+        }
+    };
+
+    /// Takes a snapshot of this frame. Capsules and the execution cache are frozen, rather than copied.
+    pub fn snapshot(self: *CallState, allocator: std.mem.Allocator) !Snapshot {
+        const public_nullifiers = try allocator.dupe(F, self.public_nullifiers.items);
+        errdefer allocator.free(public_nullifiers);
+        const private_logs = try allocator.dupe(PrivateLog, self.private_logs.items);
+        errdefer allocator.free(private_logs);
+        const capsule_storage = try self.capsule_storage.snapshot();
+        errdefer CapsuleStorage.release(allocator, capsule_storage);
+        return .{
+            .contract_address = self.contract_address,
+            .msg_sender = self.msg_sender,
+            .function_selector = self.function_selector,
+            .is_static_call = self.is_static_call,
+            .side_effect_counter = self.side_effect_counter,
+            .public_nullifiers = public_nullifiers,
+            .private_logs = private_logs,
+            .capsule_storage = capsule_storage,
+            .execution_cache = try self.execution_cache.snapshot(),
+        };
+    }
+
+    /// Returns this frame to the snapshot, discarding anything written since.
+    pub fn restore(self: *CallState, snap: *const Snapshot) !void {
+        self.contract_address = snap.contract_address;
+        self.msg_sender = snap.msg_sender;
+        self.function_selector = snap.function_selector;
+        self.is_static_call = snap.is_static_call;
+        self.side_effect_counter = snap.side_effect_counter;
+        self.public_nullifiers.clearRetainingCapacity();
+        try self.public_nullifiers.appendSlice(snap.public_nullifiers);
+        self.private_logs.clearRetainingCapacity();
+        try self.private_logs.appendSlice(snap.private_logs);
+        self.capsule_storage.restore(snap.capsule_storage);
+        self.execution_cache.restore(snap.execution_cache);
+        self.return_data = &[_]F{};
+        self.contract_abi = null;
+        self.execution_error = null;
+    }
+
     /// Create a child state that inherits from this state
     pub fn createChild(
         self: *CallState,
@@ -268,12 +327,7 @@ pub const CallState = struct {
 
     /// Store capsule data with a key in the current context
     fn storeCapsule(self: *CallState, key: CapsuleKey, capsule: []const F) !void {
-        // If there's existing data, free it
-        if (self.capsule_storage.get(key)) |existing| {
-            self.capsule_storage.allocator.free(existing);
-        }
-
-        // Store new data (key is a value type, no need to copy)
+        // Store new data, freeing any existing data (key is a value type, no need to copy)
         const capsule_copy = try self.capsule_storage.allocator.alloc(F, capsule.len);
         @memcpy(capsule_copy, capsule);
 
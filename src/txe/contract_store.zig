@@ -0,0 +1,137 @@
+const std = @import("std");
+const cvm = @import("../cvm/package.zig");
+const ContractAbi = @import("../nargo/contract.zig").ContractAbi;
+const Function = @import("../nargo/contract.zig").Function;
+const ClassCache = @import("../nargo/class_cache.zig").ClassCache;
+const DebugInfo = @import("../nargo/debug_info.zig").DebugInfo;
+const ThreadPool = @import("../thread/thread_pool.zig").ThreadPool;
+const runAll = @import("../thread/thread_pool.zig").runAll;
+
+// Decodes one contract function's program into its slot in ContractAbi.programs.
+const DecodeTask = struct {
+    program_cache: *cvm.ProgramCache,
+    function: *const Function,
+    slot: *?cvm.io.Program,
+    arena: std.heap.ArenaAllocator,
+
+    fn run(self: *DecodeTask) void {
+        if (self.program_cache.load(self.arena.allocator(), self.function)) |program| {
+            self.slot.* = program;
+        } else |_| {}
+    }
+};
+
+fn isPublic(function: *const Function) bool {
+    if (std.mem.eql(u8, function.name, "public_dispatch")) return true;
+    for (function.custom_attributes) |attr| if (std.mem.eql(u8, attr, "public")) return true;
+    return false;
+}
+
+/// The contract artifacts deployed by one or more TXEs, each parsed and decoded once per process.
+/// Contracts are immutable once loaded, so TXEs on different threads share them without copying.
+/// The allocator must be thread safe if the store is shared across threads.
+pub const ContractStore = struct {
+    allocator: std.mem.Allocator,
+    contract_artifacts_path: []const u8,
+    // Guards contracts, class_cache, program_arenas, and the lazily filled parts of the contracts.
+    mutex: std.Thread.Mutex = .{},
+    // Loaded contracts, by name.
+    contracts: std.StringHashMap(ContractAbi),
+    // Deserialized programs of contract functions, persisted across runs.
+    program_cache: cvm.ProgramCache,
+    // Selectors and hashes of contract artifacts, persisted across runs.
+    class_cache: ClassCache,
+    // Decodes contract functions when loaded.
+    thread_pool: ThreadPool,
+    // Own the programs decoded on the thread pool, one per function.
+    program_arenas: std.ArrayList(std.heap.ArenaAllocator),
+
+    pub fn init(allocator: std.mem.Allocator, contract_artifacts_path: []const u8) !*ContractStore {
+        const store = try allocator.create(ContractStore);
+        store.* = .{
+            .allocator = allocator,
+            .contract_artifacts_path = contract_artifacts_path,
+            .contracts = std.StringHashMap(ContractAbi).init(allocator),
+            .program_cache = cvm.ProgramCache.init(allocator, true),
+            .class_cache = ClassCache.init(allocator, true),
+            .thread_pool = ThreadPool.init(.{ .max_threads = @min(try std.Thread.getCpuCount(), 64) }),
+            .program_arenas = std.ArrayList(std.heap.ArenaAllocator).init(allocator),
+        };
+        return store;
+    }
+
+    pub fn deinit(self: *ContractStore) void {
+        self.thread_pool.shutdown();
+        self.thread_pool.deinit();
+        self.contracts.deinit();
+        self.program_cache.deinit();
+        self.class_cache.deinit();
+        for (self.program_arenas.items) |*arena| arena.deinit();
+        self.program_arenas.deinit();
+        self.allocator.destroy(self);
+    }
+
+    /// Returns the named contract, loading it and decoding its functions on first use.
+    pub fn load(self: *ContractStore, tmp_allocator: std.mem.Allocator, contract_name: []const u8) !ContractAbi {
+        self.mutex.lock();
+        defer self.mutex.unlock();
+
+        if (self.contracts.get(contract_name)) |abi| return abi;
+        const contract_path = try std.fmt.allocPrint(tmp_allocator, "{s}/{s}.json", .{
+            self.contract_artifacts_path,
+            contract_name,
+        });
+        const abi = try ContractAbi.loadCached(self.allocator, contract_path, &self.class_cache);
+        try self.decodePrograms(tmp_allocator, &abi);
+        try self.contracts.put(try self.allocator.dupe(u8, contract_name), abi);
+        return abi;
+    }
+
+    /// Returns the decoded program of one of the contract's functions, decoding it on first use.
+    pub fn getFunctionProgram(self: *ContractStore, abi: *const ContractAbi, function: *const Function) !*const cvm.io.Program {
+        self.mutex.lock();
+        defer self.mutex.unlock();
+
+        const slot = &abi.programs[function.index];
+        if (slot.* == null) slot.* = try self.program_cache.load(self.allocator, function);
+        return &slot.*.?;
+    }
+
+    /// As ContractAbi.getFunctionDebugInfo, but safe to call while other threads share the contract.
+    pub fn getFunctionDebugInfo(self: *ContractStore, abi: *const ContractAbi, function: *const Function) !*const DebugInfo {
+        self.mutex.lock();
+        defer self.mutex.unlock();
+
+        return abi.getFunctionDebugInfo(self.allocator, function);
+    }
+
+    pub fn dump(self: *ContractStore) void {
+        self.program_cache.dump();
+        self.mutex.lock();
+        defer self.mutex.unlock();
+        self.class_cache.dump();
+    }
+
+    /// Decodes all of the contract's functions in parallel on the thread pool.
+    /// A function that fails to decode is left to fail again, with its error, when first called.
+    fn decodePrograms(self: *ContractStore, tmp_allocator: std.mem.Allocator, abi: *const ContractAbi) !void {
+        var tasks = try std.ArrayList(DecodeTask).initCapacity(tmp_allocator, abi.functions.len);
+        defer tasks.deinit();
+        for (abi.functions) |*f| {
+            // Public functions are reached through public_dispatch, whose bytecode is for the avm.
+            if (f.bytecode.len == 0 or isPublic(f)) continue;
+            tasks.appendAssumeCapacity(.{
+                .program_cache = &self.program_cache,
+                .function = f,
+                .slot = &abi.programs[f.index],
+                .arena = std.heap.ArenaAllocator.init(std.heap.page_allocator),
+            });
+        }
+        if (tasks.items.len == 0) return;
+        // Reserve up front, so the arenas can always be kept once the programs reference them.
+        try self.program_arenas.ensureUnusedCapacity(tasks.items.len);
+
+        try runAll(tmp_allocator, &self.thread_pool, DecodeTask, tasks.items, DecodeTask.run);
+        for (tasks.items) |t| self.program_arenas.appendAssumeCapacity(t.arena);
+    }
+};
@@ -0,0 +1,195 @@
+const std = @import("std");
+
+/// A hash map whose entries can be frozen into an immutable layer in O(1), so it can be snapshotted and later restored.
+/// Lookups search the map's own entries, then each layer beneath. Writes only ever go to the map's own entries,
+/// so the map is restored to a snapshot by dropping its own entries.
+/// Layers are reference counted, and shared by the map and its snapshots.
+/// If given, free_value is called on values when they are overwritten, or their layer or map is freed.
+pub fn CowMap(comptime K: type, comptime V: type, comptime Context: type) type {
+    return struct {
+        const Self = @This();
+        const Map = std.HashMapUnmanaged(K, V, Context, std.hash_map.default_max_load_percentage);
+        pub const FreeFn = *const fn (std.mem.Allocator, V) void;
+        pub const Entry = Map.Entry;
+
+        /// Frozen entries, shared by the map and its snapshots.
+        pub const Layer = struct {
+            map: Map,
+            parent: ?*Layer,
+            refs: std.atomic.Value(u32),
+            free_value: ?FreeFn,
+
+            fn acquire(self: *Layer) *Layer {
+                _ = self.refs.fetchAdd(1, .monotonic);
+                return self;
+            }
+        };
+
+        allocator: std.mem.Allocator,
+        free_value: ?FreeFn,
+        base: ?*Layer = null,
+        own: Map = .{},
+
+        pub fn init(allocator: std.mem.Allocator, free_value: ?FreeFn) Self {
+            return .{ .allocator = allocator, .free_value = free_value };
+        }
+
+        pub fn deinit(self: *Self) void {
+            freeValues(self.allocator, self.free_value, &self.own);
+            self.own.deinit(self.allocator);
+            release(self.allocator, self.base);
+        }
+
+        /// Freezes the map's entries, returning a reference to them that must be released.
+        pub fn snapshot(self: *Self) !?*Layer {
+            if (self.own.count() > 0) {
+                const layer = try self.allocator.create(Layer);
+                layer.* = .{
+                    .map = self.own,
+                    .parent = self.base,
+                    .refs = std.atomic.Value(u32).init(1),
+                    .free_value = self.free_value,
+                };
+                self.base = layer;
+                self.own = .{};
+            }
+            return if (self.base) |layer| layer.acquire() else null;
+        }
+
+        /// Discards all entries, leaving those of the snapshot.
+        pub fn restore(self: *Self, snapshot_layer: ?*Layer) void {
+            freeValues(self.allocator, self.free_value, &self.own);
+            self.own.clearRetainingCapacity();
+            const old = self.base;
+            self.base = if (snapshot_layer) |layer| layer.acquire() else null;
+            release(self.allocator, old);
+        }
+
+        /// Releases a reference to a layer, freeing it (and any parents) once unreferenced.
+        pub fn release(allocator: std.mem.Allocator, snapshot_layer: ?*Layer) void {
+            var next = snapshot_layer;
+            while (next) |layer| {
+                if (layer.refs.fetchSub(1, .acq_rel) != 1) return;
+                next = layer.parent;
+                freeValues(allocator, layer.free_value, &layer.map);
+                layer.map.deinit(allocator);
+                allocator.destroy(layer);
+            }
+        }
+
+        pub fn get(self: *const Self, key: K) ?V {
+            return if (self.getPtr(key)) |value| value.* else null;
+        }
+
+        /// The pointer is only valid until the next put, and must not be written through.
+        pub fn getPtr(self: *const Self, key: K) ?*const V {
+            if (self.own.getPtr(key)) |value| return value;
+            var next = self.base;
+            while (next) |layer| : (next = layer.parent) {
+                if (layer.map.getPtr(key)) |value| return value;
+            }
+            return null;
+        }
+
+        pub fn contains(self: *const Self, key: K) bool {
+            return self.getPtr(key) != null;
+        }
+
+        /// Adds or replaces the entry. Replacing one of the map's own entries frees the old value.
+        pub fn put(self: *Self, key: K, value: V) !void {
+            const entry = try self.own.getOrPut(self.allocator, key);
+            if (entry.found_existing) {
+                if (self.free_value) |free| free(self.allocator, entry.value_ptr.*);
+            }
+            entry.value_ptr.* = value;
+        }
+
+        /// The number of distinct keys, across the map and its layers.
+        pub fn count(self: *const Self) usize {
+            if (self.base == null) return self.own.count();
+            var n: usize = 0;
+            var it = self.iterator();
+            while (it.next() != null) n += 1;
+            return n;
+        }
+
+        /// Iterates the visible entries, i.e. the newest entry of each key.
+        pub fn iterator(self: *const Self) Iterator {
+            return .{ .map = self, .layer = null, .it = self.own.iterator() };
+        }
+
+        pub const Iterator = struct {
+            map: *const Self,
+            // The layer being iterated, or null for the map's own entries.
+            layer: ?*Layer,
+            it: Map.Iterator,
+
+            pub fn next(self: *Iterator) ?Entry {
+                while (true) {
+                    while (self.it.next()) |entry| {
+                        if (!self.shadowed(entry.key_ptr.*)) return entry;
+                    }
+                    const layer = (if (self.layer) |l| l.parent else self.map.base) orelse return null;
+                    self.layer = layer;
+                    self.it = layer.map.iterator();
+                }
+            }
+
+            // Whether the key has a newer entry, above the current layer.
+            fn shadowed(self: *const Iterator, key: K) bool {
+                const current = self.layer orelse return false;
+                if (self.map.own.contains(key)) return true;
+                var next_layer = self.map.base;
+                while (next_layer) |layer| : (next_layer = layer.parent) {
+                    if (layer == current) return false;
+                    if (layer.map.contains(key)) return true;
+                }
+                return false;
+            }
+        };
+
+        fn freeValues(allocator: std.mem.Allocator, free_value: ?FreeFn, map: *Map) void {
+            const free = free_value orelse return;
+            var it = map.valueIterator();
+            while (it.next()) |value| free(allocator, value.*);
+        }
+    };
+}
+
+pub fn AutoCowMap(comptime K: type, comptime V: type) type {
+    return CowMap(K, V, std.hash_map.AutoContext(K));
+}
+
+test "snapshot and restore" {
+    const Map = AutoCowMap(u32, []u8);
+    const allocator = std.testing.allocator;
+    const free = struct {
+        fn f(a: std.mem.Allocator, value: []u8) void {
+            a.free(value);
+        }
+    }.f;
+
+    var map = Map.init(allocator, free);
+    defer map.deinit();
+    try map.put(1, try allocator.dupe(u8, "one"));
+    try map.put(2, try allocator.dupe(u8, "two"));
+    const snapshot = try map.snapshot();
+    defer Map.release(allocator, snapshot);
+
+    // Writes after the snapshot shadow it, without changing it.
+    try map.put(2, try allocator.dupe(u8, "deux"));
+    try map.put(3, try allocator.dupe(u8, "trois"));
+    try map.put(3, try allocator.dupe(u8, "three"));
+    try std.testing.expectEqualStrings("deux", map.get(2).?);
+    try std.testing.expectEqual(3, map.count());
+
+    var it = map.iterator();
+    var sum: u32 = 0;
+    while (it.next()) |entry| sum += entry.key_ptr.*;
+    try std.testing.expectEqual(6, sum);
+
+    map.restore(snapshot);
+    try std.testing.expectEqualStrings("two", map.get(2).?);
+    try std.testing.expectEqual(null, map.get(3));
+    try std.testing.expectEqual(2, map.count());
+}
@@ -7,6 +7,8 @@ pub const TxeDispatcher = struct {
     allocator: std.mem.Allocator,
     mocker: bvm.foreign_call.Mocker,
     txe_impl: *TxeImpl,
+    // If set, every call is recorded, including those of nested vms.
+    stats: ?*bvm.foreign_call.ForeignCallStats = null,
 
     pub fn fcDispatcher(self: *TxeDispatcher) bvm.foreign_call.ForeignCallDispatcher {
         return .{
@@ -29,26 +31,37 @@ pub const TxeDispatcher = struct {
 
     fn handleForeignCall(context: *anyopaque, mem: *bvm.memory.Memory, fc: *const bvm.io.ForeignCall) !void {
         const self: *TxeDispatcher = @alignCast(@ptrCast(context));
+        const stats = self.stats orelse return self.dispatch(mem, fc);
 
+        const in_slots = bvm.foreign_call.marshal.inputSlots(mem, fc);
+        var t = try std.time.Timer.start();
+        const result = self.dispatch(mem, fc);
+        const elapsed_ns = t.read();
+        // A failed call may not have written its outputs.
+        const out_slots = if (result) |_| bvm.foreign_call.marshal.outputSlots(mem, fc) else |_| 0;
+        try stats.record(fc, in_slots, out_slots, elapsed_ns);
+        return result;
+    }
+
+    fn dispatch(self: *TxeDispatcher, mem: *bvm.memory.Memory, fc: *const bvm.io.ForeignCall) !void {
         // This arena allocator is for the transient memory needed for processing the call.
         // In the actual call handlers you have access to self.allocator for longer lived data.
         var arena = std.heap.ArenaAllocator.init(self.allocator);
         defer arena.deinit();
 
-        // Extract from the VM memory, a slice of ForeignCallParam's, one per argument.
-        const params = try bvm.foreign_call.marshal.extractParams(arena.allocator(), mem, fc);
-
         // First see if this is a mock setup call, or a mocked call.
-        if (try self.mocker.handleForeignCall(arena.allocator(), mem, fc, params)) {
+        if (try self.mocker.handleForeignCall(arena.allocator(), mem, fc)) {
             return;
         }
 
-        // Otherwise attempt to dispatch on txe.
-        if (try bvm.foreign_call.structDispatcher(self.txe_impl, self.allocator, mem, fc, params)) {
+        // Otherwise attempt to dispatch on txe. Arguments are read straight from vm memory.
+        if (try bvm.foreign_call.structDispatcher(self.txe_impl, self.allocator, mem, fc)) {
             return;
         }
 
         // We didn't find a matching function. Fallback on default foreign call handler.
+        // Extract from the VM memory, a slice of ForeignCallParam's, one per argument.
+        const params = try bvm.foreign_call.marshal.extractParams(arena.allocator(), mem, fc);
         try bvm.foreign_call.marshal.handleForeignCall(arena.allocator(), mem, fc, params);
     }
 };
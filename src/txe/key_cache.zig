@@ -0,0 +1,95 @@
+const std = @import("std");
+const F = @import("../bn254/fr.zig").Fr;
+const GrumpkinScalar = @import("../grumpkin/fr.zig").Fr;
+const proto = @import("../protocol/package.zig");
+const key_derivation = @import("../protocol/key_derivation.zig");
+const AutoLru = @import("../lru/lru.zig").AutoLru;
+
+/// Keys derived from account secrets, and app secrets derived from master keys, so each is only derived once.
+/// Deriving an account's keys takes several grumpkin scalar multiplications, and tests derive the same few accounts'
+/// keys on nearly every key validation request. Each is a pure function of its inputs, so entries never go stale.
+/// Each cache holds at most `capacity` entries, evicting the least recently used.
+pub const KeyCache = struct {
+    const AppKey = struct {
+        master_key: u256,
+        app: u256,
+        generator: key_derivation.KeyGenerators,
+    };
+
+    derived_keys: AutoLru(u256, key_derivation.DerivedKeys),
+    app_secrets: AutoLru(AppKey, F),
+
+    pub fn init(allocator: std.mem.Allocator, capacity: usize) KeyCache {
+        return .{
+            .derived_keys = AutoLru(u256, key_derivation.DerivedKeys).init(allocator, capacity),
+            .app_secrets = AutoLru(AppKey, F).init(allocator, capacity),
+        };
+    }
+
+    pub fn deinit(self: *KeyCache) void {
+        self.derived_keys.deinit();
+        self.app_secrets.deinit();
+    }
+
+    /// As proto.deriveKeys.
+    pub fn deriveKeys(self: *KeyCache, secret: F) !key_derivation.DerivedKeys {
+        const key = secret.to_int();
+        if (self.derived_keys.get(key)) |keys| return keys;
+        const keys = proto.deriveKeys(secret);
+        _ = try self.derived_keys.put(key, keys);
+        return keys;
+    }
+
+    /// As proto.CompleteAddress.fromSecretKeyAndPartialAddress.
+    pub fn completeAddress(self: *KeyCache, secret: F, partial_address: proto.PartialAddress) !proto.CompleteAddress {
+        const public_keys = (try self.deriveKeys(secret)).public_keys;
+        return .{
+            .aztec_address = proto.AztecAddress.compute(public_keys, partial_address),
+            .public_keys = public_keys,
+            .partial_address = partial_address,
+        };
+    }
+
+    /// As key_derivation.computeAppSecretKey.
+    pub fn computeAppSecretKey(
+        self: *KeyCache,
+        sk_m: GrumpkinScalar,
+        app: proto.AztecAddress,
+        generator: key_derivation.KeyGenerators,
+    ) !F {
+        const key = AppKey{ .master_key = sk_m.to_int(), .app = app.value.to_int(), .generator = generator };
+        if (self.app_secrets.get(key)) |sk_app| return sk_app;
+        const sk_app = key_derivation.computeAppSecretKey(sk_m, app, generator);
+        _ = try self.app_secrets.put(key, sk_app);
+        return sk_app;
+    }
+
+    pub fn dump(self: *const KeyCache) void {
+        std.debug.print("Derived key cache hits / misses: {} / {}\n", .{ self.derived_keys.hits, self.derived_keys.misses });
+        std.debug.print("App secret cache hits / misses: {} / {}\n", .{ self.app_secrets.hits, self.app_secrets.misses });
+    }
+};
+
+test "key cache" {
+    var cache = KeyCache.init(std.testing.allocator, 1);
+    defer cache.deinit();
+
+    const secret = F.from_int(42);
+    const partial_address = proto.PartialAddress.init(secret);
+    const expected = proto.CompleteAddress.fromSecretKeyAndPartialAddress(secret, partial_address);
+    try std.testing.expectEqualDeep(expected, try cache.completeAddress(secret, partial_address));
+    try std.testing.expectEqualDeep(expected, try cache.completeAddress(secret, partial_address));
+    try std.testing.expectEqual(1, cache.derived_keys.hits);
+
+    // The only entry is evicted by another secret.
+    _ = try cache.deriveKeys(F.from_int(43));
+    _ = try cache.deriveKeys(secret);
+    try std.testing.expectEqual(3, cache.derived_keys.misses);
+
+    const keys = try cache.deriveKeys(secret);
+    const app = proto.AztecAddress{ .value = F.from_int(7) };
+    const sk_app = key_derivation.computeAppNullifierSecretKey(keys.master_nullifier_secret_key, app);
+    try std.testing.expect(sk_app.eql(try cache.computeAppSecretKey(keys.master_nullifier_secret_key, app, .n)));
+    try std.testing.expect(sk_app.eql(try cache.computeAppSecretKey(keys.master_nullifier_secret_key, app, .n)));
+    try std.testing.expectEqual(1, cache.app_secrets.hits);
+}
@@ -63,13 +63,42 @@ pub const NoteData = struct {
 
 /// Notes and nullifiers that exist within a tx scope.
 /// Presents a set of notes that have not been nullified within this tx scope.
+/// A cache can be frozen by snapshot, after which it only holds what's added since, on top of the frozen parent.
+/// Any number of caches can share a frozen parent, so restoring a snapshot costs only what's written after.
 /// TODO: Move private logs here? Rename this StorageCache? Or SideEffectCache?
 pub const NoteCache = struct {
+    // A field scoped to a contract. Fields are keyed on their canonical value, as their limbs may not be reduced.
+    const Key = struct {
+        contract_address: u256,
+        value: u256,
+    };
+
+    // A nullification of a note frozen in a parent.
+    const Nullification = struct {
+        nullifier: F,
+        siloed_nullifier: F,
+    };
+
     allocator: std.mem.Allocator,
-    // Notes that have not been nullified during this scope.
+    // Frozen notes and nullifiers, from before the last snapshot.
+    parent: ?*NoteCache = null,
+    // References to a frozen cache, from its snapshots and children.
+    refs: std.atomic.Value(u32) = std.atomic.Value(u32).init(1),
+    // Notes are numbered across the parents, so this cache's first note is at position offset.
+    offset: u32 = 0,
+    // All notes added during this scope. Nullified notes are kept, with their nullifier set.
     notes: std.ArrayList(NoteData),
     // All nullifiers emitted during this scope.
     nullifiers: std.ArrayList(F),
+    // Positions of the notes in notes not yet nullified, in order, by contract and storage slot.
+    // Notes never move, so phase changes and finalize leave the indexes valid.
+    notes_by_slot: std.AutoHashMap(Key, std.ArrayList(u32)),
+    // Position of the first note in notes with each note hash, by contract.
+    notes_by_hash: std.AutoHashMap(Key, u32),
+    // Every nullifier given to nullifyNote, by contract, whether emitted or assigned to a note.
+    nullified: std.AutoHashMap(Key, void),
+    // Nullifications of the parents' notes, by position.
+    nullified_parent_notes: std.AutoHashMap(u32, Nullification),
     // The side effect counter increments for every note added/nullified.
     // Each note tracks the counter it was created at.
     side_effect_counter: u32 = 0,
@@ -81,12 +110,122 @@ pub const NoteCache = struct {
             .allocator = allocator,
             .notes = std.ArrayList(NoteData).init(allocator),
             .nullifiers = std.ArrayList(F).init(allocator),
+            .notes_by_slot = std.AutoHashMap(Key, std.ArrayList(u32)).init(allocator),
+            .notes_by_hash = std.AutoHashMap(Key, u32).init(allocator),
+            .nullified = std.AutoHashMap(Key, void).init(allocator),
+            .nullified_parent_notes = std.AutoHashMap(u32, Nullification).init(allocator),
         };
     }
 
     pub fn deinit(self: *NoteCache) void {
         self.notes.deinit();
         self.nullifiers.deinit();
+        var it = self.notes_by_slot.valueIterator();
+        while (it.next()) |positions| positions.deinit();
+        self.notes_by_slot.deinit();
+        self.notes_by_hash.deinit();
+        self.nullified.deinit();
+        self.nullified_parent_notes.deinit();
+        release(self.parent);
+    }
+
+    /// Removes all notes and nullifiers, and leaves the non-revertible phase.
+    pub fn clear(self: *NoteCache) void {
+        self.restore(null);
+    }
+
+    /// Freezes the cache's contents, returning a reference to them that must be released.
+    pub fn snapshot(self: *NoteCache) !*NoteCache {
+        const allocator = self.allocator;
+        const frozen = try allocator.create(NoteCache);
+        frozen.* = self.*;
+        // Referenced by this cache, as its parent.
+        frozen.refs = std.atomic.Value(u32).init(1);
+        self.* = NoteCache.init(allocator);
+        self.inherit(frozen);
+        return frozen.acquire();
+    }
+
+    /// Discards all notes and nullifiers, leaving those of the snapshot.
+    pub fn restore(self: *NoteCache, frozen: ?*NoteCache) void {
+        const allocator = self.allocator;
+        if (frozen) |f| _ = f.acquire();
+        self.deinit();
+        self.* = NoteCache.init(allocator);
+        if (frozen) |f| self.inherit(f);
+    }
+
+    /// Releases a reference to a frozen cache, freeing it (and any parents) once unreferenced.
+    pub fn release(frozen: ?*NoteCache) void {
+        const f = frozen orelse return;
+        if (f.refs.fetchSub(1, .acq_rel) != 1) return;
+        f.deinit();
+        f.allocator.destroy(f);
+    }
+
+    fn acquire(self: *NoteCache) *NoteCache {
+        _ = self.refs.fetchAdd(1, .monotonic);
+        return self;
+    }
+
+    // Takes ownership of a reference to the frozen cache, and carries on from it.
+    fn inherit(self: *NoteCache, frozen: *NoteCache) void {
+        self.parent = frozen;
+        self.offset = frozen.offset + @as(u32, @intCast(frozen.notes.items.len));
+        self.side_effect_counter = frozen.side_effect_counter;
+        self.min_revertible_side_effect_counter = frozen.min_revertible_side_effect_counter;
+    }
+
+    fn key(contract_address: proto.AztecAddress, value: F) Key {
+        return .{ .contract_address = contract_address.value.to_int(), .value = value.to_int() };
+    }
+
+    /// The number of notes added during this scope, including those since nullified.
+    pub fn noteCount(self: *const NoteCache) usize {
+        return self.offset + self.notes.items.len;
+    }
+
+    /// Returns the note at the given position, in the order notes were added.
+    pub fn getNote(self: *const NoteCache, position: u32) NoteData {
+        var cache = self;
+        while (position < cache.offset) cache = cache.parent.?;
+        var note = cache.notes.items[position - cache.offset];
+        // The newest nullification of a frozen note is in the nearest child.
+        var child: *const NoteCache = self;
+        while (child != cache) : (child = child.parent.?) {
+            if (child.nullified_parent_notes.get(position)) |n| {
+                note.nullifier = n.nullifier;
+                note.siloed_nullifier = n.siloed_nullifier;
+                break;
+            }
+        }
+        return note;
+    }
+
+    /// Whether the contract has nullified the given (inner) nullifier during this scope.
+    pub fn hasNullifier(self: *const NoteCache, contract_address: proto.AztecAddress, nullifier: F) bool {
+        var cache: ?*const NoteCache = self;
+        while (cache) |c| : (cache = c.parent) {
+            if (c.nullified.contains(key(contract_address, nullifier))) return true;
+        }
+        return false;
+    }
+
+    // Position of the first note with the hash, searching the oldest notes first.
+    fn findNoteByHash(self: *const NoteCache, k: Key) ?u32 {
+        if (self.parent) |parent| {
+            if (parent.findNoteByHash(k)) |position| return position;
+        }
+        return self.notes_by_hash.get(k);
+    }
+
+    // Whether the frozen note has been nullified by any cache from this one down to (excluding) its own.
+    fn isNullifiedAbove(self: *const NoteCache, position: u32, owner: *const NoteCache) bool {
+        var child: *const NoteCache = self;
+        while (child != owner) : (child = child.parent.?) {
+            if (child.nullified_parent_notes.contains(position)) return true;
+        }
+        return false;
     }
 
     /// Takes a copy of the note data and stores it.
@@ -99,7 +238,15 @@ pub const NoteCache = struct {
             [_]F{ note_data.contract_address.value, note_data.note_hash },
             proto.constants.GeneratorIndex.siloed_note_hash,
         );
+        const position: u32 = @intCast(self.noteCount());
         self.notes.append(note_to_add) catch unreachable;
+
+        const slot = self.notes_by_slot.getOrPut(key(note_data.contract_address, note_data.storage_slot)) catch unreachable;
+        if (!slot.found_existing) slot.value_ptr.* = std.ArrayList(u32).init(self.allocator);
+        slot.value_ptr.append(position) catch unreachable;
+        // As with a linear search, the first note with a given hash is the one nullified.
+        const by_hash = self.notes_by_hash.getOrPut(key(note_data.contract_address, note_data.note_hash)) catch unreachable;
+        if (!by_hash.found_existing) by_hash.value_ptr.* = position;
         // self.side_effect_counter += 1;
     }
 
@@ -109,27 +256,47 @@ pub const NoteCache = struct {
             proto.constants.GeneratorIndex.outer_nullifier,
         );
 
+        self.nullified.put(key(contract_address, nullifier), {}) catch unreachable;
+
         // No note hash given, just emit the siloed nullifier.
         if (note_hash.is_zero()) {
             self.nullifiers.append(siloed_nullifier) catch unreachable;
             return;
         }
 
-        for (self.notes.items) |*note| {
-            // Skip notes not in this contract.
-            if (!note.contract_address.eql(contract_address)) continue;
-
-            if (note.note_hash.eql(note_hash)) {
-                // Assign the nullifier to it to mark it as nullified.
-                note.nullifier = nullifier;
-
-                // If we're in the revertible phase, but nullifying a non-revertible note, we emit the nullifier.
-                if (self.min_revertible_side_effect_counter) |min_revertible_side_effect_counter| {
-                    if (note.side_effect_counter < min_revertible_side_effect_counter) {
-                        self.nullifiers.append(note.siloed_nullifier) catch unreachable;
+        const position = self.findNoteByHash(key(contract_address, note_hash)) orelse return;
+        const side_effect_counter = if (position < self.offset) blk: {
+            // Frozen notes can't be written, so the nullification is recorded here.
+            self.nullified_parent_notes.put(position, .{
+                .nullifier = nullifier,
+                .siloed_nullifier = siloed_nullifier,
+            }) catch unreachable;
+            break :blk self.getNote(position).side_effect_counter;
+        } else blk: {
+            const note = &self.notes.items[position - self.offset];
+            const was_nullified = !note.nullifier.is_zero();
+
+            // Assign the nullifier to it to mark it as nullified.
+            note.nullifier = nullifier;
+            note.siloed_nullifier = siloed_nullifier;
+
+            // It's no longer selectable. Positions are in order, so it can be found by binary search.
+            if (!was_nullified) {
+                const positions = self.notes_by_slot.getPtr(key(note.contract_address, note.storage_slot)).?;
+                const i = std.sort.binarySearch(u32, positions.items, position, struct {
+                    fn order(target: u32, p: u32) std.math.Order {
+                        return std.math.order(target, p);
                     }
-                }
-                break;
+                }.order).?;
+                _ = positions.orderedRemove(i);
+            }
+            break :blk note.side_effect_counter;
+        };
+
+        // If we're in the revertible phase, but nullifying a non-revertible note, we emit the nullifier.
+        if (self.min_revertible_side_effect_counter) |min_revertible_side_effect_counter| {
+            if (side_effect_counter < min_revertible_side_effect_counter) {
+                self.nullifiers.append(siloed_nullifier) catch unreachable;
             }
         }
 
@@ -142,20 +309,33 @@ pub const NoteCache = struct {
     }
 
     /// Compute all the note nonces and resulting unique hashes.
+    /// Notes frozen by a snapshot keep the nonces they had when frozen.
     pub fn finalize(self: *NoteCache, tx_hash: F) void {
-        const nonce_generator = if (self.nullifiers.items.len > 0) self.nullifiers[0] else tx_hash;
-        for (self.notes.items, 0..) |*note, i| {
+        var root: *const NoteCache = self;
+        while (root.parent) |parent| root = parent;
+        const nonce_generator = if (root.nullifiers.items.len > 0) root.nullifiers.items[0] else tx_hash;
+        for (self.notes.items, self.offset..) |*note, i| {
             note.note_nonce = poseidon.hash_array_with_generator(
-                F{ nonce_generator, F.from_int(i) },
+                [_]F{ nonce_generator, F.from_int(i) },
                 proto.constants.GeneratorIndex.note_hash_nonce,
             );
             note.unique_note_hash = poseidon.hash_array_with_generator(
-                F{ note.note_nonce, note.siloed_note_hash },
+                [_]F{ note.note_nonce, note.siloed_note_hash },
                 proto.constants.GeneratorIndex.unique_note_hash,
             );
         }
     }
 
+    // Appends the non-nullified notes of the contract and storage slot, oldest first.
+    fn collectSlotNotes(self: *const NoteCache, top: *const NoteCache, k: Key, result: *std.ArrayList(NoteData)) error{OutOfMemory}!void {
+        if (self.parent) |parent| try parent.collectSlotNotes(top, k, result);
+        const positions = self.notes_by_slot.get(k) orelse return;
+        for (positions.items) |position| {
+            if (top.isNullifiedAbove(position, self)) continue;
+            try result.append(self.notes.items[position - self.offset]);
+        }
+    }
+
     pub fn getNotes(
         self: *const NoteCache,
         allocator: std.mem.Allocator,
@@ -189,7 +369,10 @@ pub const NoteCache = struct {
         }
 
         // Apply selection filters
-        var selected_notes = try selectNotes(allocator, contract_address, storage_slot, self.notes.items, selects);
+        var slot_notes = std.ArrayList(NoteData).init(allocator);
+        defer slot_notes.deinit();
+        try self.collectSlotNotes(self, key(contract_address, storage_slot), &slot_notes);
+        var selected_notes = try selectNotes(allocator, slot_notes.items, selects);
         defer selected_notes.deinit();
 
         // Build sort criteria
@@ -244,19 +427,15 @@ pub const SortCriteria = struct {
     order: SortOrder,
 };
 
+/// Selects from the non-nullified notes of one contract and storage slot.
 fn selectNotes(
     allocator: std.mem.Allocator,
-    contract_address: proto.AztecAddress,
-    storage_slot: F,
     notes: []const NoteData,
     selects: []const SelectCriteria,
 ) !std.ArrayList(NoteData) {
     var result = std.ArrayList(NoteData).init(allocator);
 
     for (notes) |note_data| {
-        // We're only interested in non-nullified notes for the given contract and storage slot.
-        if (!(note_data.contract_address.eql(contract_address) and note_data.storage_slot.eql(storage_slot) and note_data.nullifier.is_zero())) continue;
-
         var matches = true;
         for (selects) |select| {
             const note_value = selectPropertyFromPackedNoteContent(note_data.note_fields, select.selector) catch {
@@ -305,3 +484,116 @@ fn sortNotes(notes: []NoteData, sorts: []const SortCriteria) void {
         }
     }.lessThan);
 }
+
+// The fields of the selectable notes of the contract and storage slot, in order.
+fn testSlotFields(cache: *const NoteCache, allocator: std.mem.Allocator, contract_address: proto.AztecAddress, slot: u64) ![]u256 {
+    const notes = try cache.getNotes(allocator, contract_address, F.from_int(slot), 0, &.{}, &.{}, &.{}, &.{}, &.{}, &.{}, &.{}, &.{}, &.{});
+    const fields = try allocator.alloc(u256, notes.len);
+    for (notes, fields) |note, *f| f.* = note.note_fields[0].to_int();
+    return fields;
+}
+
+fn testAddNote(cache: *NoteCache, contract_address: proto.AztecAddress, slot: u64, hash: u64, value: u64) void {
+    var fields = [_]F{F.from_int(value)};
+    cache.addNote(.{
+        .contract_address = contract_address,
+        .storage_slot = F.from_int(slot),
+        .side_effect_counter = 0,
+        .note_fields = &fields,
+        .note_hash = F.from_int(hash),
+    });
+}
+
+test "note cache indexes" {
+    var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
+    defer arena.deinit();
+    const allocator = arena.allocator();
+    const a = proto.AztecAddress.init(F.from_int(1));
+    const b = proto.AztecAddress.init(F.from_int(2));
+
+    var cache = NoteCache.init(allocator);
+    defer cache.deinit();
+    // Interleaved across contracts and slots, with two notes in a's slot 1 sharing a hash.
+    testAddNote(&cache, a, 1, 100, 10);
+    testAddNote(&cache, b, 1, 100, 20);
+    testAddNote(&cache, a, 2, 200, 30);
+    testAddNote(&cache, a, 1, 101, 11);
+    testAddNote(&cache, a, 1, 100, 12);
+    testAddNote(&cache, a, 1, 102, 13);
+    try std.testing.expectEqualSlices(u256, &.{ 10, 11, 12, 13 }, try testSlotFields(&cache, allocator, a, 1));
+    try std.testing.expectEqualSlices(u256, &.{30}, try testSlotFields(&cache, allocator, a, 2));
+    try std.testing.expectEqualSlices(u256, &.{20}, try testSlotFields(&cache, allocator, b, 1));
+
+    // Only the first note with the hash is nullified, and only in its own contract.
+    cache.nullifyNote(a, F.from_int(1000), F.from_int(100));
+    try std.testing.expectEqualSlices(u256, &.{ 11, 12, 13 }, try testSlotFields(&cache, allocator, a, 1));
+    try std.testing.expectEqualSlices(u256, &.{20}, try testSlotFields(&cache, allocator, b, 1));
+    // From the middle of the slot.
+    cache.nullifyNote(a, F.from_int(1001), F.from_int(101));
+    try std.testing.expectEqualSlices(u256, &.{ 12, 13 }, try testSlotFields(&cache, allocator, a, 1));
+    // Nullifying an already nullified note leaves the slot alone.
+    cache.nullifyNote(a, F.from_int(1002), F.from_int(101));
+    try std.testing.expectEqualSlices(u256, &.{ 12, 13 }, try testSlotFields(&cache, allocator, a, 1));
+    // The last note in a slot, and an unknown hash.
+    cache.nullifyNote(a, F.from_int(1003), F.from_int(200));
+    cache.nullifyNote(b, F.from_int(1004), F.from_int(999));
+    try std.testing.expectEqual(0, (try testSlotFields(&cache, allocator, a, 2)).len);
+    try std.testing.expectEqualSlices(u256, &.{20}, try testSlotFields(&cache, allocator, b, 1));
+    // A bare nullifier is emitted rather than assigned.
+    cache.nullifyNote(b, F.from_int(1005), F.zero);
+    try std.testing.expectEqual(1, cache.nullifiers.items.len);
+
+    try std.testing.expect(cache.getNote(0).nullifier.eql(F.from_int(1000)));
+    try std.testing.expect(cache.getNote(4).nullifier.is_zero());
+    for ([_]u64{ 1000, 1001, 1002, 1003 }) |n| {
+        try std.testing.expect(cache.hasNullifier(a, F.from_int(n)));
+        try std.testing.expect(!cache.hasNullifier(b, F.from_int(n)));
+    }
+    try std.testing.expect(cache.hasNullifier(b, F.from_int(1004)));
+    try std.testing.expect(cache.hasNullifier(b, F.from_int(1005)));
+    try std.testing.expect(!cache.hasNullifier(a, F.from_int(1005)));
+}
+
+test "note cache snapshots" {
+    var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
+    defer arena.deinit();
+    const allocator = arena.allocator();
+    const a = proto.AztecAddress.init(F.from_int(1));
+
+    var cache = NoteCache.init(allocator);
+    defer cache.deinit();
+    testAddNote(&cache, a, 1, 100, 10);
+    testAddNote(&cache, a, 1, 101, 11);
+    const frozen = try cache.snapshot();
+    defer NoteCache.release(frozen);
+
+    // Notes added since follow the frozen ones.
+    testAddNote(&cache, a, 1, 102, 12);
+    try std.testing.expectEqualSlices(u256, &.{ 10, 11, 12 }, try testSlotFields(&cache, allocator, a, 1));
+    // Nullifying a frozen note is recorded in the child, leaving the frozen note as it was.
+    cache.nullifyNote(a, F.from_int(1000), F.from_int(100));
+    try std.testing.expect(cache.nullified_parent_notes.contains(0));
+    try std.testing.expect(frozen.getNote(0).nullifier.is_zero());
+    try std.testing.expect(cache.getNote(0).nullifier.eql(F.from_int(1000)));
+    try std.testing.expectEqualSlices(u256, &.{ 11, 12 }, try testSlotFields(&cache, allocator, a, 1));
+
+    // Another layer, nullifying a note frozen in each of its parents.
+    const frozen2 = try cache.snapshot();
+    defer NoteCache.release(frozen2);
+    cache.nullifyNote(a, F.from_int(1001), F.from_int(101));
+    cache.nullifyNote(a, F.from_int(1002), F.from_int(102));
+    testAddNote(&cache, a, 1, 103, 13);
+    try std.testing.expectEqualSlices(u256, &.{13}, try testSlotFields(&cache, allocator, a, 1));
+    try std.testing.expectEqual(4, cache.noteCount());
+    for ([_]u64{ 1000, 1001, 1002 }) |n| try std.testing.expect(cache.hasNullifier(a, F.from_int(n)));
+
+    // Restoring drops everything written since the snapshot.
+    cache.restore(frozen);
+    try std.testing.expectEqualSlices(u256, &.{ 10, 11 }, try testSlotFields(&cache, allocator, a, 1));
+    try std.testing.expectEqual(2, cache.noteCount());
+    try std.testing.expect(!cache.hasNullifier(a, F.from_int(1000)));
+    cache.restore(frozen2);
+    try std.testing.expectEqualSlices(u256, &.{ 11, 12 }, try testSlotFields(&cache, allocator, a, 1));
+    try std.testing.expect(cache.hasNullifier(a, F.from_int(1000)));
+    try std.testing.expect(!cache.hasNullifier(a, F.from_int(1001)));
+}
@@ -1,9 +1,14 @@
 const std = @import("std");
 const txe = @import("./txe.zig");
+const test_runner = @import("./test_runner.zig");
 
 pub const Txe = txe.Txe;
+pub const ExecuteOptions = txe.ExecuteOptions;
+pub const runTests = test_runner.runTests;
+pub const TestOptions = test_runner.TestOptions;
 
 test {
     std.testing.refAllDecls(@This());
     _ = txe;
+    _ = test_runner;
 }
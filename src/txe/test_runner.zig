@@ -0,0 +1,121 @@
+const std = @import("std");
+const Txe = @import("txe.zig").Txe;
+const ContractStore = @import("contract_store.zig").ContractStore;
+const ThreadPool = @import("../thread/thread_pool.zig").ThreadPool;
+const runAll = @import("../thread/thread_pool.zig").runAll;
+
+pub const TestOptions = struct {
+    // Number of tests run at once. Defaults to the number of cores.
+    jobs: ?u32 = null,
+    // Only run tests whose file name contains this.
+    filter: ?[]const u8 = null,
+    show_stats: bool = false,
+};
+
+/// Runs one test artifact in its own txe, on a thread pool thread.
+const TestTask = struct {
+    contracts: *ContractStore,
+    artifact_path: []const u8,
+    result: anyerror!void = {},
+    elapsed_us: u64 = 0,
+
+    fn run(self: *TestTask, allocator: std.mem.Allocator) void {
+        var t = std.time.Timer.start() catch unreachable;
+        self.result = self.execute(allocator);
+        self.elapsed_us = t.read() / 1000;
+    }
+
+    fn execute(self: *TestTask, allocator: std.mem.Allocator) !void {
+        // A fresh state, dispatcher and mocker, so nothing leaks between tests.
+        const txe = try Txe.initShared(allocator, self.contracts, false);
+        defer txe.deinit();
+        try txe.execute(self.artifact_path, .{});
+    }
+
+    // Tests named *.fail.* pass by failing.
+    fn passed(self: *const TestTask) bool {
+        const expect_fail = std.mem.indexOf(u8, std.fs.path.basename(self.artifact_path), ".fail.") != null;
+        if (self.result) |_| return !expect_fail else |_| return expect_fail;
+    }
+};
+
+/// Runs each test artifact (.json) of the directory, as dumped by nargo, in its own txe, concurrently.
+/// Contracts are parsed and their programs decoded once, then shared read only by every test that deploys them.
+/// Returns error.TestsFailed if any test didn't pass.
+pub fn runTests(
+    allocator: std.mem.Allocator,
+    contract_artifacts_path: []const u8,
+    tests_path: []const u8,
+    options: TestOptions,
+) !void {
+    const artifact_paths = try loadTestPaths(allocator, tests_path, options.filter);
+    std.debug.print("Running {} tests.\n", .{artifact_paths.len});
+    if (artifact_paths.len == 0) return;
+
+    // The store is shared by every worker, so needs a thread safe allocator.
+    var store_allocator = std.heap.ThreadSafeAllocator{ .child_allocator = allocator };
+    const contracts = try ContractStore.init(store_allocator.allocator(), contract_artifacts_path);
+    defer contracts.deinit();
+
+    const jobs = options.jobs orelse @min(try std.Thread.getCpuCount(), 64);
+    var pool = ThreadPool.init(.{ .max_threads = jobs });
+    defer {
+        pool.shutdown();
+        pool.deinit();
+    }
+
+    var t = try std.time.Timer.start();
+    const tasks = try allocator.alloc(TestTask, artifact_paths.len);
+    for (tasks, artifact_paths) |*task, path| {
+        task.* = .{
+            .contracts = contracts,
+            .artifact_path = path,
+        };
+    }
+    try runAll(allocator, &pool, TestTask, tasks, TestTask.run);
+    const elapsed_us = t.read() / 1000;
+
+    var num_failed: usize = 0;
+    std.debug.print("\nTest results:\n", .{});
+    for (tasks) |*task| {
+        const passed = task.passed();
+        if (!passed) num_failed += 1;
+        std.debug.print("  {s} {s} ({}us)", .{
+            if (passed) "PASS" else "FAIL",
+            std.fs.path.stem(task.artifact_path),
+            task.elapsed_us,
+        });
+        if (task.result) |_| {
+            std.debug.print("\n", .{});
+        } else |err| {
+            std.debug.print(": {}\n", .{err});
+        }
+    }
+    std.debug.print("Ran {} tests ({} failed) on {} threads in {}us.\n", .{
+        tasks.len,
+        num_failed,
+        jobs,
+        elapsed_us,
+    });
+    if (options.show_stats) contracts.dump();
+    if (num_failed > 0) return error.TestsFailed;
+}
+
+/// Returns the test artifacts of a directory, in name order.
+fn loadTestPaths(allocator: std.mem.Allocator, path: []const u8, filter: ?[]const u8) ![][]const u8 {
+    var paths = std.ArrayList([]const u8).init(allocator);
+    var dir = try std.fs.cwd().openDir(path, .{ .iterate = true });
+    defer dir.close();
+    var it = dir.iterate();
+    while (try it.next()) |entry| {
+        if (entry.kind != .file or !std.mem.endsWith(u8, entry.name, ".json")) continue;
+        if (filter) |f| if (std.mem.indexOf(u8, entry.name, f) == null) continue;
+        try paths.append(try std.fs.path.join(allocator, &.{ path, entry.name }));
+    }
+    std.mem.sort([]const u8, paths.items, {}, struct {
+        fn lessThan(_: void, a: []const u8, b: []const u8) bool {
+            return std.mem.lessThan(u8, a, b);
+        }
+    }.lessThan);
+    return paths.toOwnedSlice();
+}
@@ -11,23 +11,45 @@ const CallState = @import("call_state.zig").CallState;
 const DebugMode = @import("../bvm/debug_context.zig").DebugMode;
 const TxeDebugContext = @import("txe_debug_context.zig").TxeDebugContext;
 const TxeState = @import("txe_state.zig").TxeState;
+const ContractStore = @import("contract_store.zig").ContractStore;
 
 pub const ExecuteOptions = struct {
     calldata_path: ?[]const u8 = null,
     show_stats: bool = false,
+    // If set, the brillig and foreign call stats are written here as json.
+    stats_json_path: ?[]const u8 = null,
     show_trace: bool = false,
+    // If set, the top level vm's foreign calls and their results are logged here.
+    record_path: ?[]const u8 = null,
+    // If set, the top level vm's foreign calls are served from this log, rather than by the txe.
+    replay_path: ?[]const u8 = null,
 };
 
 pub const Txe = struct {
     allocator: std.mem.Allocator,
+    contracts: *ContractStore,
+    // False if the contract store is shared with other txes.
+    owns_contracts: bool,
     txe_state: TxeState,
     txe_debug_ctx: ?*TxeDebugContext = null,
     txe_impl: TxeImpl,
     txe_dispatcher: TxeDispatcher,
 
     pub fn init(allocator: std.mem.Allocator, contract_artifacts_path: []const u8, debug: bool) !*Txe {
+        const contracts = try ContractStore.init(allocator, contract_artifacts_path);
+        errdefer contracts.deinit();
+        const txe = try initShared(allocator, contracts, debug);
+        txe.owns_contracts = true;
+        return txe;
+    }
+
+    /// A txe with its own state, dispatcher and mocker, that deploys contracts from a store it doesn't own.
+    /// Any number of txes may share a store, on any threads, given the store's allocator is thread safe.
+    pub fn initShared(allocator: std.mem.Allocator, contracts: *ContractStore, debug: bool) !*Txe {
         const txe = try allocator.create(Txe);
         txe.allocator = allocator;
+        txe.contracts = contracts;
+        txe.owns_contracts = false;
         txe.txe_state = try TxeState.init(allocator);
         txe.txe_debug_ctx = null;
         if (debug) {
@@ -35,7 +57,7 @@ pub const Txe = struct {
         }
         txe.txe_impl = try TxeImpl.init(
             allocator,
-            contract_artifacts_path,
+            contracts,
             &txe.txe_state,
             txe.txe_debug_ctx,
         );
@@ -52,6 +74,7 @@ pub const Txe = struct {
         self.txe_impl.deinit();
         if (self.txe_debug_ctx) |ctx| ctx.deinit();
         self.txe_state.deinit();
+        if (self.owns_contracts) self.contracts.deinit();
         self.allocator.destroy(self);
     }
 
@@ -60,9 +83,9 @@ pub const Txe = struct {
         var calldata: []F = &[_]F{};
 
         // Load the bytecode from the artifact, and calldata from Prover.toml (unless overridden).
-        const artifact = try nargo_artifact.ArtifactAbi.load(self.allocator, artifact_path);
-        const bytecode = try artifact.getBytecode(self.allocator);
-        const program = try cvm.io.deserialize(self.allocator, bytecode);
+        const loaded = try self.contracts.program_cache.loadArtifact(self.allocator, artifact_path);
+        const artifact = loaded.artifact;
+        const program = loaded.program;
 
         if (options.calldata_path) |path| {
             calldata = try nargo.calldata.loadCalldataFromProverToml(self.allocator, &artifact, path);
@@ -77,6 +100,20 @@ pub const Txe = struct {
             ctx.onVmEnter(try artifact.getDebugInfo(self.allocator), display_name);
         }
 
+        // Nested vms always call the txe, so only the top level vm's calls are logged or replayed.
+        var recorder: ?bvm.foreign_call.OracleRecorder = null;
+        defer if (recorder) |*r| r.deinit();
+        var replayer: ?bvm.foreign_call.OracleReplayer = null;
+        defer if (replayer) |*r| r.deinit();
+        var fc_dispatcher = self.txe_dispatcher.fcDispatcher();
+        if (options.replay_path) |path| {
+            replayer = try bvm.foreign_call.OracleReplayer.init(self.allocator, path);
+            fc_dispatcher = replayer.?.fcDispatcher();
+        } else if (options.record_path) |path| {
+            recorder = try bvm.foreign_call.OracleRecorder.init(self.allocator, path, fc_dispatcher);
+            fc_dispatcher = recorder.?.fcDispatcher();
+        }
+
         // Create and init circuit VM.
         var t = try std.time.Timer.start();
         std.debug.print("Initing...\n", .{});
@@ -84,16 +121,40 @@ pub const Txe = struct {
             self.allocator,
             &program,
             calldata,
-            self.txe_dispatcher.fcDispatcher(),
+            fc_dispatcher,
             if (self.txe_debug_ctx) |ctx| ctx.brilligVmHooks() else null,
+            self.txe_impl.memory_pool,
         );
         defer circuit_vm.deinit();
+        var brillig_stats = bvm.brillig_vm.Stats{};
+        var fc_stats = bvm.foreign_call.ForeignCallStats.init(self.allocator);
+        defer fc_stats.deinit();
+        if (options.show_stats or options.stats_json_path != null) {
+            self.txe_impl.brillig_stats = &brillig_stats;
+            circuit_vm.brillig_stats = &brillig_stats;
+            self.txe_dispatcher.stats = &fc_stats;
+        }
+        defer self.txe_impl.brillig_stats = null;
+        defer self.txe_dispatcher.stats = null;
         std.debug.print("Init time: {}us\n", .{t.read() / 1000});
 
         // Execute.
         std.debug.print("Executing...\n", .{});
         t.reset();
-        defer std.debug.print("time taken: {}us\n", .{t.read() / 1000});
+        defer {
+            std.debug.print("time taken: {}us\n", .{t.read() / 1000});
+            if (options.show_stats) {
+                brillig_stats.dump();
+                fc_stats.dump();
+                self.txe_impl.key_cache.dump();
+                self.contracts.dump();
+            }
+            if (options.stats_json_path) |path| {
+                fc_stats.writeJsonFile(path, &brillig_stats) catch |err| {
+                    std.debug.print("Failed to write stats to {s}: {}\n", .{ path, err });
+                };
+            }
+        }
         circuit_vm.executeVm(0) catch |err| {
             if (circuit_vm.brillig_error_context != null) {
                 self.txe_state.vm_state_stack.items[0].execution_error = circuit_vm.brillig_error_context;
@@ -106,6 +167,7 @@ pub const Txe = struct {
         if (self.txe_debug_ctx) |ctx| {
             ctx.onVmExit();
         }
+        if (replayer) |*r| try r.finish();
     }
 
     fn dumpStackTrace(self: *Txe, artifact: *const nargo.ArtifactAbi) !void {
@@ -132,8 +194,8 @@ pub const Txe = struct {
                 const f = try abi.getFunctionBySelector(state.function_selector);
                 std.debug.print("    Function name: {s}\n", .{f.name});
 
-                // Return the debug info for this function, passing the contract's file_map
-                debug_info = try f.getDebugInfo(self.allocator, abi.file_map);
+                // Return the debug info for this function, loading the contract's debug sections if needed.
+                debug_info = try self.contracts.getFunctionDebugInfo(abi, &f);
             } else {
                 // Top-level execution.
                 debug_info = try artifact.getDebugInfo(self.allocator);
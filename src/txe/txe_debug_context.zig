@@ -292,7 +292,8 @@ pub const TxeDebugContext = struct {
                             }
                         },
                         .notes => {
-                            for (state.note_cache.notes.items, 0..) |note, index| {
+                            for (0..state.note_cache.noteCount()) |index| {
+                                const note = state.note_cache.getNote(@intCast(index));
                                 const name = try std.fmt.allocPrint(allocator, "[{}]", .{index});
                                 const value_str = try std.fmt.allocPrint(allocator, "Note at slot {}", .{note.storage_slot});
 
@@ -311,7 +312,7 @@ pub const TxeDebugContext = struct {
                                 });
                             }
                             // If no notes were found, show a message
-                            if (state.note_cache.notes.items.len == 0) {
+                            if (state.note_cache.noteCount() == 0) {
                                 try variables.append(.{
                                     .name = "(empty)",
                                     .value = "No notes in cache",
@@ -330,8 +331,8 @@ pub const TxeDebugContext = struct {
                     const state = self.txe_state.vm_state_stack.items[@intCast(display_index)];
 
                     // Find the note by index
-                    if (note_index < state.note_cache.notes.items.len) {
-                        const note = state.note_cache.notes.items[note_index];
+                    if (note_index < state.note_cache.noteCount()) {
+                        const note = state.note_cache.getNote(@intCast(note_index));
                         // Found the note - show its fields
                         try variables.append(.{
                             .name = "contract_address",
@@ -429,7 +430,7 @@ pub const TxeDebugContext = struct {
 
         // Notes list (expandable) - only show if there are actually notes
         // We need to check if the cache actually has notes
-        const actual_note_count = state.note_cache.notes.items.len;
+        const actual_note_count = state.note_cache.noteCount();
 
         if (actual_note_count > 0) {
             const notes_ref = try self.allocateRef(.{
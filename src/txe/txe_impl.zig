@@ -10,6 +10,8 @@ const call_state = @import("call_state.zig");
 const TxeState = @import("txe_state.zig").TxeState;
 const TxeDispatcher = @import("dispatcher.zig").TxeDispatcher;
 const TxeDebugContext = @import("txe_debug_context.zig").TxeDebugContext;
+const ContractStore = @import("contract_store.zig").ContractStore;
+const KeyCache = @import("key_cache.zig").KeyCache;
 
 const constants = proto.constants;
 
@@ -265,95 +267,20 @@ const PrivateCircuitPublicInputs = struct {
 pub fn BoundedVec(comptime T: type) type {
     return struct {
         items: []const T,
-        allocator: std.mem.Allocator,
         max_size: usize, // Runtime max size
         element_size: usize, // Number of fields per element when flattened
 
-        pub fn toForeignCallParams(self: @This()) [2]bvm.foreign_call.ForeignCallParam {
-            std.debug.print("BoundedVec.toForeignCallParams called with {} items\n", .{self.items.len});
-            // BoundedVec is always serialized as 2 params: [flattened_data, length]
-            var result: [2]bvm.foreign_call.ForeignCallParam = undefined;
-
-            // First param: flattened array of all data
-            var flattened = std.ArrayList(bvm.foreign_call.ForeignCallParam).init(self.allocator);
-
-            // Convert each item to ForeignCallParams and flatten
-            for (self.items) |item| {
-                if (@hasDecl(T, "toForeignCallParam")) {
-                    const param = item.toForeignCallParam(self.allocator) catch unreachable;
-                    switch (param) {
-                        .Single => flattened.append(param) catch unreachable,
-                        .Array => {
-                            // Flatten nested arrays
-                            for (param.Array) |elem| {
-                                switch (elem) {
-                                    .Single => flattened.append(elem) catch unreachable,
-                                    .Array => unreachable, // Shouldn't have deeply nested arrays here
-                                }
-                            }
-                        },
-                    }
-                } else {
-                    // For simple types, just convert directly
-                    const params = bvm.foreign_call.marshal.structToForeignCallParams(self.allocator, item) catch unreachable;
-                    for (params) |param| {
-                        switch (param) {
-                            .Single => flattened.append(param) catch unreachable,
-                            .Array => {
-                                for (param.Array) |elem| {
-                                    flattened.append(elem) catch unreachable;
-                                }
-                            },
-                        }
-                    }
-                }
-            }
-
-            // Pad the array to max_size * element_size
-            const total_expected_size = self.max_size * self.element_size;
-            const current_size = flattened.items.len;
-
-            if (current_size < total_expected_size) {
-                // Add padding with zeros
-                var i = current_size;
-                while (i < total_expected_size) : (i += 1) {
-                    flattened.append(.{ .Single = 0 }) catch unreachable;
-                }
-            }
-
-            result[0] = .{ .Array = flattened.toOwnedSlice() catch unreachable };
-
-            // Second param: actual length of the bounded vector (number of items, not flattened size)
-            result[1] = .{ .Single = self.items.len };
-
-            return result;
+        pub fn writeOutput(self: @This(), out: anytype) void {
+            // The items are written straight into the array destination, then padded with zeros.
+            var data = out.array(self.max_size * self.element_size);
+            for (self.items) |item| data.write(item);
+            data.pad();
+            // The actual length of the bounded vector (number of items, not flattened size)
+            out.write(self.items.len);
         }
     };
 }
 
-/// Computes a fast hash (SHA-1) of a file at the given path.
-/// Returns the hash as a hex string.
-// pub fn fastHashFile(allocator: std.mem.Allocator, path: []const u8) ![]u8 {
-//     var file = try std.fs.cwd().openFile(path, .{});
-//     defer file.close();
-
-//     // TODO: SHA1 is considered cryptographically broken?
-//     var sha1 = std.crypto.hash.Sha1.init(.{});
-//     var buf: [4096]u8 = undefined;
-
-//     while (true) {
-//         const n = try file.read(&buf);
-//         if (n == 0) break;
-//         sha1.update(buf[0..n]);
-//     }
-
-//     var digest: [std.crypto.hash.Sha1.digest_length]u8 = undefined;
-//     sha1.final(&digest);
-
-//     // Convert digest to hex string
-//     return std.fmt.allocPrint(allocator, "{s}", .{std.fmt.fmtSliceHexLower(&digest)});
-// }
-
 pub const TxeImpl = struct {
     allocator: std.mem.Allocator,
     // Foreign call handler. Set by caller to circular reference.
@@ -361,60 +288,56 @@ pub const TxeImpl = struct {
     // Random number generator.
     prng: *std.Random.DefaultPrng,
     state: *TxeState,
-    contract_artifacts_path: []const u8,
+    // Contract artifacts and their decoded programs, possibly shared with other TXEs.
+    contracts: *ContractStore,
     txe_debug_ctx: ?*TxeDebugContext = null,
+    // Brillig memories shared by every circuit vm we execute, including nested calls.
+    memory_pool: *bvm.MemoryPool,
+    // The empty state, whose notes, nullifiers and root call state reset returns to.
+    reset_snapshot: TxeState.Snapshot,
+    // If set, brillig stats from every circuit vm we execute are accumulated here.
+    brillig_stats: ?*bvm.brillig_vm.Stats = null,
+    // Keys derived from account secrets. Outlives resets, as derivations never change.
+    key_cache: KeyCache,
 
     pub fn init(
         allocator: std.mem.Allocator,
-        contract_artifacts_path: []const u8,
+        contracts: *ContractStore,
         state: *TxeState,
         txe_debug_ctx: ?*TxeDebugContext,
     ) !TxeImpl {
         const prng = try allocator.create(std.Random.DefaultPrng);
         prng.* = std.Random.DefaultPrng.init(12345);
+        const memory_pool = try allocator.create(bvm.MemoryPool);
+        memory_pool.* = bvm.BrilligVm.initMemoryPool(allocator, .flat);
+        const reset_snapshot = try state.snapshot();
 
         return TxeImpl{
             .allocator = allocator,
             .prng = prng,
             .state = state,
-            .contract_artifacts_path = contract_artifacts_path,
+            .contracts = contracts,
             .txe_debug_ctx = txe_debug_ctx,
+            .memory_pool = memory_pool,
+            .reset_snapshot = reset_snapshot,
+            .key_cache = KeyCache.init(allocator, 1024),
         };
     }
 
     pub fn deinit(self: *TxeImpl) void {
         self.allocator.destroy(self.prng);
+        self.memory_pool.deinit();
+        self.allocator.destroy(self.memory_pool);
+        self.reset_snapshot.deinit(self.allocator);
+        self.key_cache.deinit();
     }
 
     pub fn reset(self: *TxeImpl, _: std.mem.Allocator) !void {
         std.debug.print("reset called!\n", .{});
 
-        // Clear the note cache
-        self.state.note_cache.notes.clearRetainingCapacity();
-        self.state.note_cache.nullifiers.clearRetainingCapacity();
-        self.state.note_cache.side_effect_counter = 0;
-        self.state.note_cache.min_revertible_side_effect_counter = null;
-
-        // Clear the VM state stack (except the first one)
-        while (self.state.vm_state_stack.items.len > 1) {
-            const state = self.state.vm_state_stack.pop();
-            if (state) |s| {
-                s.deinit();
-                self.allocator.destroy(s);
-            }
-        }
-
-        // Reset the initial state
-        const initial_state = self.state.vm_state_stack.items[0];
-        initial_state.contract_address = proto.AztecAddress.zero;
-        initial_state.msg_sender = proto.AztecAddress.init(F.max);
-        initial_state.function_selector = 0;
-        initial_state.is_static_call = false;
-        initial_state.side_effect_counter = 0;
-        initial_state.public_nullifiers.clearRetainingCapacity();
-        initial_state.private_logs.clearRetainingCapacity();
-        initial_state.capsule_storage.clearRetainingCapacity();
-        initial_state.execution_cache.clearRetainingCapacity();
+        // Clears the VM state stack (except the first one), and drops the notes, nullifiers and root call state.
+        // Accounts, contracts, and the block number and timestamp are kept.
+        try self.state.rollback(&self.reset_snapshot);
 
         std.debug.print("reset: cleared note cache and reset state\n", .{});
     }
@@ -427,7 +350,7 @@ pub const TxeImpl = struct {
 
         // TODO: Why do we use the secret for both args here?
         // TS code unhelpfully just says "Footgun!"...
-        const complete_address = proto.CompleteAddress.fromSecretKeyAndPartialAddress(
+        const complete_address = try self.key_cache.completeAddress(
             secret,
             proto.PartialAddress.init(secret),
         );
@@ -471,16 +394,12 @@ pub const TxeImpl = struct {
             secret,
         });
 
-        const public_keys = if (secret.is_zero()) proto.PublicKeys.default() else proto.deriveKeys(secret).public_keys;
+        const public_keys = if (secret.is_zero()) proto.PublicKeys.default() else (try self.key_cache.deriveKeys(secret)).public_keys;
         const public_keys_hash = public_keys.hash();
         _ = public_keys_hash;
 
-        const contract_path = try std.fmt.allocPrint(tmp_allocator, "{s}/{s}.json", .{
-            self.contract_artifacts_path,
-            contract_name,
-        });
-        // Note use of long lived allocator as we will cache it.
-        const contract_abi = try ContractAbi.load(self.allocator, contract_path);
+        // Parsed and decoded once, then shared with every other deployment of the contract.
+        const contract_abi = try self.contracts.load(tmp_allocator, contract_name);
         const contract_instance = proto.ContractInstance.fromDeployParams(tmp_allocator, contract_abi, .{
             .constructor_name = initializer,
             .constructor_args = args,
@@ -634,7 +553,7 @@ pub const TxeImpl = struct {
         child_state.side_effect_counter = side_effect_counter;
 
         // Retrieve the function to execute from the target contract's ABI.
-        const contract_instance = self.state.contract_instance_cache.get(target_contract_address) orelse {
+        const contract_instance = self.state.contract_instance_cache.getPtr(target_contract_address) orelse {
             std.debug.print("Contract instance not found for address: {x}\n", .{target_contract_address});
             return error.ContractInstanceNotFound;
         };
@@ -677,17 +596,19 @@ pub const TxeImpl = struct {
             try calldata.append(arg);
         }
 
-        const program = try cvm.deserialize(allocator, try function.getBytecode(allocator));
+        const program = try self.contracts.getFunctionProgram(&contract_instance.abi, &function);
 
         // Create nested circuit vm.
         var circuit_vm = try cvm.CircuitVm.init(
             allocator,
-            &program,
+            program,
             calldata.items,
             self.fc_handler.fcDispatcher(),
             if (self.txe_debug_ctx) |ctx| ctx.brilligVmHooks() else null,
+            self.memory_pool,
         );
         defer circuit_vm.deinit();
+        circuit_vm.brillig_stats = self.brillig_stats;
 
         // Push vm details onto the debug context if available.
         if (self.txe_debug_ctx) |ctx| {
@@ -695,7 +616,7 @@ pub const TxeImpl = struct {
                 contract_instance.abi.name,
                 function.name,
             });
-            const debug_info = try function.getDebugInfo(allocator, contract_instance.abi.file_map);
+            const debug_info = try self.contracts.getFunctionDebugInfo(&contract_instance.abi, &function);
             ctx.onVmEnter(debug_info, display_name);
         }
 
@@ -837,13 +758,13 @@ pub const TxeImpl = struct {
         _: std.mem.Allocator,
         msg: []const u8,
         _: F,
-        fields: []F,
+        fields: bvm.foreign_call.MemorySlice,
     ) !void {
         std.debug.print("Debug Log: {s}\n", .{msg});
         if (fields.len > 0) {
             std.debug.print("Fields: ", .{});
-            for (fields) |field| {
-                std.debug.print("{x} ", .{field});
+            for (0..fields.len) |i| {
+                std.debug.print("{x} ", .{fields.getField(i)});
             }
             std.debug.print("\n", .{});
         }
@@ -954,7 +875,7 @@ pub const TxeImpl = struct {
         var it = self.state.accounts.iterator();
         while (it.next()) |entry| {
             const complete_address = entry.value_ptr.*;
-            const keys = proto.deriveKeys(complete_address.partial_address.value);
+            const keys = try self.key_cache.deriveKeys(complete_address.partial_address.value);
 
             // Determine which key type based on key_index
             // From the Noir code: NULLIFIER_INDEX = 0, OUTGOING_INDEX = 1
@@ -995,9 +916,8 @@ pub const TxeImpl = struct {
 
             if (pk_m_hash_computed.eql(pk_m_hash)) {
                 // Found the matching key, compute sk_app
-                const computeAppSecretKey = @import("../protocol/key_derivation.zig").computeAppSecretKey;
                 const current_state = self.state.getCurrentState();
-                const sk_app = computeAppSecretKey(sk_m, current_state.contract_address, key_prefix);
+                const sk_app = try self.key_cache.computeAppSecretKey(sk_m, current_state.contract_address, key_prefix);
 
                 std.debug.print("Found matching key for account {x}, key index: {}, sk_app: {x}\n", .{
                     complete_address.aztec_address,
@@ -1047,7 +967,7 @@ pub const TxeImpl = struct {
         child_state.side_effect_counter = current_state.side_effect_counter;
 
         // Retrieve the function to execute from the target contract's ABI.
-        const contract_instance = self.state.contract_instance_cache.get(target_contract_address) orelse {
+        const contract_instance = self.state.contract_instance_cache.getPtr(target_contract_address) orelse {
             return error.ContractInstanceNotFound;
         };
 
@@ -1072,23 +992,25 @@ pub const TxeImpl = struct {
             return error.ArgsNotFound;
         };
 
-        const program = try cvm.deserialize(allocator, try function.getBytecode(allocator));
+        const program = try self.contracts.getFunctionProgram(&contract_instance.abi, &function);
 
         // Execute utility function in nested circuit vm.
         var circuit_vm = try cvm.CircuitVm.init(
             allocator,
-            &program,
+            program,
             calldata,
             self.fc_handler.fcDispatcher(),
             if (self.txe_debug_ctx) |ctx| ctx.brilligVmHooks() else null,
+            self.memory_pool,
         );
+        circuit_vm.brillig_stats = self.brillig_stats;
 
         if (self.txe_debug_ctx) |ctx| {
             const display_name = try std.fmt.allocPrint(allocator, "{s}:{s}", .{
                 contract_instance.abi.name,
                 function.name,
             });
-            const debug_info = try function.getDebugInfo(allocator, contract_instance.abi.file_map);
+            const debug_info = try self.contracts.getFunctionDebugInfo(&contract_instance.abi, &function);
             ctx.onVmEnter(debug_info, display_name);
         }
 
@@ -1222,7 +1144,6 @@ pub const TxeImpl = struct {
 
         return BoundedVec(RetrievedNoteWithMetadata){
             .items = result,
-            .allocator = allocator,
             .max_size = max_notes,
             .element_size = packed_retrieved_note_length,
         };
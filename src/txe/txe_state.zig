@@ -34,6 +34,18 @@ pub const TxeState = struct {
 
     sender_for_tags: ?proto.AztecAddress,
 
+    /// The notes, nullifiers and root call state when the snapshot was taken.
+    /// The note cache is frozen rather than copied, and shared with the state.
+    pub const Snapshot = struct {
+        note_cache: *NoteCache,
+        initial_state: call_state.CallState.Snapshot,
+
+        pub fn deinit(self: *Snapshot, allocator: std.mem.Allocator) void {
+            NoteCache.release(self.note_cache);
+            self.initial_state.deinit(allocator);
+        }
+    };
+
     pub fn init(allocator: std.mem.Allocator) !TxeState {
         // Create global state components
         const contract_artifact_cache = try allocator.create(std.AutoHashMap(F, ContractAbi));
@@ -92,6 +104,31 @@ pub const TxeState = struct {
         self.allocator.destroy(self.accounts);
     }
 
+    /// Freezes the notes and root call state, so they can later be rolled back to.
+    pub fn snapshot(self: *TxeState) !Snapshot {
+        // Nested call states reference their parents, and are transient.
+        if (self.vm_state_stack.items.len > 1) return error.SnapshotDuringCall;
+
+        var initial_state = try self.vm_state_stack.items[0].snapshot(self.allocator);
+        errdefer initial_state.deinit(self.allocator);
+        return .{
+            .note_cache = try self.note_cache.snapshot(),
+            .initial_state = initial_state,
+        };
+    }
+
+    /// Returns the notes, nullifiers and root call state to the snapshot, in time proportional to what's been
+    /// written since, discarding any nested call states. Accounts, contracts, and the block and chain data are kept.
+    pub fn rollback(self: *TxeState, snap: *const Snapshot) !void {
+        while (self.vm_state_stack.items.len > 1) {
+            const state = self.popState();
+            state.deinit();
+            self.allocator.destroy(state);
+        }
+        try self.vm_state_stack.items[0].restore(&snap.initial_state);
+        self.note_cache.restore(snap.note_cache);
+    }
+
     /// Get the current (top) call state
     pub fn getCurrentState(self: *TxeState) *call_state.CallState {
         // The current state is always the last one on the stack
@@ -108,3 +145,53 @@ pub const TxeState = struct {
         return self.vm_state_stack.pop() orelse unreachable;
     }
 };
+
+test "txe state rollback" {
+    var arena = std.heap.ArenaAllocator.init(std.heap.page_allocator);
+    defer arena.deinit();
+    const allocator = arena.allocator();
+    const account = struct {
+        fn f(address: u64) proto.CompleteAddress {
+            return .{
+                .aztec_address = proto.AztecAddress.init(F.from_int(address)),
+                .public_keys = proto.PublicKeys.default(),
+                .partial_address = proto.PartialAddress.init(F.from_int(address)),
+            };
+        }
+    }.f;
+    const alice = account(1);
+    const bob = account(2);
+    var fields = [_]F{F.one};
+    const note = @import("note_cache.zig").NoteData{
+        .contract_address = alice.aztec_address,
+        .storage_slot = F.one,
+        .side_effect_counter = 0,
+        .note_fields = &fields,
+        .note_hash = F.from_int(100),
+    };
+
+    var state = try TxeState.init(allocator);
+    defer state.deinit();
+    try state.accounts.put(alice.aztec_address, alice);
+    state.note_cache.addNote(note);
+    state.block_number = 1;
+    var snap = try state.snapshot();
+    defer snap.deinit(allocator);
+
+    try state.accounts.put(bob.aztec_address, bob);
+    state.note_cache.addNote(note);
+    state.note_cache.nullifyNote(alice.aztec_address, F.from_int(1000), F.from_int(100));
+    state.block_number = 2;
+    state.getCurrentState().contract_address = alice.aztec_address;
+    try state.pushState(try state.getCurrentState().createChild(allocator, bob.aztec_address, 0, false));
+
+    // Side effects and calls are dropped, but accounts and block data are kept.
+    try state.rollback(&snap);
+    try std.testing.expectEqual(1, state.vm_state_stack.items.len);
+    try std.testing.expect(state.getCurrentState().contract_address.eql(proto.AztecAddress.zero));
+    try std.testing.expectEqual(1, state.note_cache.noteCount());
+    try std.testing.expect(state.note_cache.getNote(0).nullifier.is_zero());
+    try std.testing.expect(!state.note_cache.hasNullifier(alice.aztec_address, F.from_int(1000)));
+    try std.testing.expect(state.accounts.contains(bob.aztec_address));
+    try std.testing.expectEqual(2, state.block_number);
+}
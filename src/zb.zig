@@ -11,7 +11,8 @@ const F = @import("./bn254/fr.zig").Fr;
 const App = @import("yazap").App;
 const Arg = @import("yazap").Arg;
 const ArgMatches = @import("yazap").ArgMatches;
-const Txe = @import("./txe/package.zig").Txe;
+const txe_pkg = @import("./txe/package.zig");
+const Txe = txe_pkg.Txe;
 const debug = @import("./debug/package.zig");
 
 pub fn main() !void {
@@ -41,12 +42,17 @@ pub fn main() !void {
 
     {
         var txe_cmd = app.createCommand("txe", "Run the given artifact within the Txe.");
-        try txe_cmd.addArg(Arg.positional("artifact_path", "Path to file containing nargo json contract artifact.", null));
+        try txe_cmd.addArg(Arg.positional("artifact_path", "Path to file containing nargo json contract artifact, or a directory of test artifacts to run in parallel.", null));
         try txe_cmd.addArg(Arg.singleValueOption("calldata_path", 'c', "Path to toml containing calldata (default: Prover.toml)."));
         try txe_cmd.addArg(Arg.booleanOption("stats", 's', "Display execution stats after run."));
+        try txe_cmd.addArg(Arg.singleValueOption("stats-json", null, "Path to write execution stats to as json."));
+        try txe_cmd.addArg(Arg.singleValueOption("record", null, "Path to log foreign calls and their results to."));
+        try txe_cmd.addArg(Arg.singleValueOption("replay", null, "Path of a log to serve foreign calls from, rather than the txe."));
         try txe_cmd.addArg(Arg.booleanOption("trace", 't', "Display execution trace during run."));
         try txe_cmd.addArg(Arg.booleanOption("debug", 'd', "Launch interactive debugger."));
         try txe_cmd.addArg(Arg.booleanOption("debug-dap", null, "Enable DAP debugging mode for VSCode."));
+        try txe_cmd.addArg(Arg.singleValueOption("jobs", 'j', "Number of tests to run at once, given a directory (default: number of cores)."));
+        try txe_cmd.addArg(Arg.singleValueOption("filter", null, "Only run tests whose name contains this, given a directory."));
         txe_cmd.setProperty(.help_on_empty_args);
 
         try root.addSubcommand(txe_cmd);
@@ -67,11 +73,21 @@ pub fn main() !void {
         try run_cmd.addArg(Arg.singleValueOption("witness_path", 'w', "Path to to write output witness data."));
         try run_cmd.addArg(Arg.singleValueOption("bytecode_path", 'b', "Path to file containing raw bytecode."));
         try run_cmd.addArg(Arg.singleValueOption("calldata_path", 'c', "Path to toml file containing calldata."));
+        try run_cmd.addArg(Arg.singleValueOption("batch_path", null, "Directory of calldata toml files, or manifest listing them, to run in one process."));
         try run_cmd.addArg(Arg.booleanOption("stats", 's', "Display execution stats after run."));
+        try run_cmd.addArg(Arg.singleValueOption("stats-json", null, "Path to write execution stats to as json."));
         try run_cmd.addArg(Arg.booleanOption("trace", 't', "Display execution trace during run."));
         try run_cmd.addArg(Arg.booleanOption("debug", 'd', "Step through execution by source line."));
         try run_cmd.addArg(Arg.booleanOption("debug-dap", null, "Enable DAP debugging mode for VSCode."));
         try run_cmd.addArg(Arg.booleanOption("binary", 'b', "Output the witness as binary."));
+        try run_cmd.addArg(Arg.booleanOption("compact-memory", null, "Use the compact brillig memory layout."));
+        try run_cmd.addArg(Arg.booleanOption("fuse", null, "Fuse hot brillig opcode pairs after a training call."));
+        try run_cmd.addArg(Arg.booleanOption("memoise", null, "Reuse results of brillig calls without foreign calls."));
+        try run_cmd.addArg(Arg.booleanOption("parallel", null, "Solve independent expensive blackboxes in parallel."));
+        try run_cmd.addArg(Arg.booleanOption("raw", null, "Write the witness file uncompressed."));
+        try run_cmd.addArg(Arg.booleanOption("no-cache", null, "Don't use the on-disk program cache."));
+        try run_cmd.addArg(Arg.singleValueOption("record", null, "Path to log foreign calls and their results to."));
+        try run_cmd.addArg(Arg.singleValueOption("replay", null, "Path of a log to serve foreign calls from."));
         // run_cmd.setProperty(.help_on_empty_args);
 
         var dis_cmd = app.createCommand("dis", "Disassemble the given bytecode.");
@@ -248,14 +264,36 @@ fn handleTxe(cmd_matches: ArgMatches) !void {
         }
     }
 
+    // A directory of tests, each run in its own txe.
+    const artifact_path = cmd_matches.getSingleValue("artifact_path").?;
+    const is_dir = if (std.fs.cwd().statFile(artifact_path)) |stat| stat.kind == .directory else |_| false;
+    if (is_dir) {
+        const jobs = if (cmd_matches.getSingleValue("jobs")) |j| try std.fmt.parseInt(u32, j, 10) else null;
+        txe_pkg.runTests(allocator, "data/contracts", artifact_path, .{
+            .jobs = jobs,
+            .filter = cmd_matches.getSingleValue("filter"),
+            .show_stats = cmd_matches.containsArg("stats"),
+        }) catch |err| {
+            std.debug.print("{}\n", .{err});
+            std.posix.exit(switch (err) {
+                error.TestsFailed => 2,
+                else => 1,
+            });
+        };
+        return;
+    }
+
     // Normal execution (no debug mode)
     const txe = try Txe.init(allocator, "data/contracts", cmd_matches.containsArg("debug-dap"));
     defer txe.deinit();
 
-    txe.execute(cmd_matches.getSingleValue("artifact_path").?, .{
+    txe.execute(artifact_path, .{
         .calldata_path = cmd_matches.getSingleValue("calldata_path"),
         .show_stats = cmd_matches.containsArg("stats"),
+        .stats_json_path = cmd_matches.getSingleValue("stats-json"),
         .show_trace = cmd_matches.containsArg("trace"),
+        .record_path = cmd_matches.getSingleValue("record"),
+        .replay_path = cmd_matches.getSingleValue("replay"),
     }) catch |err| {
         std.debug.print("{}\n", .{err});
         // Returning 2 on traps, allows us to distinguish between zb failing and the bytecode execution failing.
@@ -274,11 +312,21 @@ fn handleCvm(matches: ArgMatches) !void {
             .witness_path = cmd_matches.getSingleValue("witness_path"),
             .bytecode_path = cmd_matches.getSingleValue("bytecode_path"),
             .calldata_path = cmd_matches.getSingleValue("calldata_path"),
+            .batch_path = cmd_matches.getSingleValue("batch_path"),
             .show_stats = cmd_matches.containsArg("stats"),
+            .stats_json_path = cmd_matches.getSingleValue("stats-json"),
             .show_trace = cmd_matches.containsArg("trace"),
             .debug_mode = cmd_matches.containsArg("debug"),
             .debug_dap = cmd_matches.containsArg("debug-dap"),
             .binary = cmd_matches.containsArg("binary"),
+            .memory_backend = if (cmd_matches.containsArg("compact-memory")) .compact else .flat,
+            .fuse_brillig = cmd_matches.containsArg("fuse"),
+            .brillig_cache_size = if (cmd_matches.containsArg("memoise")) 4096 else 0,
+            .parallel_blackboxes = cmd_matches.containsArg("parallel"),
+            .raw_witness = cmd_matches.containsArg("raw"),
+            .use_program_cache = !cmd_matches.containsArg("no-cache"),
+            .record_path = cmd_matches.getSingleValue("record"),
+            .replay_path = cmd_matches.getSingleValue("replay"),
         }) catch |err| {
             // std.debug.print("Exiting due to error: {}\n", .{err});
             // Returning 2 on traps, allows us to distinguish between zb failing and the bytecode execution failing.